@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+import pytest
+from django.core.cache import caches
+
+# A second, separate SQLite database standing in for a read replica, so
+# routing tests can see which database a row was actually read from
+REPLICA_ALIAS = 'replica'
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    from django.conf import settings
+
+    path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+    replica = dict(settings.DATABASES['default'], ENGINE='django.db.backends.sqlite3', NAME=path,
+                   HOST='', PORT='', USER='', PASSWORD='', OPTIONS={})
+    replica['TEST'] = dict(settings.DATABASES['default']['TEST'], NAME=path, MIRROR=None)
+    settings.DATABASES[REPLICA_ALIAS] = replica
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty caches; the shared tier lives on disk."""
+    for alias in caches:
+        caches[alias].clear()
+    yield
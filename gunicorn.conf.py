@@ -0,0 +1,135 @@
+"""
+Gunicorn configuration, read by ``gunicorn --config gunicorn.conf.py``.
+
+Worker and thread counts are derived from the CPUs this container may
+use (its CPU affinity and cgroup quota, not the host's core count) and
+capped, so a large host doesn't start dozens of processes.  Set
+``WEB_CONCURRENCY`` to choose the number of workers yourself; it is not
+capped.  Keep ``workers * threads`` (plus the job worker) within the
+database's connection limit: with ``DB_CONN_MAX_AGE`` every thread may
+hold a persistent connection.
+
+Environment variables:
+
+    PORT / GUNICORN_BIND          address to listen on (default 0.0.0.0:$PORT)
+    GUNICORN_WORKER_CLASS         sync, gthread (default) or uvicorn
+    WEB_CONCURRENCY               worker processes (default cpus + 1 for gthread, at most
+                                  4; 2 * cpus + 1 for sync and uvicorn, at most 8)
+    GUNICORN_THREADS              threads per gthread worker (default 4)
+    GUNICORN_PRELOAD              import the app once in the master (default true)
+    GUNICORN_TIMEOUT              seconds before a silent worker is killed (default 30)
+    GUNICORN_GRACEFUL_TIMEOUT     seconds workers get to finish on restart (default 30)
+    GUNICORN_MAX_REQUESTS         recycle a worker after this many requests (default 1000, 0 = never)
+    GUNICORN_LOG_LEVEL            default info
+"""
+import math
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value else default
+
+
+def _cgroup_cpu_quota():
+    """The container's CPU limit from its cgroup (v2, then v1), or None if unlimited."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """CPUs this process may actually use; os.cpu_count() reports the whole host."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+cpus = available_cpus()
+# Default worker caps; each worker costs memory and database connections
+MAX_DEFAULT_GTHREAD_WORKERS = 4
+MAX_DEFAULT_SYNC_WORKERS = 8
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+worker_type = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_class = WORKER_CLASSES.get(worker_type, worker_type)
+
+if worker_type == 'gthread':
+    # Requests mostly wait on the database; a few threads per core keep
+    # the CPU busy with fewer processes (and less memory) than sync workers
+    workers = _env_int('WEB_CONCURRENCY', min(cpus + 1, MAX_DEFAULT_GTHREAD_WORKERS))
+    threads = _env_int('GUNICORN_THREADS', 4)
+else:
+    # One request per process at a time
+    workers = _env_int('WEB_CONCURRENCY', min(cpus * 2 + 1, MAX_DEFAULT_SYNC_WORKERS))
+    threads = 1
+
+# The uvicorn worker serves the ASGI application
+wsgi_app = 'myproject.asgi:application' if worker_type == 'uvicorn' else 'myproject.wsgi:application'
+
+# Import Django once in the master and fork workers from it, so they share
+# the loaded code copy-on-write and start faster
+preload_app = _env_bool('GUNICORN_PRELOAD', True)
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+# Behind a load balancer; keep idle client connections a little longer than it polls
+keepalive = 5
+
+# Recycle workers to bound memory growth; the jitter keeps them from all
+# restarting at the same moment
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+# Heartbeat files on tmpfs, so a slow disk can't make workers look dead
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+capture_output = True
+
+
+def when_ready(server):
+    # Compile the templates once in the master; forked workers inherit them
+    if not server.cfg.preload_app:
+        return
+    from onlinecourse.rendering import warm_template_cache
+    warm_template_cache()
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading belong to the master; a forked
+    # worker must not share its sockets
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+    connections.close_all()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 import dj_database_url
 from decouple import config, Csv
@@ -67,24 +68,82 @@ INSTALLED_APPS = [
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MIDDLEWARE = [
+    # First, so the request ID and timing cover the whole stack
+    'onlinecourse.log.RequestLogMiddleware',
+    # Removes itself at startup unless TRACING_ENABLED
+    'onlinecourse.tracing.TracingMiddleware',
+    # Times every query; removes itself unless SLOW_QUERY_LOG_ENABLED
+    'onlinecourse.slowqueries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Profiles requests that ask for it with a signed header or ?_profile= from staff
+    'onlinecourse.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'myproject.urls'
 
+# Slow query log
+# Queries of a request that take SLOW_QUERY_THRESHOLD_MS or longer are
+# aggregated by fingerprint in the SlowQuery table once the response is
+# sent, with the EXPLAIN plan of the first occurrence; staff see them at
+# /onlinecourse/staff/slow-queries/.
+SLOW_QUERY_LOG_ENABLED = config('SLOW_QUERY_LOG_ENABLED', default=True, cast=bool)
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=200, cast=float)
+
+# Request profiling
+# A request is profiled when it carries an X-Profile header signed with
+# SECRET_KEY ("manage.py profile_token", valid PROFILING_TOKEN_MAX_AGE
+# seconds) or, from a staff user, ?_profile=cprofile or ?_profile=sample.
+# The newest PROFILING_MAX_FILES profiles are kept in PROFILING_DIR.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=True, cast=bool)
+PROFILING_DIR = config('PROFILING_DIR', default=os.path.join(tempfile.gettempdir(), 'onlinecourse-profiles'))
+PROFILING_MAX_FILES = config('PROFILING_MAX_FILES', default=50, cast=int)
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=3600, cast=int)
+# Seconds between stack samples of the "sample" profiler
+PROFILING_SAMPLE_INTERVAL = config('PROFILING_SAMPLE_INTERVAL', default=0.005, cast=float)
+
+# Tracing
+# Spans for requests, views, SQL queries, template renders and cache calls
+# of a TRACING_SAMPLE_RATE fraction of requests (or of requests whose
+# traceparent header says the caller's trace is sampled).  Exported in the
+# background as JSON lines to TRACING_FILE, or with TRACING_EXPORTER=otlp
+# as OTLP/JSON to a collector.  Disabled, it costs nothing measurable.
+TRACING_ENABLED = config('TRACING_ENABLED', default=False, cast=bool)
+TRACING_SAMPLE_RATE = config('TRACING_SAMPLE_RATE', default=1.0, cast=float)
+TRACING_EXPORTER = config('TRACING_EXPORTER', default='file')  # file | otlp
+TRACING_FILE = config('TRACING_FILE', default=os.path.join(tempfile.gettempdir(), 'onlinecourse-traces.jsonl'))
+TRACING_OTLP_ENDPOINT = config('TRACING_OTLP_ENDPOINT', default='http://localhost:4318/v1/traces')
+TRACING_SERVICE_NAME = config('TRACING_SERVICE_NAME', default='onlinecourse')
+
+# Template loading
+# Outside DEBUG, templates are compiled once per process and kept in memory
+# by the cached loader (gunicorn.conf.py compiles the page templates in the
+# master before forking workers).  With DEBUG on they are read from disk on
+# every render, so edits show up without a restart.
+TEMPLATE_CACHE = config('TEMPLATE_CACHE', default=not DEBUG, cast=bool)
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if TEMPLATE_CACHE:
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The traced backend records a span per render.  Django names an
+        # engine after its backend's module, so keep the name both ways.
+        'BACKEND': ('onlinecourse.tracing.DjangoTemplates' if TRACING_ENABLED
+                    else 'django.template.backends.django.DjangoTemplates'),
+        'NAME': 'django',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -102,15 +161,179 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Persistent connections: keep each worker's connection open for
+# DB_CONN_MAX_AGE seconds instead of reconnecting on every request, and
+# check it is still usable before reusing it.
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=600, cast=int)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+
 # Use PostgreSQL in production
 DATABASES = {
-    'default': dj_database_url.config(default=os.environ.get('DATABASE_URL'))
+    'default': dj_database_url.config(
+        default=os.environ.get('DATABASE_URL'),
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+    )
 }
 
 # For Azure App Service with SQLite (not recommended for production)
-if 'WEBSITE_SITE_NAME' in os.environ and not DATABASE_URL:
+if 'WEBSITE_SITE_NAME' in os.environ and not os.environ.get('DATABASE_URL'):
     DATABASES['default']['NAME'] = '/tmp/db.sqlite3'
 
+# Optional psycopg 3 connection pool (PostgreSQL only).  Django manages the
+# pool itself from 5.1 onwards; pooled connections replace persistent ones,
+# so CONN_MAX_AGE must be 0 when the pool is on.
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+if DB_POOL and DATABASES['default'].get('ENGINE') == 'django.db.backends.postgresql':
+    import django
+    from django.core.exceptions import ImproperlyConfigured
+
+    if django.VERSION < (5, 1):
+        raise ImproperlyConfigured(
+            'DB_POOL requires Django 5.1 or later (psycopg[pool] must also be installed); '
+            'use DB_CONN_MAX_AGE for persistent connections instead.'
+        )
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    }
+
+# Read replicas: a comma-separated list of database URLs, exposed as the
+# aliases replica_1, replica_2, ...  Read-only views route their queries to
+# a replica (see onlinecourse.routers); in tests replicas mirror default.
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    alias = 'replica_%d' % index
+    DATABASES[alias] = dj_database_url.parse(
+        replica_url,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+    )
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['onlinecourse.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write something
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=15, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The default cache reads through a per-process memory tier into a shared
+# tier, so workers share cached data without paying a network round trip
+# for every hot key.  The shared tier is file-based unless a Redis URL is
+# configured (CACHE_SHARED_BACKEND=redis requires the redis package).
+CACHE_SHARED_BACKEND = config('CACHE_SHARED_BACKEND', default='file')
+CACHE_SHARED_BACKENDS = {
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'onlinecourse.cache.TieredCache',
+        'OPTIONS': {
+            'LOCAL': 'local',
+            'SHARED': 'shared',
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'onlinecourse-local',
+        'TIMEOUT': config('CACHE_LOCAL_TIMEOUT', default=30, cast=int),
+        'KEY_PREFIX': config('CACHE_LOCAL_KEY_PREFIX', default='local'),
+        'VERSION': config('CACHE_VERSION', default=1, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_LOCAL_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+    'shared': {
+        'BACKEND': CACHE_SHARED_BACKENDS[CACHE_SHARED_BACKEND],
+        'LOCATION': config(
+            'CACHE_SHARED_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'onlinecourse-cache'),
+        ),
+        'TIMEOUT': config('CACHE_SHARED_TIMEOUT', default=300, cast=int),
+        'KEY_PREFIX': config('CACHE_SHARED_KEY_PREFIX', default='onlinecourse'),
+        'VERSION': config('CACHE_VERSION', default=1, cast=int),
+    },
+}
+
+
+
+# Seconds a compiled exam snapshot stays cached (it is also invalidated
+# whenever a question or choice changes)
+EXAM_SNAPSHOT_TIMEOUT = config('EXAM_SNAPSHOT_TIMEOUT', default=3600, cast=int)
+
+# Course leaderboards: entries shown, and seconds the top of a board stays cached
+LEADERBOARD_SIZE = config('LEADERBOARD_SIZE', default=50, cast=int)
+LEADERBOARD_CACHE_TIMEOUT = config('LEADERBOARD_CACHE_TIMEOUT', default=30, cast=int)
+
+# Background jobs (onlinecourse.jobs, run with `manage.py run_worker`)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_VISIBILITY_TIMEOUT = config('JOB_VISIBILITY_TIMEOUT', default=300, cast=int)
+JOB_MAX_RETRY_DELAY = config('JOB_MAX_RETRY_DELAY', default=600, cast=int)
+
+
+# Rate limiting (onlinecourse.ratelimit).  Rates are "<requests>/<s|m|h|d>"
+# per client IP, user or attempted username, scoped by URL name.
+RATELIMIT_ENABLED = config('RATELIMIT_ENABLED', default=True, cast=bool)
+RATELIMITS = {
+    'login': config('RATELIMIT_LOGIN', default='10/m'),
+    'registration': config('RATELIMIT_REGISTRATION', default='5/m'),
+    'check_username': config('RATELIMIT_CHECK_USERNAME', default='30/m'),
+    'submit': config('RATELIMIT_SUBMIT', default='10/m'),
+    'autosave': config('RATELIMIT_AUTOSAVE', default='60/m'),
+}
+# The deploy targets (Render, Azure App Service, Cloud Foundry) sit behind a
+# proxy, so REMOTE_ADDR is the proxy's address and the client's is read from
+# RATELIMIT_IP_HEADER, RATELIMIT_TRUSTED_PROXIES entries from the right.
+# Set RATELIMIT_TRUSTED_PROXIES=0 when clients connect directly.
+RATELIMIT_IP_HEADER = config('RATELIMIT_IP_HEADER', default='HTTP_X_FORWARDED_FOR')
+RATELIMIT_TRUSTED_PROXIES = config('RATELIMIT_TRUSTED_PROXIES', default=1, cast=int)
+
+# Admission control: concurrent requests per worker process allowed into
+# each pool of expensive work before further requests get a 429.
+CONCURRENCY_LIMITS = {
+    'password_hashing': config('PASSWORD_HASHING_CONCURRENCY', default=2, cast=int),
+}
+CONCURRENCY_RETRY_AFTER = config('CONCURRENCY_RETRY_AFTER', default=2, cast=int)
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+
+# PASSWORD_HASHER picks the algorithm new hashes use (pbkdf2, scrypt or
+# argon2; argon2 needs argon2-cffi).  The others stay listed so existing
+# hashes still verify; they are upgraded to the preferred algorithm and
+# current cost on the user's next login.  Compare settings with
+# `manage.py benchmark_hashers`.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_HASHING_COST = {
+    'pbkdf2_iterations': config('PBKDF2_ITERATIONS', default=600000, cast=int),
+    'scrypt_work_factor': config('SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int),
+    'scrypt_block_size': config('SCRYPT_BLOCK_SIZE', default=8, cast=int),
+    'scrypt_parallelism': config('SCRYPT_PARALLELISM', default=1, cast=int),
+    'argon2_time_cost': config('ARGON2_TIME_COST', default=2, cast=int),
+    'argon2_memory_cost': config('ARGON2_MEMORY_COST', default=102400, cast=int),
+    'argon2_parallelism': config('ARGON2_PARALLELISM', default=8, cast=int),
+}
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'onlinecourse.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'onlinecourse.hashers.ScryptPasswordHasher',
+    'argon2': 'onlinecourse.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -156,10 +379,24 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# Ensure media files are properly served in production
+# Course image variants (onlinecourse.images): square crops at these widths,
+# in WebP and JPEG, generated on upload or on first use
+COURSE_IMAGE_WIDTHS = config('COURSE_IMAGE_WIDTHS', default='240,480', cast=Csv(int))
+COURSE_IMAGE_QUALITY = config('COURSE_IMAGE_QUALITY', default=80, cast=int)
+
+# Media is served by onlinecourse.media.serve_media.  Uploads are stored
+# under content-hashed names, which are served as immutable.
+# MEDIA_SERVE_MODE: 'django' streams files (with range support);
+# 'x-accel-redirect' (nginx) or 'x-sendfile' hands them to the web server.
+MEDIA_SERVE_MODE = config('MEDIA_SERVE_MODE', default='django')
+# nginx "internal" location aliased to MEDIA_ROOT, for x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+# Cache lifetime of media without a content hash in the name
+MEDIA_MAX_AGE = config('MEDIA_MAX_AGE', default=3600, cast=int)
+
 STORAGES = {
     'default': {
-        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'BACKEND': 'onlinecourse.media.HashedMediaStorage',
     },
     'staticfiles': {
         'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
@@ -167,30 +404,41 @@ STORAGES = {
 }
 
 # Logging Configuration
+# Console only: platform log collectors read stdout/stderr, and no files
+# or directories are touched while settings load.  Records are written by a
+# background thread from a bounded queue (LOG_QUEUE_SIZE), so a slow
+# stderr never blocks a request; when the queue is full they are dropped.
+# LOG_FORMAT is "json" (one object per line, for the collector) or "text".
+# DEBUG records of onlinecourse are kept for a random LOG_DEBUG_SAMPLE_RATE
+# fraction of requests; every record carries the request's X-Request-ID.
+LOG_FORMAT = config('LOG_FORMAT', default='text' if DEBUG else 'json')
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_DEBUG_SAMPLE_RATE = config('LOG_DEBUG_SAMPLE_RATE', default=1.0 if DEBUG else 0.01, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
-            'style': '{',
+        'json': {
+            '()': 'onlinecourse.log.JsonFormatter',
         },
-        'simple': {
-            'format': '{levelname} {message}',
+        'text': {
+            'format': '{levelname} {asctime} {request_id} {module} {message}',
             'style': '{',
         },
     },
+    'filters': {
+        'request_context': {
+            '()': 'onlinecourse.log.RequestContextFilter',
+            'sample_rate': LOG_DEBUG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
-        },
-        'file': {
-            'class': 'logging.handlers.RotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'django.log'),
-            'maxBytes': 1024 * 1024 * 10,  # 10 MB
-            'backupCount': 5,
-            'formatter': 'verbose',
+            'class': 'onlinecourse.log.QueueStreamHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'text',
+            'filters': ['request_context'],
+            'queue_size': LOG_QUEUE_SIZE,
         },
     },
     'root': {
@@ -210,20 +458,13 @@ LOGGING = {
         },
         'onlinecourse': {
             'handlers': ['console'],
-            'level': 'INFO' if not DEBUG else 'DEBUG',
+            # Unsampled DEBUG records are dropped by the request_context filter
+            'level': 'DEBUG' if DEBUG or LOG_DEBUG_SAMPLE_RATE > 0 else 'INFO',
             'propagate': False,
         },
     },
 }
 
-# Create logs directory if it doesn't exist
-LOGS_DIR = os.path.join(BASE_DIR, 'logs')
-if not os.path.exists(LOGS_DIR):
-    try:
-        os.makedirs(LOGS_DIR)
-    except OSError:
-        pass  # Directory creation failed, use console logging only
-
 # Additional Security Settings for Production
 if not DEBUG:
     # HSTS Settings
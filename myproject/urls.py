@@ -13,11 +13,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import include, path
-from django.conf.urls.static import static
+from django.urls import include, path, re_path
 from django.conf import settings
 from django.views.generic import RedirectView
+from onlinecourse.media import serve_media
 
 urlpatterns = [
     # Root URL redirects to course list
@@ -34,4 +36,7 @@ urlpatterns = [
     path('register/', RedirectView.as_view(url='/onlinecourse/registration/', permanent=True)),
     path('login/', RedirectView.as_view(url='/onlinecourse/login/', permanent=True)),
     path('logout/', RedirectView.as_view(url='/onlinecourse/logout/', permanent=True)),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+    # Uploaded media (see onlinecourse.media)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
@@ -1,45 +1,209 @@
-from django.contrib import admin
+from collections import defaultdict
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.forms import formset_factory
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 # <HINT> Import any new Models here
-from .models import Course, Lesson, Instructor, Learner, Question, Choice, Submission
+from .models import Course, Lesson, Instructor, Learner, QuestionPool, Question, Choice, Submission, ExamAttempt, Job
+from .forms import ChoiceRowForm, QuestionRowForm
+from .paginators import EstimatedCountPaginator
+from .snapshots import deferred_invalidation, invalidate_exam_snapshot
 
 # <HINT> Register QuestionInline and ChoiceInline classes here
-class ChoiceInline(admin.StackedInline):
+class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 2
 
-class QuestionInline(admin.StackedInline):
+# Not attached to CourseAdmin: courses with hundreds of questions are edited
+# with the paginated bulk question editor instead
+class QuestionInline(admin.TabularInline):
     model = Question
     extra = 2
 
 
 class LessonInline(admin.StackedInline):
     model = Lesson
-    extra = 5
+    extra = 1
+
+
+class DeferredInvalidationMixin:
+    """Invalidate exam snapshots once per admin save, not once per saved row."""
+
+    def changeform_view(self, *args, **kwargs):
+        with deferred_invalidation():
+            return super().changeform_view(*args, **kwargs)
+
+    def changelist_view(self, *args, **kwargs):
+        with deferred_invalidation():
+            return super().changelist_view(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        with deferred_invalidation():
+            return super().delete_view(*args, **kwargs)
 
 
 # Register your models here.
-class CourseAdmin(admin.ModelAdmin):
+class CourseAdmin(DeferredInvalidationMixin, admin.ModelAdmin):
     inlines = [LessonInline]
-    list_display = ('name', 'pub_date')
+    list_display = ('name', 'pub_date', 'question_editor')
     list_filter = ['pub_date']
     search_fields = ['name', 'description']
+    questions_per_page = 50
+
+    @admin.display(description='Questions')
+    def question_editor(self, course):
+        return format_html('<a href="{}">Edit questions</a>',
+                           reverse('admin:onlinecourse_course_questions', args=[course.pk]))
+
+    def get_urls(self):
+        return [
+            path('<path:object_id>/questions/', self.admin_site.admin_view(self.questions_view),
+                 name='onlinecourse_course_questions'),
+        ] + super().get_urls()
+
+    def questions_view(self, request, object_id):
+        """
+        Edit a page of a course's questions and their choices in one form.
+        Only rows that changed are written, with one bulk_update per model,
+        and the course's exam snapshot is invalidated once.
+        """
+        course = self.get_object(request, object_id)
+        if course is None:
+            return self._get_obj_does_not_exist_redirect(request, self.opts, object_id)
+        if not self.has_change_permission(request, course):
+            raise PermissionDenied
+
+        page = Paginator(course.question_set.order_by('id').values('id', 'content', 'grade', 'pool'),
+                         self.questions_per_page).get_page(request.GET.get('page'))
+        questions = list(page)
+        choices = list(Choice.objects.filter(question_id__in=[q['id'] for q in questions])
+                       .order_by('question_id', 'id').values('id', 'question_id', 'content', 'is_correct'))
+        pool_choices = list(course.questionpool_set.order_by('name').values_list('id', 'name'))
+
+        QuestionFormSet = formset_factory(QuestionRowForm, extra=0)
+        ChoiceFormSet = formset_factory(ChoiceRowForm, extra=0)
+        data = request.POST if request.method == 'POST' else None
+        question_forms = QuestionFormSet(data, initial=questions, prefix='questions',
+                                         form_kwargs={'pool_choices': pool_choices})
+        choice_forms = ChoiceFormSet(data, initial=choices, prefix='choices')
+
+        if data is not None and question_forms.is_valid() and choice_forms.is_valid():
+            changed_questions = [
+                Question(pk=form.cleaned_data['id'], content=form.cleaned_data['content'],
+                         grade=form.cleaned_data['grade'], pool_id=form.cleaned_data['pool'])
+                for form in question_forms if form.has_changed()]
+            changed_choices = [
+                Choice(pk=form.cleaned_data['id'], content=form.cleaned_data['content'],
+                       is_correct=form.cleaned_data['is_correct'])
+                for form in choice_forms if form.has_changed()]
+            if changed_questions or changed_choices:
+                with transaction.atomic():
+                    Question.objects.bulk_update(changed_questions, ['content', 'grade', 'pool'])
+                    Choice.objects.bulk_update(changed_choices, ['content', 'is_correct'])
+                # bulk_update sends no signals; invalidate once for the whole page
+                invalidate_exam_snapshot(course.pk)
+            self.message_user(request, 'Saved %d question(s) and %d choice(s).' % (
+                len(changed_questions), len(changed_choices)), messages.SUCCESS)
+            return HttpResponseRedirect(request.get_full_path())
+
+        # Group each question's choice rows under it
+        choice_rows = defaultdict(list)
+        for form in choice_forms:
+            choice_rows[form.initial.get('question_id')].append(form)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.opts,
+            'title': 'Edit questions: %s' % course.name,
+            'course': course,
+            'page_obj': page,
+            'rows': [(form, choice_rows[form.initial.get('id')]) for form in question_forms],
+            'question_forms': question_forms,
+            'choice_forms': choice_forms,
+        }
+        return TemplateResponse(request, 'admin/onlinecourse/course/questions.html', context)
 
 
 class LessonAdmin(admin.ModelAdmin):
     list_display = ['title']
 
 
-class QuestionAdmin(admin.ModelAdmin):
+class InstructorAdmin(admin.ModelAdmin):
+    list_display = ['user', 'full_time', 'total_learners']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['user__username']
+
+
+class LearnerAdmin(admin.ModelAdmin):
+    list_display = ['user', 'occupation']
+    list_select_related = ['user']
+    list_filter = ['occupation']
+    raw_id_fields = ['user']
+    search_fields = ['user__username']
+
+
+class QuestionPoolAdmin(DeferredInvalidationMixin, admin.ModelAdmin):
+    list_display = ['name', 'course', 'sample_size']
+
+
+class QuestionAdmin(DeferredInvalidationMixin, admin.ModelAdmin):
     inlines = [ChoiceInline]
-    list_display = ['content']
+    list_display = ['content', 'pool']
+    list_select_related = ['pool']
+    # Used by the autocomplete widgets that point at questions
+    search_fields = ['content']
+
+
+class ChoiceAdmin(DeferredInvalidationMixin, admin.ModelAdmin):
+    list_display = ['content', 'question', 'is_correct']
+    list_select_related = ['question']
+    autocomplete_fields = ['question']
+    search_fields = ['content']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+# Large tables: no select boxes listing every row, no full-table counts
+class SubmissionAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'score', 'graded_at']
+    # Submission.__str__ follows enrollment to the user and the course
+    list_select_related = ['enrollment__user', 'enrollment__course']
+    raw_id_fields = ['enrollment', 'choices']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ExamAttemptAdmin(admin.ModelAdmin):
+    list_display = ['enrollment', 'course', 'started_at', 'deadline', 'state']
+    list_select_related = ['course']
+    list_filter = ['state']
+    raw_id_fields = ['enrollment', 'submission']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'queue', 'status', 'attempts', 'run_after', 'finished_at']
+    list_filter = ['status', 'queue', 'task']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # <HINT> Register Question and Choice models here
 
 admin.site.register(Course, CourseAdmin)
 admin.site.register(Lesson, LessonAdmin)
-admin.site.register(Instructor)
-admin.site.register(Learner)
+admin.site.register(Instructor, InstructorAdmin)
+admin.site.register(Learner, LearnerAdmin)
+admin.site.register(QuestionPool, QuestionPoolAdmin)
 admin.site.register(Question, QuestionAdmin)
-admin.site.register(Choice)
-admin.site.register(Submission)
+admin.site.register(Choice, ChoiceAdmin)
+admin.site.register(Submission, SubmissionAdmin)
+admin.site.register(ExamAttempt, ExamAttemptAdmin)
+admin.site.register(Job, JobAdmin)
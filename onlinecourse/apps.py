@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class OnlinecourseConfig(AppConfig):
     name = 'onlinecourse'
+
+    def ready(self):
+        # Register background job handlers and model signal receivers
+        from . import signals, tasks  # noqa: F401
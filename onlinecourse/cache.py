@@ -0,0 +1,183 @@
+"""
+Two-tier cache backend and versioned-key helpers.
+
+The ``default`` cache alias is a :class:`TieredCache` that fronts a shared
+tier (file-based or Redis) with a per-process local memory tier.  Reads are
+served from the local tier when possible, writes go to both tiers.  Each tier
+is an ordinary entry in ``settings.CACHES`` so it keeps its own TIMEOUT,
+KEY_PREFIX and VERSION.
+
+Groups of keys can be invalidated together by bumping a namespace version
+that lives in the shared tier, see :func:`versioned_key` and
+:func:`invalidate`.
+"""
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .tracing import span
+
+LOCAL_ALIAS = 'local'
+SHARED_ALIAS = 'shared'
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend that reads through a local tier into a shared tier.
+
+    OPTIONS:
+        LOCAL  -- alias of the local (per-process) cache, default ``local``
+        SHARED -- alias of the shared cache, default ``shared``
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._local_alias = options.get('LOCAL', LOCAL_ALIAS)
+        self._shared_alias = options.get('SHARED', SHARED_ALIAS)
+
+    @property
+    def local(self):
+        return caches[self._local_alias]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_timeout(self, timeout):
+        # The local tier never outlives its own TIMEOUT, so other workers'
+        # writes become visible after at most that long.
+        local_timeout = self.local.default_timeout
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+        if timeout is None:
+            return local_timeout
+        if local_timeout is None:
+            return timeout
+        return min(timeout, local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with span('cache.add', **{'cache.key': key}):
+            added = self.shared.add(key, value, timeout, version)
+            if added:
+                self.local.set(key, value, self._local_timeout(timeout), version)
+            return added
+
+    def get(self, key, default=None, version=None):
+        with span('cache.get', **{'cache.key': key}) as current:
+            sentinel = object()
+            value = self.local.get(key, sentinel, version)
+            if value is not sentinel:
+                current.set_attribute('cache.hit', 'local')
+                return value
+            value = self.shared.get(key, sentinel, version)
+            if value is sentinel:
+                current.set_attribute('cache.hit', 'miss')
+                return default
+            current.set_attribute('cache.hit', 'shared')
+            self.local.set(key, value, self._local_timeout(DEFAULT_TIMEOUT), version)
+            return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with span('cache.set', **{'cache.key': key}):
+            self.shared.set(key, value, timeout, version)
+            self.local.set(key, value, self._local_timeout(timeout), version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.touch(key, self._local_timeout(timeout), version)
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        with span('cache.delete', **{'cache.key': key}):
+            self.local.delete(key, version)
+            return self.shared.delete(key, version)
+
+    def get_many(self, keys, version=None):
+        with span('cache.get_many', **{'cache.keys': len(keys)}):
+            found = self.local.get_many(keys, version)
+            missing = [key for key in keys if key not in found]
+            if missing:
+                from_shared = self.shared.get_many(missing, version)
+                if from_shared:
+                    self.local.set_many(from_shared, self._local_timeout(DEFAULT_TIMEOUT), version)
+                found.update(from_shared)
+            return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        with span('cache.set_many', **{'cache.keys': len(data)}):
+            failed = self.shared.set_many(data, timeout, version)
+            self.local.set_many(data, self._local_timeout(timeout), version)
+            return failed
+
+    def delete_many(self, keys, version=None):
+        self.local.delete_many(keys, version)
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version) or self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        # Counters only live in the shared tier; a locally cached copy
+        # would be stale the moment another worker increments it.
+        with span('cache.incr', **{'cache.key': key}):
+            self.local.delete(key, version)
+            return self.shared.incr(key, delta, version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.local.close(**kwargs)
+        self.shared.close(**kwargs)
+
+
+def _namespace_key(namespace):
+    return 'ns-version:%s' % namespace
+
+
+def _initial_version():
+    # Seeding from the clock rather than 1 means a version counter that was
+    # culled from the shared tier never re-addresses entries written under
+    # an earlier incarnation of the same counter.
+    return int(time.time())
+
+
+def get_namespace_version(namespace):
+    """Return the current version of a key namespace."""
+    shared = caches[SHARED_ALIAS]
+    version = shared.get(_namespace_key(namespace))
+    if version is None:
+        shared.add(_namespace_key(namespace), _initial_version(), None)
+        version = shared.get(_namespace_key(namespace))
+    return version
+
+
+def versioned_key(namespace, *parts, version=None):
+    """
+    Build a cache key that is invalidated by :func:`invalidate`.
+
+    Pass ``version`` when the caller has already read the namespace version.
+    """
+    if version is None:
+        version = get_namespace_version(namespace)
+    return ':'.join([namespace, 'v%s' % version] + [str(part) for part in parts])
+
+
+def invalidate(namespace):
+    """
+    Invalidate every key built with ``versioned_key(namespace, ...)``.
+
+    Old entries are not deleted, they simply stop being addressed and
+    expire with their tier's TIMEOUT.
+    """
+    shared = caches[SHARED_ALIAS]
+    try:
+        return shared.incr(_namespace_key(namespace))
+    except ValueError:
+        # Nobody has read this namespace yet (or its counter was culled),
+        # so there is nothing cached under it to invalidate.
+        version = _initial_version()
+        shared.set(_namespace_key(namespace), version, None)
+        return version
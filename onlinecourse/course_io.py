@@ -0,0 +1,178 @@
+"""
+Course import and export.
+
+A course is written as one document::
+
+    {"name": ..., "description": ..., "image": ..., "pub_date": "2024-01-31",
+     "exam_duration": null, "max_active_attempts": null,
+     "instructors": ["<username>", ...],
+     "lessons": [{"title": ..., "order": 0, "content": ...}, ...],
+     "pools": [{"name": ..., "sample_size": 1}, ...],
+     "questions": [{"content": ..., "grade": 50, "pool": "<pool name>" or null,
+                    "choices": [{"content": ..., "is_correct": false}, ...]}, ...]}
+
+in JSON or YAML (YAML needs PyYAML).  Export streams questions and choices
+from two ordered cursors, so memory use doesn't grow with the question
+bank.  Import creates each table's rows with one ``bulk_create`` in
+dependency order, inside a single transaction.
+"""
+import datetime
+import json
+
+from django.db import transaction
+
+from .models import Choice, Course, Instructor, Lesson, Question, QuestionPool
+from .routers import replica_reads
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+FORMATS = ('json', 'yaml')
+COURSE_FIELDS = ('name', 'description', 'image', 'pub_date', 'exam_duration', 'max_active_attempts')
+BATCH_SIZE = 500
+
+
+class CourseFormatError(ValueError):
+    pass
+
+
+def _require_yaml():
+    if yaml is None:
+        raise CourseFormatError('YAML support requires the PyYAML package.')
+
+
+def _course_header(course):
+    return {
+        'name': course.name,
+        'description': course.description,
+        'image': course.image.name or '',
+        'pub_date': course.pub_date.isoformat() if course.pub_date else None,
+        'exam_duration': course.exam_duration,
+        'max_active_attempts': course.max_active_attempts,
+        'instructors': list(course.instructors.order_by('id').values_list('user__username', flat=True)),
+        'lessons': list(course.lesson_set.order_by('order', 'id').values('title', 'order', 'content')),
+        'pools': list(course.questionpool_set.order_by('id').values('name', 'sample_size')),
+    }
+
+
+def iter_questions(course):
+    """Yield each question of ``course`` with its choices, reading both tables with cursors."""
+    pools = dict(course.questionpool_set.values_list('id', 'name'))
+    choices = (Choice.objects.filter(question__course=course).order_by('question_id', 'id')
+               .values_list('question_id', 'content', 'is_correct').iterator(chunk_size=BATCH_SIZE))
+    pending = next(choices, None)
+    questions = (Question.objects.filter(course=course).order_by('id')
+                 .values_list('id', 'content', 'grade', 'pool_id').iterator(chunk_size=BATCH_SIZE))
+    for question_id, content, grade, pool_id in questions:
+        question_choices = []
+        # Both cursors are ordered by question id, so a question's choices are next in line
+        while pending is not None and pending[0] == question_id:
+            question_choices.append({'content': pending[1], 'is_correct': pending[2]})
+            pending = next(choices, None)
+        yield {'content': content, 'grade': grade, 'pool': pools.get(pool_id), 'choices': question_choices}
+
+
+def export_course(course, stream, fmt='json'):
+    """Write ``course`` to the text ``stream`` one question at a time."""
+    if fmt == 'yaml':
+        _require_yaml()
+    with replica_reads():
+        header = _course_header(course)
+        if fmt == 'json':
+            stream.write(json.dumps(header, indent=1)[:-2])
+            stream.write(',\n "questions": [')
+            for index, question in enumerate(iter_questions(course)):
+                stream.write(',\n  ' if index else '\n  ')
+                stream.write(json.dumps(question))
+            stream.write('\n ]\n}\n')
+        else:
+            stream.write(yaml.safe_dump(header, sort_keys=False, allow_unicode=True))
+            stream.write('questions:\n')
+            for question in iter_questions(course):
+                stream.write(yaml.safe_dump([question], sort_keys=False, allow_unicode=True))
+
+
+def load_course(stream, fmt='json'):
+    """Parse a course document from ``stream``."""
+    if fmt == 'json':
+        try:
+            data = json.load(stream)
+        except ValueError as e:
+            raise CourseFormatError('Invalid JSON: %s' % e)
+    else:
+        _require_yaml()
+        try:
+            data = yaml.safe_load(stream)
+        except yaml.YAMLError as e:
+            raise CourseFormatError('Invalid YAML: %s' % e)
+    if not isinstance(data, dict):
+        raise CourseFormatError('A course document must be a mapping.')
+    return data
+
+
+def import_course(data):
+    """Create a new course from a parsed course document and return it."""
+    try:
+        usernames = data.get('instructors', [])
+        instructors = list(Instructor.objects.filter(user__username__in=usernames).select_related('user'))
+        missing = set(usernames) - {instructor.user.username for instructor in instructors}
+        if missing:
+            raise CourseFormatError('Unknown instructor(s): %s' % ', '.join(sorted(missing)))
+
+        course = Course(**{field: data[field] for field in COURSE_FIELDS if field in data})
+        if isinstance(course.pub_date, str):
+            course.pub_date = datetime.date.fromisoformat(course.pub_date)
+        lessons = [Lesson(title=lesson['title'], order=lesson.get('order', index), content=lesson['content'])
+                   for index, lesson in enumerate(data.get('lessons', []))]
+        pools = [QuestionPool(name=pool['name'], sample_size=pool.get('sample_size', 1))
+                 for pool in data.get('pools', [])]
+        questions = [(Question(content=question['content'], grade=question.get('grade', 50)),
+                      question.get('pool'), question.get('choices', []))
+                     for question in data.get('questions', [])]
+    except CourseFormatError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise CourseFormatError('Malformed course document: %r' % e)
+
+    with transaction.atomic():
+        course.save()
+        course.instructors.set(instructors)
+        for lesson in lessons:
+            lesson.course = course
+        Lesson.objects.bulk_create(lessons, batch_size=BATCH_SIZE)
+
+        for pool in pools:
+            pool.course = course
+        _bulk_create(QuestionPool, pools, course)
+        pools_by_name = {pool.name: pool for pool in pools}
+
+        for question, pool_name, _ in questions:
+            question.course = course
+            if pool_name is not None:
+                if pool_name not in pools_by_name:
+                    raise CourseFormatError('Unknown pool: %s' % pool_name)
+                question.pool = pools_by_name[pool_name]
+        _bulk_create(Question, [question for question, _, _ in questions], course)
+
+        try:
+            choices = [Choice(question=question, content=choice['content'],
+                              is_correct=choice.get('is_correct', False))
+                       for question, _, question_choices in questions for choice in question_choices]
+        except (KeyError, TypeError) as e:
+            raise CourseFormatError('Malformed choice: %r' % e)
+        Choice.objects.bulk_create(choices, batch_size=BATCH_SIZE)
+    return course
+
+
+def _bulk_create(model, objs, course):
+    """
+    ``bulk_create`` rows that later rows refer to.  Backends that can't
+    return the new primary keys from a bulk insert get them read back in
+    insertion order.
+    """
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    if objs and objs[0].pk is None:
+        for obj, pk in zip(objs, model.objects.filter(course=course).order_by('id').values_list('id', flat=True)):
+            obj.pk = pk
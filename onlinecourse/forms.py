@@ -0,0 +1,29 @@
+from django import forms
+
+
+# Rows of the admin bulk question editor.  Plain forms rather than model
+# forms: validating a page of rows must not query the database per row.
+class QuestionRowForm(forms.Form):
+    id = forms.IntegerField(widget=forms.HiddenInput)
+    content = forms.CharField(max_length=200, widget=forms.TextInput(attrs={'size': 60}))
+    grade = forms.IntegerField(widget=forms.NumberInput(attrs={'style': 'width: 5em'}))
+    pool = forms.TypedChoiceField(coerce=int, empty_value=None, required=False)
+
+    def __init__(self, *args, pool_choices=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['pool'].choices = [('', '---------')] + list(pool_choices)
+
+    def clean_id(self):
+        # Rows are matched to the page by position; refuse to save over a
+        # different row if the page changed since it was rendered
+        if self.cleaned_data['id'] != self.initial.get('id'):
+            raise forms.ValidationError('This page changed since it was loaded; reload it and try again.')
+        return self.cleaned_data['id']
+
+
+class ChoiceRowForm(forms.Form):
+    id = forms.IntegerField(widget=forms.HiddenInput)
+    content = forms.CharField(max_length=200, widget=forms.TextInput(attrs={'size': 60}))
+    is_correct = forms.BooleanField(required=False)
+
+    clean_id = QuestionRowForm.clean_id
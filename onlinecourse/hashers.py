@@ -0,0 +1,56 @@
+"""
+Password hashers whose cost comes from ``settings.PASSWORD_HASHING_COST``.
+
+They keep Django's algorithm names, so existing hashes stay valid.  When
+the configured cost changes (or a different algorithm is preferred in
+``PASSWORD_HASHERS``), Django re-hashes a user's password on their next
+successful login.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+def _cost(name):
+    return settings.PASSWORD_HASHING_COST[name]
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return _cost('pbkdf2_iterations')
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return _cost('scrypt_work_factor')
+
+    @property
+    def block_size(self):
+        return _cost('scrypt_block_size')
+
+    @property
+    def parallelism(self):
+        return _cost('scrypt_parallelism')
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * N * r bytes; leave room for verifying hashes
+        # made with a previous, higher work factor.
+        return max(64 * 1024 * 1024, 256 * self.work_factor * self.block_size)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Requires the argon2-cffi package."""
+
+    @property
+    def time_cost(self):
+        return _cost('argon2_time_cost')
+
+    @property
+    def memory_cost(self):
+        return _cost('argon2_memory_cost')
+
+    @property
+    def parallelism(self):
+        return _cost('argon2_parallelism')
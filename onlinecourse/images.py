@@ -0,0 +1,104 @@
+"""
+Resized variants of course images.
+
+Each original gets a square crop per width in ``settings.COURSE_IMAGE_WIDTHS``,
+as WebP (when Pillow supports it) and JPEG.  Variants are stored next to
+the uploads under names derived from a hash of the original's content,
+``course_images/variants/<hash>-<width>.<ext>``, so they never change once
+written and can be cached by browsers indefinitely.
+
+Variants are generated when a course image is uploaded (see
+``signals.py``), or on first use for images uploaded before.  The mapping
+from an original's name to its variants is kept in the cache.  Pillow is
+only imported once an image is actually processed, so loading the app
+doesn't pay for it.
+"""
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'course_images/variants'
+VARIANTS_CACHE_TIMEOUT = 24 * 60 * 60
+# Pillow format name, file extension, MIME type
+FORMATS = [
+    ('WEBP', 'webp', 'image/webp'),
+    ('JPEG', 'jpg', 'image/jpeg'),
+]
+
+
+def _formats():
+    from PIL import features
+    return [fmt for fmt in FORMATS if fmt[0] != 'WEBP' or features.check('webp')]
+
+
+def _content_hash(field_file):
+    digest = hashlib.sha256()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()[:16]
+
+
+def generate_variants(field_file):
+    """
+    Write any missing variants of ``field_file`` to its storage and return
+    ``{mime type: [(name, width), ...]}``, in preference order.
+    """
+    from PIL import Image, ImageOps
+
+    storage = field_file.storage
+    content_hash = _content_hash(field_file)
+    variants = {}
+    image = None
+    try:
+        for pil_format, extension, mime_type in _formats():
+            variants[mime_type] = []
+            for width in sorted(settings.COURSE_IMAGE_WIDTHS):
+                name = posixpath.join(VARIANTS_DIR, '%s-%d.%s' % (content_hash, width, extension))
+                if not storage.exists(name):
+                    if image is None:
+                        field_file.open('rb')
+                        image = ImageOps.exif_transpose(Image.open(field_file))
+                    variant = ImageOps.fit(image, (width, width), Image.LANCZOS)
+                    if pil_format == 'JPEG' and variant.mode != 'RGB':
+                        variant = variant.convert('RGB')
+                    buffer = BytesIO()
+                    variant.save(buffer, pil_format, quality=settings.COURSE_IMAGE_QUALITY)
+                    name = storage.save(name, ContentFile(buffer.getvalue()))
+                variants[mime_type].append((name, width))
+    finally:
+        if image is not None:
+            field_file.close()
+    return variants
+
+
+def get_variants(field_file):
+    """
+    Return the variants of ``field_file`` as ``generate_variants`` does,
+    generating them on first use, or None if it isn't a readable image.
+    """
+    if not field_file:
+        return None
+    from PIL import Image
+
+    key = 'course_image_variants:%s' % hashlib.sha1(field_file.name.encode()).hexdigest()
+    variants = cache.get(key)
+    if variants is None:
+        try:
+            variants = generate_variants(field_file)
+        except (OSError, Image.DecompressionBombError):
+            logger.warning('Could not create variants of %s', field_file.name, exc_info=True)
+            # Remember the failure too, so an unreadable upload isn't reopened on every render
+            variants = {}
+        cache.set(key, variants, VARIANTS_CACHE_TIMEOUT)
+    return variants or None
@@ -0,0 +1,158 @@
+"""
+A small database-backed job queue.
+
+Work is enqueued with :func:`enqueue` and executed by the ``run_worker``
+management command.  Workers claim jobs with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` where the database supports it (PostgreSQL); elsewhere (SQLite)
+each candidate is claimed with a conditional UPDATE, which is safe because
+SQLite serialises writers.
+
+A claimed job is locked for a visibility timeout.  If the worker dies the
+lock expires and another worker picks the job up again.  Failed jobs are
+retried with exponential backoff until ``max_attempts`` is reached; that
+includes jobs whose worker died or hung, so a job that kills its worker
+isn't retried forever.
+"""
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name):
+    """Register a function as a job handler under ``name``."""
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def get_task(name):
+    return _registry.get(name)
+
+
+def enqueue(task_name, payload=None, idempotency_key=None, delay=0,
+            queue='default', max_attempts=None):
+    """
+    Queue a job and return it.
+
+    With an ``idempotency_key`` the job is only queued once; enqueueing the
+    same key again returns the existing job.
+    """
+    job = Job(
+        queue=queue,
+        task=task_name,
+        payload=payload or {},
+        idempotency_key=idempotency_key,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+    if idempotency_key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=idempotency_key)
+    return job
+
+
+def worker_id():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def _available(now):
+    return (Q(status=Job.QUEUED, run_after__lte=now) |
+            Q(status=Job.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')))
+
+
+def fail_abandoned(queue, now):
+    """Fail running jobs whose lock expired on their last attempt.  Returns how many."""
+    failed = Job.objects.filter(
+        queue=queue, status=Job.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts'),
+    ).update(status=Job.FAILED, locked_until=None, finished_at=now,
+             last_error='Lock expired on the last attempt; the worker died or hung')
+    if failed:
+        logger.error("Failed %d job(s) abandoned on their last attempt", failed)
+    return failed
+
+
+def claim(queue='default', batch_size=10, visibility_timeout=None, worker=None):
+    """Lock up to ``batch_size`` runnable jobs for this worker and return them."""
+    worker = worker or worker_id()
+    visibility_timeout = visibility_timeout or settings.JOB_VISIBILITY_TIMEOUT
+    now = timezone.now()
+    lock = {
+        'status': Job.RUNNING,
+        'locked_by': worker,
+        'locked_until': now + timedelta(seconds=visibility_timeout),
+        'attempts': F('attempts') + 1,
+    }
+    fail_abandoned(queue, now)
+    candidates = Job.objects.filter(_available(now), queue=queue).order_by('run_after', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True)
+                       .values_list('id', flat=True)[:batch_size])
+            Job.objects.filter(id__in=ids).update(**lock)
+    else:
+        ids = []
+        for job_id in candidates.values_list('id', flat=True)[:batch_size]:
+            # Only one worker's UPDATE can still match the availability check.
+            if Job.objects.filter(_available(now), id=job_id).update(**lock):
+                ids.append(job_id)
+
+    return list(Job.objects.filter(id__in=ids, locked_by=worker).order_by('run_after', 'id'))
+
+
+def _retry_delay(attempts):
+    return min(2 ** attempts, settings.JOB_MAX_RETRY_DELAY)
+
+
+def run(job):
+    """Execute a claimed job and record the outcome.  Returns True on success."""
+    # Only touch the row while we still own the lock.
+    owned = Job.objects.filter(id=job.id, locked_by=job.locked_by, status=Job.RUNNING)
+    func = get_task(job.task)
+    if func is None:
+        owned.update(status=Job.FAILED, locked_until=None, finished_at=timezone.now(),
+                     last_error='Unknown task %r' % job.task)
+        logger.error("Job %s failed: unknown task %r", job.id, job.task)
+        return False
+    try:
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            owned.update(status=Job.FAILED, locked_until=None,
+                         finished_at=timezone.now(), last_error=error)
+            logger.error("Job %s (%s) failed after %d attempts", job.id, job.task, job.attempts)
+        else:
+            owned.update(status=Job.QUEUED, locked_until=None, last_error=error,
+                         run_after=timezone.now() + timedelta(seconds=_retry_delay(job.attempts)))
+            logger.warning("Job %s (%s) failed, will retry", job.id, job.task)
+        return False
+    owned.update(status=Job.DONE, locked_until=None, finished_at=timezone.now())
+    return True
+
+
+def run_pending(queue='default', batch_size=10, visibility_timeout=None, worker=None):
+    """Claim and run one batch of jobs.  Returns the number of jobs claimed."""
+    jobs = claim(queue, batch_size, visibility_timeout, worker)
+    for job in jobs:
+        run(job)
+    return len(jobs)
@@ -0,0 +1,63 @@
+"""
+Per-course leaderboards.
+
+Each learner's best score in a course is kept in one
+:class:`~onlinecourse.models.LeaderboardEntry` row.  When a submission is
+graded, :func:`record_score` upserts it with a single
+``INSERT ... ON CONFLICT DO UPDATE ... WHERE`` that only replaces a lower
+score, so concurrent gradings can't overwrite a better result.
+
+Ranks use standard competition ranking (equal scores share a rank):
+:func:`get_rank` counts the entries with a higher score, a range scan of
+the ``(course, -best_score, achieved_at)`` index that doesn't sort
+anything.  The top of the board is cached for
+``LEADERBOARD_CACHE_TIMEOUT`` seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import LeaderboardEntry
+
+
+def _top_key(course_id):
+    return 'leaderboard:%d:top' % course_id
+
+
+def record_score(course_id, user_id, score, achieved_at):
+    """Keep ``score`` as the learner's best in the course if it beats their current best."""
+    table = connection.ops.quote_name(LeaderboardEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {table} (course_id, user_id, best_score, achieved_at) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (course_id, user_id) DO UPDATE '
+            'SET best_score = EXCLUDED.best_score, achieved_at = EXCLUDED.achieved_at '
+            'WHERE {table}.best_score < EXCLUDED.best_score'.format(table=table),
+            [course_id, user_id, score, achieved_at])
+
+
+def get_rank(course_id, user_id):
+    """Return ``(rank, best_score)`` of a learner in a course, or None if they have no graded submission."""
+    best_score = (LeaderboardEntry.objects.filter(course_id=course_id, user_id=user_id)
+                  .values_list('best_score', flat=True).first())
+    if best_score is None:
+        return None
+    ahead = LeaderboardEntry.objects.filter(course_id=course_id, best_score__gt=best_score).count()
+    return ahead + 1, best_score
+
+
+def top_entries(course_id):
+    """Return the top ``LEADERBOARD_SIZE`` entries as ``[{rank, username, score}]``, cached briefly."""
+    key = _top_key(course_id)
+    entries = cache.get(key)
+    if entries is None:
+        rows = (LeaderboardEntry.objects.filter(course_id=course_id)
+                .order_by('-best_score', 'achieved_at')
+                .values_list('user__username', 'best_score')[:settings.LEADERBOARD_SIZE])
+        entries = []
+        for position, (username, score) in enumerate(rows, start=1):
+            tied = entries and entries[-1]['score'] == score
+            entries.append({'rank': entries[-1]['rank'] if tied else position,
+                            'username': username, 'score': score})
+        cache.set(key, entries, settings.LEADERBOARD_CACHE_TIMEOUT)
+    return entries
@@ -0,0 +1,197 @@
+"""
+Structured request logging.
+
+* :class:`JsonFormatter` writes one JSON object per record, with the fields
+  passed through ``extra=`` as top-level keys.
+* :class:`RequestContextFilter` stamps each record with the ID of the
+  request being handled and drops DEBUG records of requests that weren't
+  sampled, so debug logging can stay on in production for a fraction of
+  the traffic (``LOG_DEBUG_SAMPLE_RATE``).
+* :class:`QueueStreamHandler` only puts records on a bounded in-memory
+  queue; a background thread writes them out.  A slow or blocked stderr
+  never stalls a request thread: when the queue is full, records are
+  dropped and counted instead.
+* :class:`RequestLogMiddleware` assigns the request ID (reusing a valid
+  ``X-Request-ID`` from the proxy), returns it in the response and logs
+  one access record per request with its timing.
+
+This module is imported while logging is configured, before the apps are
+loaded, so it must not import models.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from django.utils.functional import empty
+
+# (request id, whether DEBUG records are kept) of the request being handled
+_request_context = ContextVar('log_request_context', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{8,64}$')
+
+access_logger = logging.getLogger('onlinecourse.requests')
+
+# Attributes every LogRecord has; anything else was passed through ``extra=``
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id():
+    context = _request_context.get()
+    return context[0] if context else None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Add ``request_id`` to records and drop unsampled DEBUG records.
+
+    Outside a request, DEBUG records are kept only if ``sample_rate`` is 1.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        context = _request_context.get()
+        if context is None:
+            record.request_id = '-'
+            sampled = self.sample_rate >= 1
+        else:
+            record.request_id, sampled = context
+        return sampled or record.levelno > logging.DEBUG
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room: on shutdown the queue may be full, and the writer is draining it
+        self.queue.put(self._sentinel)
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Hand records to a background thread that writes them to ``stream``.
+
+    Records are formatted in the logging thread (the request's arguments
+    may change after the call returns); only the write happens in the
+    background.  The thread is started per process on first use, so a
+    handler configured before gunicorn forks works in every worker.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.flush_and_stop)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # After a fork the parent's listener thread doesn't exist here, and
+            # anything still queued is the parent's to write
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self._listener = _Listener(self.queue, self.target)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush_and_stop(self):
+        """Write out what is queued and stop the background thread."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+        self._pid = None
+
+    def close(self):
+        self.flush_and_stop()
+        self.target.close()
+        super().close()
+
+
+class RequestLogMiddleware:
+    """Give each request an ID, sample its debug logs and log its timing."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        sampled = random.random() < settings.LOG_DEBUG_SAMPLE_RATE
+        token = _request_context.set((request_id, sampled))
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            duration_ms = (time.perf_counter() - started) * 1000
+            response[REQUEST_ID_HEADER] = request_id
+            self.log(request, response, duration_ms)
+            return response
+        finally:
+            _request_context.reset(token)
+
+    def log(self, request, response, duration_ms):
+        # Don't load the session just to log who it belongs to
+        user = getattr(request, 'user', None)
+        if getattr(user, '_wrapped', None) is empty:
+            user = None
+        match = request.resolver_match
+        access_logger.info('%s %s %d', request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'trace_id': getattr(request, 'trace_id', None),
+            'debug_sampled': _request_context.get()[1],
+        })
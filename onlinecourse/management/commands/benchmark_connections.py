@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the database connection cost per request with per-request '
+        'connections (CONN_MAX_AGE=0) and with persistent connections.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of simulated requests per run.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias to benchmark.')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        requests = options['requests']
+        connection = connections[alias]
+        if connection.in_atomic_block:
+            raise CommandError('Cannot benchmark connections inside a transaction.')
+
+        original_max_age = connection.settings_dict['CONN_MAX_AGE']
+        persistent_max_age = settings.DB_CONN_MAX_AGE or 600
+        runs = [
+            ('per-request (CONN_MAX_AGE=0)', 0),
+            ('persistent (CONN_MAX_AGE=%s)' % persistent_max_age, persistent_max_age),
+        ]
+
+        self.stdout.write('Database: %s (%s), %d requests per run' % (
+            alias, connection.vendor, requests))
+        results = []
+        try:
+            for label, max_age in runs:
+                results.append((label,) + self._run(connection, max_age, requests))
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original_max_age
+
+        for label, opened, elapsed in results:
+            self.stdout.write('%-34s %5d connections opened  %8.3f ms/request' % (
+                label, opened, elapsed * 1000 / requests))
+        before, after = results[0][2], results[1][2]
+        if after:
+            self.stdout.write(self.style.SUCCESS('Persistent connections: %.1fx faster' % (before / after)))
+
+    def _run(self, connection, max_age, requests):
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        opened = []
+
+        def count_connection(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection_created.connect(count_connection)
+        try:
+            start = time.perf_counter()
+            for _ in range(requests):
+                # The same signals the request handler sends; Django closes
+                # obsolete connections on both of them.
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+            elapsed = time.perf_counter() - start
+        finally:
+            connection_created.disconnect(count_connection)
+        return opened.count(connection.alias), elapsed
@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+def _hash_for(hasher_path, seconds):
+    """Hash passwords for ``seconds`` and return (hashes, elapsed)."""
+    hasher = import_string(hasher_path)()
+    salt = hasher.salt()
+    count = 0
+    start = time.perf_counter()
+    while True:
+        hasher.encode('benchmark-password', salt)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count, elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Report password hashes per second per core for each configured '
+        'hasher, to size the worker fleet for peak logins.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3.0,
+                            help='Time spent hashing per hasher and process.')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Hash in this many processes at once (0 = one per CPU).')
+        parser.add_argument('--hasher', action='append', dest='hashers',
+                            help='Only benchmark hashers with this algorithm name.')
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or os.cpu_count()
+        seconds = options['seconds']
+        self.stdout.write('%d process(es), %.1fs per hasher, %d CPUs' % (
+            processes, seconds, os.cpu_count()))
+        self.stdout.write('%-16s %-44s %10s %14s %10s' % (
+            'algorithm', 'parameters', 'ms/hash', 'hashes/s/core', 'hashes/s'))
+
+        for hasher, path in zip(get_hashers(), settings.PASSWORD_HASHERS):
+            if options['hashers'] and hasher.algorithm not in options['hashers']:
+                continue
+            try:
+                if hasher.library:
+                    hasher._load_library()
+            except ValueError:
+                self.stdout.write('%-16s skipped, library %r not installed' % (
+                    hasher.algorithm, hasher.library))
+                continue
+
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(_hash_for, [path] * processes, [seconds] * processes))
+            per_core = [count / elapsed for count, elapsed in results]
+            per_core_rate = sum(per_core) / len(per_core)
+            self.stdout.write('%-16s %-44s %10.1f %14.1f %10.1f' % (
+                hasher.algorithm, self._parameters(hasher),
+                1000 / per_core_rate, per_core_rate, sum(per_core)))
+
+    def _parameters(self, hasher):
+        names = ['iterations', 'work_factor', 'block_size', 'time_cost', 'memory_cost', 'parallelism']
+        return ' '.join('%s=%s' % (name, getattr(hasher, name))
+                        for name in names if hasattr(hasher, name))
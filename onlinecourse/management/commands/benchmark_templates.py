@@ -0,0 +1,123 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+
+LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+CHOICES_PER_QUESTION = 4
+
+
+def course_list_context(size):
+    courses = [SimpleNamespace(id=number, name='Course %d' % number, image=None,
+                               description='Description of course %d. ' % number * 5,
+                               total_enrollment=number * 7, is_enrolled=number % 2 == 0)
+               for number in range(1, size + 1)]
+    return {'course_list': courses}
+
+
+def _choices(question_number):
+    return [SimpleNamespace(id=question_number * CHOICES_PER_QUESTION + index,
+                            content='Choice %d of question %d' % (index, question_number),
+                            is_correct=index == 0)
+            for index in range(CHOICES_PER_QUESTION)]
+
+
+def course_detail_context(size):
+    """A course with ``size`` lessons and an exam of ``size`` questions, as an enrolled learner sees it."""
+    lessons = [SimpleNamespace(order=number, title='Lesson %d' % number, content='Lesson text. ' * 40)
+               for number in range(size)]
+    course = SimpleNamespace(id=1, name='Benchmark course', exam_duration=None,
+                             lesson_set=SimpleNamespace(all=lessons))
+    questions = [{'id': number, 'content': 'Question %d?' % number,
+                  'choices': [vars(choice) for choice in _choices(number)]}
+                 for number in range(size)]
+    return {'course': course, 'object': course, 'exam': {'questions': questions},
+            'drafted': set(), 'submission_token': '0' * 32}
+
+
+def exam_result_context(size):
+    """The result page for ``size`` questions with half the answers right."""
+    questions = []
+    selected = []
+    for number in range(size):
+        choices = _choices(number)
+        questions.append(SimpleNamespace(content='Question %d?' % number,
+                                         choice_set=SimpleNamespace(all=choices)))
+        selected.append(choices[number % 2])
+    return {'course': SimpleNamespace(id=1), 'questions': questions, 'grade': 50, 'choices': selected}
+
+
+TEMPLATES = [
+    ('onlinecourse/course_list_bootstrap.html', course_list_context),
+    ('onlinecourse/course_detail_bootstrap.html', course_detail_context),
+    ('onlinecourse/exam_result_bootstrap.html', exam_result_context),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure render time of the course list, course detail and exam result '
+        'templates for growing numbers of courses, lessons and questions, with '
+        'and without the cached template loader.  Contexts are built in memory, '
+        'so only template work is timed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,500',
+                            help='Comma-separated numbers of courses (list) or lessons and questions '
+                                 '(detail, result) to render.')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Renders per template, size and loader; the median is reported.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        iterations = max(1, options['iterations'])
+        backends = {'uncached': self._backend(cached=False), 'cached': self._backend(cached=True)}
+
+        request = RequestFactory().get('/', secure=True)
+        request.user = User(username='benchmark', first_name='Bench')
+
+        self.stdout.write('Median render time of %d run(s), ms:' % iterations)
+        self.stdout.write('%-45s %6s %10s %10s %8s' % ('template', 'size', 'uncached', 'cached', 'speedup'))
+        for name, build_context in TEMPLATES:
+            for size in sizes:
+                context = build_context(size)
+                timings = {label: self._time(backend, name, context, request, iterations)
+                           for label, backend in backends.items()}
+                self.stdout.write('%-45s %6d %10.2f %10.2f %7.1fx' % (
+                    name, size, timings['uncached'], timings['cached'],
+                    timings['uncached'] / timings['cached'] if timings['cached'] else 0))
+
+    def _backend(self, cached):
+        """A template engine configured like the project's, with or without the cached loader."""
+        template_settings = settings.TEMPLATES[0]
+        options = dict(template_settings.get('OPTIONS', {}))
+        options['loaders'] = [('django.template.loaders.cached.Loader', LOADERS)] if cached else LOADERS
+        return DjangoTemplates({
+            'NAME': 'benchmark-%s' % ('cached' if cached else 'uncached'),
+            'DIRS': list(template_settings.get('DIRS', [])),
+            'APP_DIRS': False,
+            'OPTIONS': options,
+        })
+
+    def _time(self, backend, name, context, request, iterations):
+        # One render first, so the cached loader is measured warm, as in a running worker
+        backend.get_template(name).render(context, request)
+        durations = []
+        for _ in range(iterations):
+            began = time.perf_counter()
+            # Look the template up on every render, as each request does
+            backend.get_template(name).render(context, request)
+            durations.append(time.perf_counter() - began)
+        return statistics.median(durations) * 1000
@@ -0,0 +1,259 @@
+import http.client
+import importlib.util
+import os
+import re
+import runpy
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from onlinecourse.models import Choice, Course, Enrollment, Question
+
+BENCHMARK_COURSE = 'Benchmark course'
+BENCHMARK_PASSWORD = 'benchmark-password'
+COOKIE_RE = re.compile(r'^([^=;\s]+)=([^;]*)')
+
+
+class ExamClient:
+    """One simulated learner: logs in once, then takes the exam in a loop."""
+
+    def __init__(self, port, username):
+        self.port = port
+        self.username = username
+        self.cookies = {}
+        self.location = None
+        self.origin = 'https://127.0.0.1:%d' % port
+
+    def request(self, method, path, fields=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {
+            # Tell the app the (absent) proxy terminated TLS, like in production
+            'X-Forwarded-Proto': 'https',
+            'Cookie': '; '.join('%s=%s' % item for item in self.cookies.items()),
+        }
+        body = None
+        if method == 'POST':
+            body = urlencode(fields or {})
+            headers.update({
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Origin': self.origin,
+                'X-CSRFToken': self.cookies.get('csrftoken', ''),
+            })
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            self.location = response.getheader('Location')
+            for header, value in response.getheaders():
+                if header.lower() == 'set-cookie':
+                    match = COOKIE_RE.match(value)
+                    if match:
+                        self.cookies[match.group(1)] = match.group(2)
+            return response.status
+        finally:
+            connection.close()
+
+    def login(self):
+        self.request('GET', '/onlinecourse/login/')
+        status = self.request('POST', '/onlinecourse/login/', {'username': self.username, 'psw': BENCHMARK_PASSWORD})
+        if status != 302:
+            raise RuntimeError('login failed with HTTP %d' % status)
+
+    def take_exam(self, course_id, choice_ids):
+        """The exam flow: load the exam, submit it, view the result."""
+        statuses = [self.request('GET', '/onlinecourse/%d/' % course_id)]
+        fields = {'choice_%d' % choice_id: choice_id for choice_id in choice_ids}
+        fields['submission_token'] = uuid.uuid4().hex
+        statuses.append(self.request('POST', '/onlinecourse/%d/submit/' % course_id, fields))
+        if self.location:
+            statuses.append(self.request('GET', self.location))
+        return statuses
+
+
+class Command(BaseCommand):
+    help = (
+        'Start gunicorn with sync, gthread and uvicorn workers in turn and '
+        'measure exam flows per second (load exam, submit, view result) '
+        'under concurrent simulated learners.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-class', action='append', dest='worker_classes',
+                            choices=['sync', 'gthread', 'uvicorn'],
+                            help='Worker class to benchmark (repeatable; default: all three).')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Simulated learners taking the exam at once.')
+        parser.add_argument('--duration', type=float, default=20.0,
+                            help='Seconds to run each worker class for.')
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes (default: as in gunicorn.conf.py).')
+        parser.add_argument('--threads', type=int,
+                            help='Threads per gthread worker (default: as in gunicorn.conf.py).')
+
+    def handle(self, *args, **options):
+        course_id, choice_ids, usernames = self._prepare(options['concurrency'])
+        if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+            self.stderr.write('Warning: SQLite serializes writes; benchmark against PostgreSQL '
+                              'for numbers that reflect production.')
+
+        worker_classes = options['worker_classes'] or ['sync', 'gthread', 'uvicorn']
+        self.stdout.write('%d learners, %.0fs per worker class, %d CPUs' % (
+            options['concurrency'], options['duration'], os.cpu_count()))
+        self.stdout.write('%-8s %8s %8s %10s %10s %10s %8s' % (
+            'class', 'workers', 'threads', 'flows/s', 'p50 ms', 'p95 ms', 'errors'))
+        for worker_class in worker_classes:
+            if worker_class == 'uvicorn' and importlib.util.find_spec('uvicorn') is None:
+                self.stdout.write('%-8s skipped, uvicorn is not installed' % worker_class)
+                continue
+            port = self._free_port()
+            env = self._server_env(worker_class, port, options)
+            config = self._gunicorn_config(env)
+            server = self._start_server(env)
+            try:
+                self._wait_until_ready(server, port)
+                flows, latencies, errors = self._run(port, course_id, choice_ids, usernames, options['duration'])
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+                self.server_log.close()
+            quantiles = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else [0] * 19
+            self.stdout.write('%-8s %8s %8s %10.1f %10.1f %10.1f %8d' % (
+                worker_class, config['workers'], config['threads'], flows / options['duration'],
+                statistics.median(latencies) * 1000 if latencies else 0, quantiles[18] * 1000, errors))
+
+    def _prepare(self, learners):
+        """Create (once) a course with a 10-question exam and enrolled benchmark users."""
+        course, created = Course.objects.get_or_create(
+            name=BENCHMARK_COURSE, defaults={'description': 'Created by benchmark_workers'})
+        if created:
+            for number in range(10):
+                question = Question.objects.create(course=course, content='Question %d' % number, grade=10)
+                Choice.objects.bulk_create([
+                    Choice(question=question, content='Choice %d' % index, is_correct=index == 0)
+                    for index in range(4)])
+        password = make_password(BENCHMARK_PASSWORD)
+        usernames = ['benchmark-%d' % number for number in range(learners)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create([User(username=name, password=password)
+                                  for name in usernames if name not in existing])
+        for user in User.objects.filter(username__in=usernames):
+            Enrollment.objects.get_or_create(user=user, course=course)
+        choice_ids = list(Choice.objects.filter(question__course=course, is_correct=True).values_list('id', flat=True))
+        return course.id, choice_ids, usernames
+
+    def _free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def _server_env(self, worker_class, port, options):
+        env = dict(os.environ,
+                   GUNICORN_WORKER_CLASS=worker_class,
+                   GUNICORN_BIND='127.0.0.1:%d' % port,
+                   GUNICORN_LOG_LEVEL='warning',
+                   # Measure the workers, not the token buckets or the hashing
+                   # cap: every learner logs in at once before the clock starts
+                   RATELIMIT_ENABLED='False',
+                   PASSWORD_HASHING_CONCURRENCY=str(max(options['concurrency'],
+                                                        settings.CONCURRENCY_LIMITS['password_hashing'])))
+        if options['workers']:
+            env['WEB_CONCURRENCY'] = str(options['workers'])
+        if options['threads']:
+            env['GUNICORN_THREADS'] = str(options['threads'])
+        return env
+
+    def _gunicorn_config(self, env):
+        """Evaluate gunicorn.conf.py as gunicorn will see it with ``env``."""
+        saved = dict(os.environ)
+        os.environ.update(env)
+        try:
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+    def _start_server(self, env):
+        config = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        # The app logs every request to stderr; keep it out of the results
+        # table, but at hand in case the server fails to start
+        self.server_log = tempfile.TemporaryFile()
+        return subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', config, '--access-logfile', '/dev/null'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=self.server_log)
+
+    def _server_log_tail(self, lines=20):
+        self.server_log.seek(0)
+        return b''.join(self.server_log.readlines()[-lines:]).decode(errors='replace')
+
+    def _wait_until_ready(self, server, port, timeout=60):
+        deadline = time.monotonic() + timeout
+        client = ExamClient(port, None)
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn exited with status %d:\n%s' % (
+                    server.returncode, self._server_log_tail()))
+            try:
+                if client.request('GET', '/onlinecourse/health/') == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise CommandError('gunicorn did not become ready within %ds:\n%s' % (timeout, self._server_log_tail()))
+
+    def _run(self, port, course_id, choice_ids, usernames, duration):
+        latencies = []
+        counts = {'flows': 0, 'errors': 0, 'logins_failed': 0}
+        lock = threading.Lock()
+        # Everyone logs in first; the clock starts once all learners are ready
+        ready = threading.Barrier(len(usernames) + 1)
+        go = threading.Event()
+        deadline = []
+
+        def learner(username):
+            client = ExamClient(port, username)
+            try:
+                client.login()
+                logged_in = True
+            except (OSError, RuntimeError):
+                logged_in = False
+                with lock:
+                    counts['logins_failed'] += 1
+            ready.wait()
+            go.wait()
+            while logged_in and time.monotonic() < deadline[0]:
+                began = time.monotonic()
+                try:
+                    ok = client.take_exam(course_id, choice_ids) == [200, 302, 200]
+                except OSError:
+                    ok = False
+                with lock:
+                    if ok:
+                        counts['flows'] += 1
+                        latencies.append(time.monotonic() - began)
+                    else:
+                        counts['errors'] += 1
+
+        threads = [threading.Thread(target=learner, args=(username,)) for username in usernames]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        deadline.append(time.monotonic() + duration)
+        go.set()
+        for thread in threads:
+            thread.join()
+        if counts['logins_failed']:
+            # Fewer learners than asked for: the row wouldn't compare with the others
+            raise CommandError('%d of %d learners could not log in' % (counts['logins_failed'], len(usernames)))
+        return counts['flows'], latencies, counts['errors']
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from onlinecourse.course_io import FORMATS, CourseFormatError, export_course
+from onlinecourse.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Write a course with its lessons, pools, questions, choices and instructors as JSON or YAML.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int)
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format (default: from the output file extension, else json).')
+        parser.add_argument('--output', '-o', help='File to write to (default: stdout).')
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(pk=options['course_id'])
+        except Course.DoesNotExist:
+            raise CommandError('Course %s does not exist.' % options['course_id'])
+        fmt = options['format'] or guess_format(options['output'])
+        try:
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8') as stream:
+                    export_course(course, stream, fmt)
+            else:
+                # Written in pieces; don't let the wrapper add a newline after each
+                self.stdout.ending = ''
+                export_course(course, self.stdout, fmt)
+        except CourseFormatError as e:
+            raise CommandError(e)
+
+
+def guess_format(path):
+    if path and path.lower().endswith(('.yaml', '.yml')):
+        return 'yaml'
+    return 'json'
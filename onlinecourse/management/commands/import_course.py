@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from onlinecourse.course_io import FORMATS, CourseFormatError, import_course, load_course
+
+from .export_course import guess_format
+
+
+class Command(BaseCommand):
+    help = 'Create a course from a JSON or YAML file written by export_course.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: from the file extension, else json).')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        try:
+            with open(options['path'], encoding='utf-8') as stream:
+                course = import_course(load_course(stream, fmt))
+        except OSError as e:
+            raise CommandError(e)
+        except CourseFormatError as e:
+            raise CommandError(e)
+        self.stdout.write('Imported course %d: %s (%d questions)' % (
+            course.pk, course.name, course.question_set.count()))
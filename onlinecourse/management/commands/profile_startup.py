@@ -0,0 +1,103 @@
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, the way a web worker boots: load the WSGI
+# application, then serve one request to the health check.
+BOOT_SCRIPT = r'''
+import json, sys, time
+started = time.time()
+from myproject.wsgi import application
+loaded = time.time()
+
+def start_response(status, headers, exc_info=None):
+    start_response.status = status
+
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r, 'QUERY_STRING': '',
+    'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '443', 'HTTP_HOST': '127.0.0.1',
+    'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'https', 'wsgi.input': sys.stdin.buffer,
+    'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0), 'wsgi.multithread': False,
+    'wsgi.multiprocess': True, 'wsgi.run_once': False,
+}
+response = application(environ, start_response)
+b''.join(response)
+response.close()
+served = time.time()
+print(json.dumps({'started': started, 'loaded': loaded, 'served': served,
+                  'status': start_response.status, 'modules': len(sys.modules)}))
+'''
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(output):
+    """Return ``[(module, self_us, cumulative_us, depth)]`` from ``-X importtime`` output."""
+    entries = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+class Command(BaseCommand):
+    help = (
+        'Profile a cold start: time from interpreter launch until the WSGI '
+        'application is loaded and until the first request is served, and '
+        'import time by module as reported by "python -X importtime".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Cold starts to time; the median is reported.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of modules and packages to list.')
+        parser.add_argument('--path', default='/onlinecourse/health/',
+                            help='URL of the first request.')
+
+    def handle(self, *args, **options):
+        script = BOOT_SCRIPT % {'path': options['path']}
+        timings = []
+        imports = []
+        for run in range(max(1, options['runs'])):
+            launched = time.time()
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                                    cwd=settings.BASE_DIR, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError('Boot failed:\n%s' % result.stderr[-2000:])
+            boot = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(boot)
+            boot['launched'] = launched
+            if run == 0:
+                imports = parse_importtime(result.stderr)
+
+        def median_ms(start, end):
+            return statistics.median((t[end] - t[start]) * 1000 for t in timings)
+
+        self.stdout.write('Cold start, median of %d run(s):' % len(timings))
+        self.stdout.write('  interpreter start      %8.1f ms' % median_ms('launched', 'started'))
+        self.stdout.write('  load WSGI application  %8.1f ms' % median_ms('started', 'loaded'))
+        self.stdout.write('  first request (%s)  %8.1f ms' % (timings[-1]['status'], median_ms('loaded', 'served')))
+        self.stdout.write('  time to first request  %8.1f ms' % median_ms('launched', 'served'))
+        self.stdout.write('  modules loaded         %8d' % timings[-1]['modules'])
+
+        top = options['top']
+        self.stdout.write('\nSlowest modules (self / cumulative import time, first run):')
+        for module, self_us, cumulative_us, depth in sorted(imports, key=lambda entry: -entry[1])[:top]:
+            self.stdout.write('  %8.1f / %8.1f ms  %s' % (self_us / 1000, cumulative_us / 1000, module))
+
+        by_package = defaultdict(int)
+        for module, self_us, cumulative_us, depth in imports:
+            by_package[module.split('.')[0]] += self_us
+        self.stdout.write('\nImport time by package (self time, first run):')
+        for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write('  %8.1f ms  %s' % (self_us / 1000, package))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from onlinecourse.profiling import HEADER, PROFILERS, make_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Print a signed X-Profile header value. A request that carries it is '
+        'profiled, and its response names the stored profile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('profiler', nargs='?', default='cprofile', choices=sorted(PROFILERS),
+                            help='cprofile (a .prof file) or sample (collapsed stacks for a flame graph).')
+
+    def handle(self, *args, **options):
+        self.stdout.write('%s: %s' % (HEADER, make_token(options['profiler'])))
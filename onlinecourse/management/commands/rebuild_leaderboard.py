@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from onlinecourse.leaderboard import record_score
+from onlinecourse.models import Submission
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the course leaderboards from graded submissions, e.g. those graded '
+        'before leaderboards existed. Safe to re-run: only better scores are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, help='Only rebuild the leaderboard of this course id.')
+
+    def handle(self, *args, **options):
+        submissions = Submission.objects.filter(score__isnull=False, graded_at__isnull=False)
+        if options['course']:
+            submissions = submissions.filter(enrollment__course_id=options['course'])
+        count = 0
+        for course_id, user_id, score, graded_at in (
+                submissions.order_by('id')
+                .values_list('enrollment__course_id', 'enrollment__user_id', 'score', 'graded_at')
+                .iterator(chunk_size=2000)):
+            record_score(course_id, user_id, score, graded_at)
+            count += 1
+        self.stdout.write('Recorded %d graded submissions' % count)
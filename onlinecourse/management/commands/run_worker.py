@@ -0,0 +1,52 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from onlinecourse import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database-backed job queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', default='default',
+                            help='Queue to consume.')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Jobs claimed per poll.')
+        parser.add_argument('--visibility-timeout', type=int,
+                            default=settings.JOB_VISIBILITY_TIMEOUT,
+                            help='Seconds a claimed job stays locked before it is retried elsewhere.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        worker = jobs.worker_id()
+        self.stdout.write('Worker %s consuming queue %r' % (worker, options['queue']))
+
+        processed = 0
+        while not self.stopping:
+            close_old_connections()
+            claimed = jobs.run_pending(
+                queue=options['queue'],
+                batch_size=options['batch_size'],
+                visibility_timeout=options['visibility_timeout'],
+                worker=worker,
+            )
+            processed += claimed
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        self.stdout.write('Worker %s stopped after %d jobs' % (worker, processed))
+
+    def stop(self, signum, frame):
+        # Finish the current batch, then exit
+        self.stopping = True
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Now
+
+from onlinecourse.models import ExamAttempt
+
+
+class Command(BaseCommand):
+    help = 'Mark timed exam attempts whose deadline has passed as expired, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Attempts closed per UPDATE.')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to wait between batches to limit lock pressure.')
+
+    def handle(self, *args, **options):
+        expired = ExamAttempt.objects.filter(state=ExamAttempt.ACTIVE, deadline__lt=Now())
+        total = 0
+        while True:
+            # Served by the (state, deadline) index; each batch is a short transaction
+            ids = list(expired.values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            total += expired.filter(id__in=ids).update(state=ExamAttempt.EXPIRED)
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write('Expired %d attempt(s)' % total)
@@ -0,0 +1,205 @@
+"""
+Serving uploaded media in production.
+
+:class:`HashedMediaStorage` stores uploads under names that contain a hash
+of their content (``cover.3f2a9c1b7d4e.png``), so a name always refers to
+the same bytes.  It also writes a gzip-compressed sibling
+(``<name>.gz``) for compressible types.
+
+:func:`serve_media` serves ``MEDIA_ROOT``:
+
+* hashed names are sent with a far-future, immutable ``Cache-Control``;
+  others get ``MEDIA_MAX_AGE`` and are revalidated with their ETag;
+* a precompressed ``.br`` or ``.gz`` sibling is sent instead of the file
+  when the client accepts that encoding;
+* with ``MEDIA_SERVE_MODE`` set to ``x-accel-redirect`` (nginx) or
+  ``x-sendfile`` (Apache, lighttpd) the file transfer is handed to the
+  web server; otherwise the file is streamed by Django with support for
+  single byte-range requests.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# A run of 12+ hex digits delimited by '.' or '-' in the file name
+HASHED_NAME_RE = re.compile(r'(^|[.-])[0-9a-f]{12,}([.-]|$)')
+COMPRESSIBLE_TYPES = {'image/svg+xml', 'application/json', 'application/javascript', 'application/xml'}
+# (Accept-Encoding token, file suffix), in order of preference
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME_RE.search(posixpath.basename(name)))
+
+
+def _is_compressible(name):
+    content_type = mimetypes.guess_type(name)[0] or ''
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+class HashedMediaStorage(FileSystemStorage):
+    """File system storage that names files after their content."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not is_hashed(name):
+            digest = hashlib.sha256()
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+            root, ext = posixpath.splitext(name)
+            name = '%s.%s%s' % (root, digest.hexdigest()[:12], ext)
+            if self.exists(name):
+                # Same content already stored under this name
+                return name
+        return super().save(name, content, max_length)
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        if _is_compressible(name):
+            with self.open(name, 'rb') as stored:
+                data = stored.read()
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                super()._save(name + '.gz', ContentFile(compressed))
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        if name and self.exists(name + '.gz'):
+            super().delete(name + '.gz')
+
+
+def _cache_control(name):
+    if is_hashed(name):
+        return 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    return 'public, max-age=%d' % settings.MEDIA_MAX_AGE
+
+
+def _byte_range(header, size):
+    """
+    Parse a single ``Range: bytes=...`` header into ``(start, end)``
+    inclusive, or return None to serve the whole file.  Raises ValueError
+    for a range that can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or another unit: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid path')
+    if not os.path.isfile(full_path):
+        raise Http404('"%s" does not exist' % path)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    # Pick a precompressed sibling the client accepts
+    encoding, suffix = None, ''
+    accepted = {token.split(';')[0].strip() for token in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')}
+    for token, candidate in PRECOMPRESSED:
+        if token in accepted and os.path.isfile(full_path + candidate):
+            encoding, suffix = token, candidate
+            break
+    file_path = full_path + suffix
+    stat = os.stat(file_path)
+    etag = quote_etag('%x-%x%s' % (int(stat.st_mtime), stat.st_size, suffix))
+
+    headers = {
+        'Cache-Control': _cache_control(path),
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Vary': 'Accept-Encoding',
+    }
+    if request.META.get('HTTP_IF_NONE_MATCH') in (etag, 'W/' + etag):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'x-accel-redirect':
+        # nginx serves the file (and any range) from an internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + path + suffix)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = file_path
+    else:
+        response = _file_response(request, file_path, stat.st_size, content_type, etag,
+                                  filename=os.path.basename(full_path))
+    for header, value in headers.items():
+        response[header] = value
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _file_response(request, file_path, size, content_type, etag, filename):
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _byte_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(file_path, start, end - start + 1),
+                                             status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            response['Content-Length'] = str(end - start + 1)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+    response = FileResponse(open(file_path, 'rb'), content_type=content_type, filename=filename)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onlinecourse', '0004_submission_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollment',
+            name='exam_question_ids',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='QuestionPool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('sample_size', models.PositiveIntegerField(default=1)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='onlinecourse.course')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='pool',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='onlinecourse.questionpool'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onlinecourse', '0005_question_pools'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='exam_duration',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='max_active_attempts',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ExamAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('deadline', models.DateTimeField()),
+                ('state', models.CharField(choices=[('active', 'Active'), ('submitted', 'Submitted'), ('expired', 'Expired')], default='active', max_length=10)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='onlinecourse.course')),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='onlinecourse.enrollment')),
+                ('submission', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='onlinecourse.submission')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'deadline'], name='onlinecours_state_72d0b4_idx'), models.Index(fields=['course', 'state', 'deadline'], name='onlinecours_course__2f9896_idx')],
+            },
+        ),
+    ]
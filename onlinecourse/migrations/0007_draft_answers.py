@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onlinecourse', '0006_exam_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selected', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='onlinecourse.choice')),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='onlinecourse.enrollment')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='draftanswer',
+            constraint=models.UniqueConstraint(fields=('enrollment', 'choice'), name='unique_draft_answer'),
+        ),
+    ]
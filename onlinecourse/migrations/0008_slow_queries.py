@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-19 05:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onlinecourse', '0007_draft_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=16, unique=True)),
+                ('statement', models.TextField()),
+                ('example', models.TextField()),
+                ('params_shape', models.CharField(blank=True, max_length=200)),
+                ('database', models.CharField(max_length=50)),
+                ('view', models.CharField(blank=True, max_length=200)),
+                ('location', models.CharField(blank=True, max_length=300)),
+                ('plan', models.TextField(blank=True)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
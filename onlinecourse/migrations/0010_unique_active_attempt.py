@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+def expire_duplicate_active_attempts(apps, schema_editor):
+    # Keep each enrollment's newest active attempt; the constraint allows only one
+    ExamAttempt = apps.get_model('onlinecourse', 'ExamAttempt')
+    kept = set()
+    for attempt in ExamAttempt.objects.filter(state='active').order_by('enrollment_id', '-started_at', '-id'):
+        if attempt.enrollment_id in kept:
+            ExamAttempt.objects.filter(pk=attempt.pk).update(state='expired')
+        kept.add(attempt.enrollment_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onlinecourse', '0009_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(expire_duplicate_active_attempts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='examattempt',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 'active')), fields=('enrollment',), name='unique_active_exam_attempt'),
+        ),
+    ]
@@ -7,6 +7,8 @@ except Exception:
     sys.exit()
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from collections import defaultdict
 import uuid
 
 
@@ -61,6 +63,10 @@ class Course(models.Model):
     instructors = models.ManyToManyField(Instructor)
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, through='Enrollment')
     total_enrollment = models.IntegerField(default=0)
+    # Minutes allowed per exam attempt; null for an untimed exam
+    exam_duration = models.PositiveIntegerField(null=True, blank=True)
+    # Cap on concurrently running timed attempts; null for no cap
+    max_active_attempts = models.PositiveIntegerField(null=True, blank=True)
     is_enrolled = False
 
     def __str__(self):
@@ -93,20 +99,41 @@ class Enrollment(models.Model):
     date_enrolled = models.DateField(default=now)
     mode = models.CharField(max_length=5, choices=COURSE_MODES, default=AUDIT)
     rating = models.FloatField(default=5.0)
+    # Question ids sampled from the course's question pools for this learner,
+    # stored as one compact list; null until the learner first sees the exam
+    exam_question_ids = models.JSONField(null=True, blank=True)
 
 
 # One enrollment could have multiple submission
 # One submission could have multiple choices
 # One choice could belong to multiple submissions
 
+# Question pool model
+# Each learner gets sample_size questions drawn at random from the pool;
+# questions without a pool are asked to everyone
+class QuestionPool(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    sample_size = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return self.name
+
+
 class Question(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    pool = models.ForeignKey(QuestionPool, null=True, blank=True, on_delete=models.SET_NULL)
     content = models.CharField(max_length=200)
     grade = models.IntegerField(default=50)
 
     def __str__(self):
         return "Question: " + self.content
 
+    def clean(self):
+        # Exam snapshots only know the pools of the question's own course
+        if self.pool_id is not None and self.pool.course_id != self.course_id:
+            raise ValidationError({'pool': 'The pool must belong to the same course as the question.'})
+
     # method to calculate if the learner gets the score of the question
     def is_get_score(self, selected_ids):
         all_answers = self.choice_set.filter(is_correct=True).count()
@@ -124,6 +151,167 @@ class Choice(models.Model):
 class Submission(models.Model):
     enrollment = models.ForeignKey(Enrollment, on_delete=models.CASCADE)
     choices = models.ManyToManyField(Choice)
+    # Filled in by the grade_submission background job
+    score = models.IntegerField(null=True, blank=True)
+    graded_at = models.DateTimeField(null=True, blank=True)
+    # Token from the exam form, so a replayed POST doesn't create a second submission
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['enrollment', 'idempotency_key'],
+                                    name='unique_submission_idempotency_key')
+        ]
     
     def __str__(self):
         return f"Submission for {self.enrollment.user.username} - {self.enrollment.course.name}"
+
+    # A question scores its grade only if exactly its correct choices were selected.
+    # Uses a fixed number of queries regardless of the number of questions.
+    # Only the questions sampled for the learner count when the course uses pools.
+    def compute_score(self):
+        selected_ids = set(self.choices.values_list('id', flat=True))
+        course_id = self.enrollment.course_id
+        questions = Question.objects.filter(course_id=course_id)
+        choices = Choice.objects.filter(question__course_id=course_id)
+        if self.enrollment.exam_question_ids is not None:
+            questions = questions.filter(id__in=self.enrollment.exam_question_ids)
+            choices = choices.filter(question_id__in=self.enrollment.exam_question_ids)
+        grades = dict(questions.values_list('id', 'grade'))
+        correct = defaultdict(set)
+        selected = defaultdict(set)
+        for choice_id, question_id, is_correct in choices.values_list('id', 'question_id', 'is_correct'):
+            if is_correct:
+                correct[question_id].add(choice_id)
+            if choice_id in selected_ids:
+                selected[question_id].add(choice_id)
+        return sum(grade for question_id, grade in grades.items()
+                   if correct[question_id] == selected[question_id])
+
+
+# Draft answer model
+# Autosaved exam answers, one row per (enrollment, choice) upserted as the learner
+# ticks and unticks boxes; promoted to a Submission on submit
+class DraftAnswer(models.Model):
+    enrollment = models.ForeignKey(Enrollment, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    selected = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['enrollment', 'choice'], name='unique_draft_answer')
+        ]
+
+
+# Exam attempt model
+# A timed exam is started with an attempt and must be submitted before its deadline;
+# attempts past their deadline are closed by the sweep_attempts command
+class ExamAttempt(models.Model):
+    ACTIVE = 'active'
+    SUBMITTED = 'submitted'
+    EXPIRED = 'expired'
+    STATES = [
+        (ACTIVE, 'Active'),
+        (SUBMITTED, 'Submitted'),
+        (EXPIRED, 'Expired')
+    ]
+    enrollment = models.ForeignKey(Enrollment, on_delete=models.CASCADE)
+    # Denormalized from enrollment so active attempts can be counted per course from an index
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    started_at = models.DateTimeField(default=now)
+    deadline = models.DateTimeField()
+    state = models.CharField(max_length=10, choices=STATES, default=ACTIVE)
+    submission = models.OneToOneField(Submission, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'deadline']),
+            models.Index(fields=['course', 'state', 'deadline']),
+        ]
+        constraints = [
+            # Concurrent starts can't give a learner two running attempts
+            models.UniqueConstraint(fields=['enrollment'], condition=models.Q(state='active'),
+                                    name='unique_active_exam_attempt'),
+        ]
+
+    def __str__(self):
+        return f"Attempt by {self.enrollment.user.username} ({self.state})"
+
+
+# Background job, see onlinecourse.jobs
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    ]
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=now)
+    # A running job whose lock has expired is picked up again by another worker
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    idempotency_key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['queue', 'status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+# Slow query, see onlinecourse.slowqueries
+# Queries slower than SLOW_QUERY_THRESHOLD_MS, aggregated by fingerprint
+# (the statement with its literals and parameters blanked out)
+class SlowQuery(models.Model):
+    fingerprint = models.CharField(max_length=16, unique=True)
+    statement = models.TextField()
+    # The first occurrence: its SQL with parameters, and where it was run from
+    example = models.TextField()
+    params_shape = models.CharField(max_length=200, blank=True)
+    database = models.CharField(max_length=50)
+    view = models.CharField(max_length=200, blank=True)
+    location = models.CharField(max_length=300, blank=True)
+    plan = models.TextField(blank=True)
+    calls = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"{self.fingerprint} ({self.calls} calls)"
+
+
+# Leaderboard entry, see onlinecourse.leaderboard
+# A learner's best graded score in a course, upserted when a submission is
+# graded; a rank is one plus the number of entries above it in the index
+class LeaderboardEntry(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    best_score = models.IntegerField()
+    achieved_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'user'], name='unique_leaderboard_entry')
+        ]
+        indexes = [
+            models.Index(fields=['course', '-best_score', 'achieved_at'], name='leaderboard_rank_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.best_score} in {self.course.name}"
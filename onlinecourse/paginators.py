@@ -0,0 +1,40 @@
+"""
+Paginators for tables too large to count on every page view.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On PostgreSQL, use the planner's row estimate from ``pg_class`` as the
+    count of an unfiltered queryset instead of ``SELECT COUNT(*)``, which
+    scans the whole table.  Filtered querysets, small tables and other
+    databases get an exact count.
+    """
+    # Below this many rows an exact count is cheap and preferable
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self._estimated_count()
+        if estimate is not None and estimate >= self.estimate_threshold:
+            return estimate
+        return super().count
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where or queryset.query.distinct:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 for a table that has never been analyzed
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
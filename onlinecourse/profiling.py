@@ -0,0 +1,187 @@
+"""
+On-demand profiling of individual production requests.
+
+:class:`ProfilingMiddleware` profiles a request when it carries either
+
+* an ``X-Profile`` header signed with the ``SECRET_KEY`` (create one with
+  ``manage.py profile_token``; it expires after ``PROFILING_TOKEN_MAX_AGE``
+  seconds), or
+* a ``?_profile=`` query parameter, from a staff user.
+
+The value names the profiler: ``cprofile`` writes a ``.prof`` file for
+``pstats``/snakeviz; ``sample`` samples the request thread's stack every
+``PROFILING_SAMPLE_INTERVAL`` seconds and writes flamegraph-ready collapsed
+stacks (``.collapsed``).  Profiles are kept in ``PROFILING_DIR``, the newest
+``PROFILING_MAX_FILES`` of them, and the response names its profile in an
+``X-Profile`` header.  Staff download them from ``staff/profiles/``.
+
+Other requests cost a header and a query string lookup.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.urls import reverse
+
+HEADER = 'X-Profile'
+QUERY_PARAMETER = '_profile'
+TOKEN_SALT = 'onlinecourse.profiling'
+PROFILERS = {'cprofile': '.prof', 'sample': '.collapsed'}
+PROFILE_NAME_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[\w.-]+-[0-9a-f]{8}\.(prof|collapsed)$')
+
+
+def make_token(profiler):
+    """Return a signed ``X-Profile`` header value that requests ``profiler``."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(profiler)
+
+
+def _requested_profiler(request):
+    token = request.headers.get(HEADER)
+    if token:
+        try:
+            profiler = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+                token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            return None
+        return profiler if profiler in PROFILERS else None
+    profiler = request.GET.get(QUERY_PARAMETER)
+    if profiler in PROFILERS and request.user.is_staff:
+        return profiler
+    return None
+
+
+class StackSampler:
+    """Sample one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        # Longest first, so files are shown relative to the innermost directory
+        self._prefixes = [prefix + os.sep for prefix in sorted({settings.BASE_DIR, *sys.path}, key=len, reverse=True)
+                          if prefix]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append('%s (%s:%d)' % (code.co_name, self._short_path(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(frames))] += 1
+
+    def _short_path(self, path):
+        for prefix in self._prefixes:
+            if path.startswith(prefix):
+                return path[len(prefix):]
+        return path
+
+    def collapsed(self):
+        """The samples in the collapsed-stack format of ``flamegraph.pl`` and speedscope."""
+        return ''.join('%s %d\n' % item for item in sorted(self.stacks.items()))
+
+
+def profile_path(name):
+    if not PROFILE_NAME_RE.match(name):
+        raise Http404('Invalid profile name')
+    return os.path.join(settings.PROFILING_DIR, name)
+
+
+def list_profiles():
+    """Return ``[(name, size, modified)]`` of the stored profiles, newest first."""
+    try:
+        entries = [entry for entry in os.scandir(settings.PROFILING_DIR)
+                   if entry.is_file() and PROFILE_NAME_RE.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [(entry.name, entry.stat().st_size, datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc))
+            for entry in entries]
+
+
+def _prune():
+    for name, size, modified in list_profiles()[settings.PROFILING_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, name))
+        except FileNotFoundError:
+            pass  # pruned by another worker
+
+
+class ProfilingMiddleware:
+    """Profile requests that ask for it; must come after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = _requested_profiler(request)
+        if profiler is None:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        if profiler == 'cprofile':
+            profile = cProfile.Profile()
+            response = profile.runcall(self.get_response, request)
+        else:
+            with StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL) as sampler:
+                response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        label = re.sub(r'[^\w.-]+', '_', match.view_name if match else request.path).strip('_') or 'request'
+        name = '%s-%s-%s%s' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime()), label[:60],
+                               uuid.uuid4().hex[:8], PROFILERS[profiler])
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        path = os.path.join(settings.PROFILING_DIR, name)
+        if profiler == 'cprofile':
+            profile.dump_stats(path)
+        else:
+            with open(path, 'w') as f:
+                f.write(sampler.collapsed())
+        _prune()
+
+        response[HEADER] = '%s; duration=%.1fms' % (
+            reverse('onlinecourse:download_profile', args=(name,)), elapsed_ms)
+        return response
+
+
+@staff_member_required
+def profile_list(request):
+    return render(request, 'onlinecourse/profile_list.html', {'profiles': list_profiles()})
+
+
+@staff_member_required
+def download_profile(request, name):
+    path = profile_path(name)
+    if not os.path.isfile(path):
+        raise Http404('Profile not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name,
+                        content_type='application/octet-stream')
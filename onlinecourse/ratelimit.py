@@ -0,0 +1,171 @@
+"""
+Rate limiting and admission control for expensive endpoints.
+
+:func:`ratelimit` keeps token buckets in the shared cache tier, so all
+workers draw from the same buckets.  Buckets are scoped per URL name and
+keyed by client IP, authenticated user or attempted username from that
+IP; a request needs a token from every bucket it is keyed by.  Behind
+proxies the client IP is read from ``X-Forwarded-For`` (see
+:func:`client_ip`).  Rates come from
+``settings.RATELIMITS``.
+
+:func:`admission_control` caps how many requests may run a section of
+expensive work (such as password hashing) at once in this process.
+Requests over the cap are turned away immediately with 429 instead of
+queueing until the worker times out.
+"""
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .cache import SHARED_ALIAS
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Parse ``'10/m'`` into ``(capacity, tokens per second)``."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def client_ip(request):
+    """
+    The address of the client, as seen by the outermost of our
+    ``RATELIMIT_TRUSTED_PROXIES`` proxies.
+
+    Each trusted proxy appends the address it received the request from to
+    ``X-Forwarded-For``, so the client is that many entries from the right;
+    anything further left is client-controlled.  Without the header (or
+    with no trusted proxies) the socket address is used.
+    """
+    hops = settings.RATELIMIT_TRUSTED_PROXIES
+    value = request.META.get(settings.RATELIMIT_IP_HEADER) if hops else None
+    if not value:
+        return request.META.get('REMOTE_ADDR', '')
+    addresses = [address.strip() for address in value.split(',') if address.strip()]
+    if not addresses:
+        return request.META.get('REMOTE_ADDR', '')
+    return addresses[max(0, len(addresses) - hops)]
+
+
+def _ip_key(request):
+    return client_ip(request)
+
+
+def _user_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return str(user.pk)
+    return None
+
+
+def _username_key(request):
+    # Scoped to the IP: keyed by username alone, anyone could lock a user
+    # out by posting bad passwords for their name
+    username = request.POST.get('username')
+    return '%s@%s' % (username.lower(), client_ip(request)) if username else None
+
+
+KEY_FUNCTIONS = {
+    'ip': _ip_key,
+    'user': _user_key,
+    'username': _username_key,
+}
+
+
+def take_token(bucket, capacity, refill_rate, now=None):
+    """
+    Take a token from ``bucket``.  Returns 0 if one was available, otherwise
+    the number of seconds until the next token.
+
+    The read-modify-write is not atomic; under a race a bucket can hand out
+    a token or two too many, which is acceptable for load shedding.
+    """
+    cache = caches[SHARED_ALIAS]
+    now = time.time() if now is None else now
+    tokens, updated = cache.get(bucket) or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    retry_after = 0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        retry_after = (1 - tokens) / refill_rate
+    # Keep the bucket only as long as it takes to refill completely
+    cache.set(bucket, (tokens, now), math.ceil(capacity / refill_rate) + 1)
+    return retry_after
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse('Too many requests, please try again later.',
+                            status=429, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def ratelimit(*keys, methods=('POST',)):
+    """
+    Limit a view with token buckets keyed by each of ``keys``
+    (``'ip'``, ``'user'`` or ``'username'``).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if settings.RATELIMIT_ENABLED and request.method in methods:
+                match = request.resolver_match
+                scope = match.url_name if match else view_func.__name__
+                rate = settings.RATELIMITS.get(scope)
+                if rate:
+                    capacity, refill_rate = parse_rate(rate)
+                    retry_after = 0
+                    for key in keys:
+                        value = KEY_FUNCTIONS[key](request)
+                        if value is None:
+                            continue
+                        digest = hashlib.sha1(value.encode()).hexdigest()[:16]
+                        bucket = 'ratelimit:%s:%s:%s' % (scope, key, digest)
+                        retry_after = max(retry_after, take_token(bucket, capacity, refill_rate))
+                    if retry_after:
+                        return too_many_requests(retry_after)
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _get_slots(pool):
+    with _slots_lock:
+        if pool not in _slots:
+            _slots[pool] = threading.BoundedSemaphore(settings.CONCURRENCY_LIMITS[pool])
+        return _slots[pool]
+
+
+def admission_control(pool, methods=('POST',)):
+    """
+    Allow at most ``settings.CONCURRENCY_LIMITS[pool]`` requests of all views
+    sharing ``pool`` to run at once in this process; reject the rest with 429.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in methods:
+                return view_func(request, *args, **kwargs)
+            slots = _get_slots(pool)
+            if not slots.acquire(blocking=False):
+                return too_many_requests(settings.CONCURRENCY_RETRY_AFTER)
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                slots.release()
+        return _wrapped_view
+    return decorator
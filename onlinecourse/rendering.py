@@ -0,0 +1,39 @@
+"""
+Template cache warm-up.
+
+With the cached loader (see ``TEMPLATE_CACHE`` in settings) each process
+compiles a template the first time it is rendered.  Calling
+:func:`warm_template_cache` before workers are forked compiles the pages
+once in the master, so every worker starts with them in memory instead of
+paying for the parse on its first requests.
+"""
+from django.template import TemplateDoesNotExist, engines
+
+PAGE_TEMPLATES = [
+    'onlinecourse/course_list_bootstrap.html',
+    'onlinecourse/course_detail_bootstrap.html',
+    'onlinecourse/exam_result_bootstrap.html',
+    'onlinecourse/user_login_bootstrap.html',
+    'onlinecourse/user_registration_bootstrap.html',
+]
+# Loaded by the pages through {% extends %} and {% include %}
+SHARED_TEMPLATES = [
+    'onlinecourse/base.html',
+    'onlinecourse/partials/navbar.html',
+    'onlinecourse/partials/login_form.html',
+    'onlinecourse/partials/messages.html',
+    'onlinecourse/course_image.html',
+]
+
+
+def warm_template_cache():
+    """Compile the site's templates into the cached loader; return how many were loaded."""
+    engine = engines['django']
+    loaded = 0
+    for name in PAGE_TEMPLATES + SHARED_TEMPLATES:
+        try:
+            engine.get_template(name)
+        except TemplateDoesNotExist:
+            continue
+        loaded += 1
+    return loaded
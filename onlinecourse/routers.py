@@ -0,0 +1,91 @@
+"""
+Database routing for read replicas.
+
+Reads only go to a replica inside an explicit read-only scope, either a view
+wrapped with :func:`read_from_replica` or a block wrapped with
+:func:`replica_reads`.  Everything else, and every write, uses ``default``.
+
+A user who has just written something (enrolled, submitted an exam) is
+pinned to the primary for ``DATABASE_REPLICA_PIN_SECONDS`` so that replica
+lag never hides their own write from them.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+_read_alias = ContextVar('onlinecourse_read_alias', default=None)
+
+PIN_SESSION_KEY = '_db_primary_until'
+
+
+def choose_replica():
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    if not replicas:
+        return None
+    return random.choice(replicas)
+
+
+@contextmanager
+def replica_reads(alias=None):
+    """Route reads inside the block to a replica, if any are configured."""
+    token = _read_alias.set(alias or choose_replica())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def pin_to_primary(request):
+    """Keep this user's reads on the primary for a short while after a write."""
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session[PIN_SESSION_KEY] = time.time() + settings.DATABASE_REPLICA_PIN_SECONDS
+
+
+def is_pinned_to_primary(request):
+    session = getattr(request, 'session', None)
+    if session is None:
+        return False
+    return session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def read_from_replica(view_func):
+    """
+    View decorator that sends the view's reads to a replica.
+
+    Template responses are rendered inside the scope too, since lazy
+    querysets in the template are evaluated at render time.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if is_pinned_to_primary(request):
+            return view_func(request, *args, **kwargs)
+        # Resolve the lazy user on the primary: a freshly registered user
+        # may not have reached the replica yet.
+        user = getattr(request, 'user', None)
+        if user is not None:
+            user.is_authenticated
+        with replica_reads():
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+    return _wrapped_view
+
+
+class ReplicaRouter:
+    """Send reads in a replica scope to that replica, and all writes to default."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
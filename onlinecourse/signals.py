@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .jobs import enqueue
+from .models import Choice, Course, Question, QuestionPool
+from .snapshots import invalidate_exam_snapshot, invalidate_question_exam_snapshot
+
+
+@receiver([post_save, post_delete], sender=QuestionPool)
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    invalidate_exam_snapshot(instance.course_id)
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    invalidate_question_exam_snapshot(instance.question_id)
+
+
+@receiver(pre_save, sender=Course)
+def course_image_uploaded(sender, instance, **kwargs):
+    # A newly uploaded file is written to storage during save; note it now
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+
+
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, **kwargs):
+    if getattr(instance, '_image_uploaded', False):
+        # Resize in the background worker; the catalog falls back to
+        # generating on first view if the worker hasn't got to it yet
+        enqueue('course_image_variants', {'course_id': instance.pk},
+                idempotency_key='course_image_variants:%s' % instance.image.name)
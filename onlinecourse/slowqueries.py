@@ -0,0 +1,211 @@
+"""
+Slow query log.
+
+:class:`SlowQueryMiddleware` times every SQL query of a request through
+``connection.execute_wrapper()``.  Queries that take at least
+``SLOW_QUERY_THRESHOLD_MS`` are kept in memory with the view that ran
+them and the innermost ``onlinecourse`` frame they came from, and are
+written to :class:`~onlinecourse.models.SlowQuery` once the response has
+been sent (on ``request_finished``), aggregated by fingerprint: the
+statement with literals, placeholders and ``IN`` lists blanked out.
+
+The first time a fingerprint is seen, the query plan is captured with
+``EXPLAIN`` (``EXPLAIN QUERY PLAN`` on SQLite) using the original
+parameters.  Parameter values are never stored, only their types.  Staff
+see the aggregates at ``staff/slow-queries/``.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_finished
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest
+from django.shortcuts import render
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+MAX_STATEMENT_LENGTH = 10000
+PAGE_SIZE = 100
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'mysql': 'EXPLAIN ',
+}
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%s|\?')
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+REPEATED_ROWS_RE = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Slow queries of the request being handled in this thread, written on request_finished
+_pending = threading.local()
+
+
+def normalize(sql):
+    """Blank out the values in ``sql``, so queries that differ only in values compare equal."""
+    sql = STRING_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    sql = REPEATED_ROWS_RE.sub('(...)', sql)
+    return WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(statement):
+    return hashlib.sha1(statement.encode()).hexdigest()[:16]
+
+
+def _shape(value):
+    if isinstance(value, (list, tuple)):
+        return '%s[%d]' % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def params_shape(params, many=False):
+    """Describe the parameters by type and length only, e.g. ``int, str, list[3]``."""
+    if many:
+        rows = list(params)
+        return '%d x (%s)' % (len(rows), params_shape(rows[0]) if rows else '')
+    if not params:
+        return ''
+    if isinstance(params, dict):
+        return ', '.join('%s: %s' % (key, _shape(value)) for key, value in params.items())
+    return ', '.join(_shape(value) for value in params)
+
+
+def _caller():
+    """The innermost frame of this app outside this module, as ``path:line in function``."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != __file__:
+            return '%s:%d in %s' % (os.path.relpath(filename, settings.BASE_DIR), frame.f_lineno,
+                                    frame.f_code.co_name)
+        frame = frame.f_back
+    return ''
+
+
+def explain(alias, sql, params):
+    """Return the plan of a SELECT statement, or '' for other statements and unknown databases."""
+    connection = connections[alias]
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return ''
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+def record_slow_queries(queries):
+    """Add ``queries`` to the SlowQuery aggregates, explaining fingerprints not seen before."""
+    from .models import SlowQuery
+
+    by_fingerprint = defaultdict(list)
+    for query in queries:
+        by_fingerprint[query['fingerprint']].append(query)
+    for key, group in by_fingerprint.items():
+        total_ms = sum(query['duration_ms'] for query in group)
+        max_ms = max(query['duration_ms'] for query in group)
+        aggregate = {
+            'calls': F('calls') + len(group),
+            'total_ms': F('total_ms') + total_ms,
+            'max_ms': Greatest('max_ms', Value(max_ms, output_field=FloatField())),
+            'last_seen': now(),
+        }
+        if SlowQuery.objects.filter(fingerprint=key).update(**aggregate):
+            continue
+        first = group[0]
+        try:
+            plan = '' if first['many'] else explain(first['alias'], first['sql'], first['params'])
+        except Exception as e:
+            plan = 'EXPLAIN failed: %s' % e
+        try:
+            with transaction.atomic():
+                SlowQuery.objects.create(
+                    fingerprint=key, statement=first['statement'], example=first['sql'][:MAX_STATEMENT_LENGTH],
+                    params_shape=first['params_shape'][:200], database=first['alias'],
+                    view=first['view'][:200], location=first['location'][:300], plan=plan,
+                    calls=len(group), total_ms=total_ms, max_ms=max_ms)
+        except IntegrityError:
+            # Another worker recorded this fingerprint first
+            SlowQuery.objects.filter(fingerprint=key).update(**aggregate)
+
+
+def flush_slow_queries(**kwargs):
+    queries = getattr(_pending, 'queries', None)
+    _pending.queries = None
+    if not queries:
+        return
+    try:
+        record_slow_queries(queries)
+    except Exception:
+        logger.warning('Recording %d slow queries failed', len(queries), exc_info=True)
+
+
+class SlowQueryMiddleware:
+    """Time the queries of each request and keep the slow ones."""
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_LOG_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        request_finished.connect(flush_slow_queries, dispatch_uid='onlinecourse.slowqueries')
+
+    def __call__(self, request):
+        pending = _pending.queries = []
+        threshold_ms = settings.SLOW_QUERY_THRESHOLD_MS
+
+        def timed(alias):
+            def wrapper(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    duration_ms = (time.perf_counter() - started) * 1000
+                    if duration_ms >= threshold_ms:
+                        statement = normalize(sql)[:MAX_STATEMENT_LENGTH]
+                        match = request.resolver_match
+                        pending.append({
+                            'fingerprint': fingerprint(statement), 'statement': statement,
+                            'sql': sql, 'params': params, 'many': many,
+                            'params_shape': params_shape(params, many), 'alias': alias,
+                            'view': match.view_name if match else request.path,
+                            'location': _caller(), 'duration_ms': duration_ms,
+                        })
+            return wrapper
+
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(timed(alias)))
+            return self.get_response(request)
+
+
+@staff_member_required
+def slow_query_list(request):
+    from .models import SlowQuery
+
+    ordering = {'total': '-total_ms', 'max': '-max_ms', 'calls': '-calls', 'recent': '-last_seen'}
+    order = request.GET.get('order', 'total')
+    queries = SlowQuery.objects.order_by(ordering.get(order, '-total_ms'))[:PAGE_SIZE]
+    return render(request, 'onlinecourse/slow_query_list.html', {
+        'queries': queries, 'order': order, 'threshold_ms': settings.SLOW_QUERY_THRESHOLD_MS,
+    })
@@ -0,0 +1,172 @@
+"""
+Compiled exam snapshots.
+
+A snapshot is a plain, serialisable description of a course's exam: its
+questions and their choices, in display order, with ids, content and
+grades.  It never contains ``is_correct``, so it is safe to hand to the
+browser.  Rendering the exam form from a snapshot avoids walking
+Course -> Question -> Choice through the ORM on every request.
+
+Snapshots are cached under the course's versioned ``exam:<id>`` namespace;
+any QuestionPool, Question or Choice change bumps that namespace (see
+``signals.py``) once its transaction commits, and snapshots are compiled
+from the primary, so a compile never caches rows older than the version it
+is stored under.  Inside :func:`deferred_invalidation` those bumps are
+collected and applied once per course when the block exits, so saving a
+page of rows doesn't invalidate the same course once per row.
+
+Courses with question pools give each learner a sample of every pool.  The
+sample is drawn from the snapshot's id lists with a per-enrollment seed and
+stored on the enrollment as a single list of ids.
+"""
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import get_namespace_version, invalidate, versioned_key
+from .models import Choice, Course, Enrollment, Question, QuestionPool
+from .routers import replica_reads
+
+
+def exam_namespace(course_id):
+    return 'exam:%s' % course_id
+
+
+def build_exam_snapshot(course_id, version=None):
+    """Compile the snapshot from the database, or return None for an unknown course."""
+    if not Course.objects.filter(pk=course_id).exists():
+        return None
+    choices = defaultdict(list)
+    for choice in (Choice.objects.filter(question__course_id=course_id)
+                   .order_by('question_id', 'id').values('id', 'question_id', 'content')):
+        choices[choice['question_id']].append({'id': choice['id'], 'content': choice['content']})
+    questions = [
+        dict(question, choices=choices[question['id']])
+        for question in (Question.objects.filter(course_id=course_id)
+                         .order_by('id').values('id', 'pool', 'content', 'grade'))
+    ]
+    # JSON object keys are strings
+    pools = {str(pool_id): sample_size for pool_id, sample_size in
+             QuestionPool.objects.filter(course_id=course_id).values_list('id', 'sample_size')}
+    return {'course_id': course_id, 'version': version, 'pools': pools, 'questions': questions}
+
+
+def get_exam_snapshot(course_id):
+    """Return the cached snapshot for a course, compiling it on a miss."""
+    namespace = exam_namespace(course_id)
+    # Read the version before compiling: if the exam changes meanwhile, the
+    # result is stored under the old, already unreachable key.
+    version = get_namespace_version(namespace)
+    key = versioned_key(namespace, 'snapshot', version=version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        # From the primary: a lagging replica could still hold the rows of
+        # the version before this one
+        with replica_reads('default'):
+            snapshot = build_exam_snapshot(course_id, version)
+        if snapshot is not None:
+            cache.set(key, snapshot, settings.EXAM_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+# (course ids, question ids) awaiting invalidation inside deferred_invalidation()
+_deferred = ContextVar('deferred_exam_invalidations', default=None)
+
+
+def _invalidate_on_commit(course_id):
+    # Bumping before the commit would let a concurrent reader compile the
+    # old rows under the new version
+    namespace = exam_namespace(course_id)
+    transaction.on_commit(lambda: invalidate(namespace))
+
+
+def invalidate_exam_snapshot(course_id):
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred[0].add(course_id)
+    else:
+        _invalidate_on_commit(course_id)
+
+
+def invalidate_question_exam_snapshot(question_id):
+    """Invalidate the snapshot of the course a question belongs to."""
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred[1].add(question_id)
+        return
+    course_id = Question.objects.filter(pk=question_id).values_list('course_id', flat=True).first()
+    # A choice deleted along with its question: the question's own signal covers it
+    if course_id is not None:
+        _invalidate_on_commit(course_id)
+
+
+@contextmanager
+def deferred_invalidation():
+    """Invalidate each affected course's snapshot once, when the block exits."""
+    if _deferred.get() is not None:
+        # Nested: the outermost block invalidates
+        yield
+        return
+    course_ids, question_ids = set(), set()
+    token = _deferred.set((course_ids, question_ids))
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        if question_ids:
+            course_ids.update(Question.objects.filter(pk__in=question_ids).values_list('course_id', flat=True))
+        for course_id in course_ids:
+            _invalidate_on_commit(course_id)
+
+
+def sample_question_ids(snapshot, seed):
+    """Pick every unpooled question plus ``sample_size`` questions from each pool."""
+    rng = random.Random(seed)
+    chosen = set()
+    pooled = defaultdict(list)
+    for question in snapshot['questions']:
+        if question['pool'] is None:
+            chosen.add(question['id'])
+        else:
+            pooled[question['pool']].append(question['id'])
+    for pool_id in sorted(pooled):
+        sample_size = snapshot['pools'].get(str(pool_id))
+        if sample_size is None:
+            # A pool of another course, saved before Question.clean() existed
+            continue
+        ids = pooled[pool_id]
+        chosen.update(rng.sample(ids, min(sample_size, len(ids))))
+    return [question['id'] for question in snapshot['questions'] if question['id'] in chosen]
+
+
+def exam_for_enrollment(snapshot, enrollment):
+    """
+    Narrow a snapshot to the questions this learner is asked.
+
+    Without pools everyone gets the whole exam and nothing is stored.  With
+    pools, the sample is drawn once per enrollment (seeded by its id) and
+    saved; a visitor who isn't enrolled only sees the unpooled questions.
+    """
+    if snapshot is None or not snapshot['pools']:
+        return snapshot
+    if enrollment is None:
+        question_ids = [q['id'] for q in snapshot['questions'] if q['pool'] is None]
+    else:
+        question_ids = enrollment.exam_question_ids
+        if question_ids is None:
+            # The enrollment may have been read from a lagging replica; the
+            # sample already stored, if any, is on the primary
+            question_ids = Enrollment.objects.using('default').filter(pk=enrollment.pk).values_list(
+                'exam_question_ids', flat=True).first()
+        if question_ids is None:
+            question_ids = sample_question_ids(snapshot, seed=enrollment.pk)
+            Enrollment.objects.filter(pk=enrollment.pk, exam_question_ids__isnull=True).update(
+                exam_question_ids=question_ids)
+        enrollment.exam_question_ids = question_ids
+    question_ids = set(question_ids)
+    return dict(snapshot, questions=[q for q in snapshot['questions'] if q['id'] in question_ids])
@@ -0,0 +1,23 @@
+from django.utils import timezone
+
+from .images import get_variants
+from .jobs import task
+from .leaderboard import record_score
+from .models import Course, Submission
+
+
+@task('grade_submission')
+def grade_submission(submission_id):
+    submission = Submission.objects.select_related('enrollment').get(id=submission_id)
+    score = submission.compute_score()
+    graded_at = timezone.now()
+    Submission.objects.filter(id=submission_id).update(score=score, graded_at=graded_at)
+    enrollment = submission.enrollment
+    record_score(enrollment.course_id, enrollment.user_id, score, graded_at)
+
+
+@task('course_image_variants')
+def course_image_variants(course_id):
+    course = Course.objects.filter(id=course_id).first()
+    if course is not None:
+        get_variants(course.image)
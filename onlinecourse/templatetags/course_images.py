@@ -0,0 +1,26 @@
+from django import template
+
+from ..images import get_variants
+
+register = template.Library()
+
+
+@register.inclusion_tag('onlinecourse/course_image.html')
+def course_image(image, size=240, alt='', css_class=''):
+    """
+    Render ``image`` as a ``<picture>`` with WebP and JPEG ``srcset``s, so
+    the browser downloads the smallest variant for a ``size``-pixel box.
+    Falls back to the original when no variants can be made.
+    """
+    context = {'image': image, 'size': size, 'alt': alt, 'css_class': css_class, 'sources': [], 'src': None}
+    variants = get_variants(image)
+    if variants:
+        storage = image.storage
+        for mime_type, names in variants.items():
+            srcset = ', '.join('%s %dw' % (storage.url(name), width) for name, width in names)
+            context['sources'].append({'type': mime_type, 'srcset': srcset})
+        # The last format (JPEG) is understood everywhere; its smallest variant is the plain src
+        context['src'] = storage.url(variants[list(variants)[-1]][0][0])
+    elif image:
+        context['src'] = image.url
+    return context
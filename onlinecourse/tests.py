@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
@@ -8,6 +8,7 @@ from .models import (
     Enrollment, Question, Choice, Submission
 )
 import json
+import logging
 
 
 class InstructorModelTest(TestCase):
@@ -885,3 +886,1851 @@ class UtilityFunctionsTest(TestCase):
         self.assertEqual(len(answers), 2)
         self.assertIn(10, answers)
         self.assertIn(20, answers)
+
+
+class TieredCacheTest(TestCase):
+    """Test cases for the two-tier cache and versioned keys"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        self.cache = caches['default']
+        self.local = caches['local']
+        self.shared = caches['shared']
+
+    def test_set_writes_both_tiers(self):
+        """Test a write lands in the local and the shared tier"""
+        self.cache.set('course', 'value')
+        self.assertEqual(self.local.get('course'), 'value')
+        self.assertEqual(self.shared.get('course'), 'value')
+
+    def test_get_reads_through_to_shared_tier(self):
+        """Test a local miss is filled from the shared tier"""
+        self.shared.set('course', 'from-shared')
+        self.assertIsNone(self.local.get('course'))
+        self.assertEqual(self.cache.get('course'), 'from-shared')
+        self.assertEqual(self.local.get('course'), 'from-shared')
+
+    def test_delete_removes_from_both_tiers(self):
+        """Test delete clears the key everywhere"""
+        self.cache.set('course', 'value')
+        self.cache.delete('course')
+        self.assertIsNone(self.local.get('course'))
+        self.assertIsNone(self.shared.get('course'))
+
+    def test_versioned_key_invalidation(self):
+        """Test invalidate() moves a namespace to fresh keys"""
+        from .cache import versioned_key, invalidate
+
+        key = versioned_key('course:1', 'exam')
+        self.cache.set(key, 'old')
+        self.assertEqual(versioned_key('course:1', 'exam'), key)
+
+        invalidate('course:1')
+        new_key = versioned_key('course:1', 'exam')
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(self.cache.get(new_key))
+        # Other namespaces are untouched
+        self.assertEqual(versioned_key('course:2', 'exam'), versioned_key('course:2', 'exam'))
+
+
+class ReplicaRouterTest(TestCase):
+    """Test cases for read-replica routing"""
+
+    def setUp(self):
+        from .routers import ReplicaRouter
+        self.router = ReplicaRouter()
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+
+    def test_reads_use_default_outside_replica_scope(self):
+        """Test reads are not routed unless a view opts in"""
+        self.assertIsNone(self.router.db_for_read(Course))
+        self.assertEqual(self.router.db_for_write(Course), 'default')
+
+    def test_reads_use_replica_inside_scope(self):
+        """Test reads inside replica_reads() go to a configured replica"""
+        from django.test import override_settings
+        from .routers import replica_reads
+
+        with override_settings(DATABASE_REPLICAS=['replica_1']):
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(Course), 'replica_1')
+                self.assertEqual(self.router.db_for_write(Course), 'default')
+        self.assertIsNone(self.router.db_for_read(Course))
+
+    def test_enroll_pins_user_to_primary(self):
+        """Test a user who just enrolled reads from the primary"""
+        from .routers import PIN_SESSION_KEY, is_pinned_to_primary
+        from django.test import RequestFactory
+
+        self.client.login(username='student', password='testpass123')
+        self.client.get(reverse('onlinecourse:enroll', args=[self.course.id]), secure=True)
+        self.assertIn(PIN_SESSION_KEY, self.client.session)
+
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        self.assertTrue(is_pinned_to_primary(request))
+
+
+class ReplicaDatabaseTest(TestCase):
+    """Test cases for replica routing against a second SQLite database (see conftest.py)"""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Primary Course',
+            description='Only on the primary'
+        )
+        # The replica starts out empty, like one that hasn't caught up yet
+        replicas = override_settings(DATABASE_REPLICAS=['replica'])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    def test_replica_scope_reads_from_replica(self):
+        """Test reads in replica_reads() come from the replica and writes go to the primary"""
+        from .routers import replica_reads
+
+        Course.objects.using('replica').create(name='Replica Course', description='Only on the replica')
+        with replica_reads():
+            self.assertEqual(list(Course.objects.values_list('name', flat=True)), ['Replica Course'])
+            Course.objects.create(name='Written', description='Inside the scope')
+        self.assertEqual(set(Course.objects.values_list('name', flat=True)), {'Primary Course', 'Written'})
+        self.assertFalse(Course.objects.using('replica').filter(name='Written').exists())
+
+    def test_course_list_reads_from_replica(self):
+        """Test a read-only view renders the replica's rows"""
+        Course.objects.using('replica').create(name='Replica Course', description='Only on the replica')
+        response = self.client.get(reverse('onlinecourse:index'), secure=True)
+        self.assertContains(response, 'Replica Course')
+        self.assertNotContains(response, 'Primary Course')
+
+    def test_pinned_user_reads_from_primary(self):
+        """Test a user who just enrolled sees the primary despite the lagging replica"""
+        self.client.login(username='student', password='testpass123')
+        url = reverse('onlinecourse:course_details', args=[self.course.id])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 404)
+
+        self.client.get(reverse('onlinecourse:enroll', args=[self.course.id]), secure=True)
+        response = self.client.get(url, secure=True)
+        self.assertContains(response, 'Primary Course')
+        self.assertFalse(Enrollment.objects.using('replica').exists())
+
+
+class JobQueueTest(TestCase):
+    """Test cases for the database-backed job queue"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+        self.enrollment = Enrollment.objects.create(
+            user=self.user,
+            course=self.course
+        )
+        self.question = Question.objects.create(
+            course=self.course,
+            content='Test question',
+            grade=10
+        )
+        self.choice = Choice.objects.create(
+            question=self.question,
+            content='Correct answer',
+            is_correct=True
+        )
+
+    def test_submit_enqueues_grading(self):
+        """Test submit queues grading and the worker stores the score"""
+        from .views import submit
+        from .jobs import run_pending
+        from .models import Job
+        from django.test import RequestFactory
+
+        request = RequestFactory().post(
+            f'/onlinecourse/{self.course.id}/submit/',
+            {'choice': str(self.choice.id)}
+        )
+        request.user = self.user
+        submit(request, self.course.id)
+
+        submission = Submission.objects.get(enrollment=self.enrollment)
+        self.assertIsNone(submission.score)
+        self.assertEqual(Job.objects.filter(task='grade_submission').count(), 1)
+
+        self.assertEqual(run_pending(), 1)
+        submission.refresh_from_db()
+        self.assertEqual(submission.score, 10)
+        self.assertIsNotNone(submission.graded_at)
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_enqueue_idempotency_key(self):
+        """Test the same idempotency key only queues one job"""
+        from .jobs import enqueue
+        from .models import Job
+
+        first = enqueue('grade_submission', {'submission_id': 1}, idempotency_key='grade:1')
+        second = enqueue('grade_submission', {'submission_id': 1}, idempotency_key='grade:1')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_failed_job_is_retried_then_failed(self):
+        """Test failures are retried with backoff until max_attempts"""
+        from .jobs import enqueue, run_pending, task
+        from .models import Job
+
+        @task('always_fails')
+        def always_fails():
+            raise RuntimeError('boom')
+
+        job = enqueue('always_fails', max_attempts=2)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_expired_lock_is_reclaimed(self):
+        """Test a job abandoned by a worker becomes visible again"""
+        from datetime import timedelta
+        from .jobs import claim, enqueue
+        from .models import Job
+
+        job = enqueue('grade_submission', {'submission_id': 1})
+        self.assertEqual(len(claim(worker='worker-a')), 1)
+        self.assertEqual(claim(worker='worker-b'), [])
+
+        Job.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim(worker='worker-b')
+        self.assertEqual([j.id for j in reclaimed], [job.id])
+        self.assertEqual(reclaimed[0].attempts, 2)
+
+    def test_expired_lock_on_last_attempt_fails(self):
+        """Test a job that keeps killing its worker is failed after max_attempts"""
+        from datetime import timedelta
+        from .jobs import claim, enqueue
+        from .models import Job
+
+        job = enqueue('grade_submission', {'submission_id': 1}, max_attempts=2)
+        for worker in ('worker-a', 'worker-b'):
+            self.assertEqual(len(claim(worker=worker)), 1)
+            Job.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(claim(worker='worker-c'), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('Lock expired', job.last_error)
+
+
+class IdempotentSubmitTest(TestCase):
+    """Test cases for duplicate exam POST detection"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+        self.enrollment = Enrollment.objects.create(
+            user=self.user,
+            course=self.course
+        )
+        self.question = Question.objects.create(
+            course=self.course,
+            content='Test question',
+            grade=10
+        )
+        self.choice = Choice.objects.create(
+            question=self.question,
+            content='Correct answer',
+            is_correct=True
+        )
+
+    def _submit(self, token):
+        from .views import submit
+        from django.test import RequestFactory
+
+        request = RequestFactory().post(
+            f'/onlinecourse/{self.course.id}/submit/',
+            {'choice_1': str(self.choice.id), 'submission_token': token}
+        )
+        request.user = self.user
+        return submit(request, self.course.id)
+
+    def test_replayed_post_reuses_submission(self):
+        """Test the same token twice creates one submission and one redirect target"""
+        first = self._submit('a' * 32)
+        second = self._submit('a' * 32)
+
+        self.assertEqual(Submission.objects.filter(enrollment=self.enrollment).count(), 1)
+        self.assertEqual(first['Location'], second['Location'])
+
+    def test_new_token_creates_new_submission(self):
+        """Test a fresh form (new token) is a new attempt"""
+        self._submit('a' * 32)
+        self._submit('b' * 32)
+        self.assertEqual(Submission.objects.filter(enrollment=self.enrollment).count(), 2)
+
+    def test_oversized_token_is_rejected(self):
+        """Test a token longer than the column is a 400, not silently dropped"""
+        self.assertEqual(self._submit('a' * 65).status_code, 400)
+        self.assertEqual(Submission.objects.count(), 0)
+
+    def test_integrity_error_without_token_is_raised(self):
+        """Test a conflict that can't be a replayed form isn't mistaken for one"""
+        from unittest import mock
+        from django.db import IntegrityError
+
+        with mock.patch.object(Submission.objects, 'create', side_effect=IntegrityError('boom')):
+            with self.assertRaises(IntegrityError):
+                self._submit('')
+            # With a token that matches no submission, the conflict was something else
+            with self.assertRaises(IntegrityError):
+                self._submit('a' * 32)
+
+    def test_course_detail_renders_token(self):
+        """Test the exam form carries a submission token"""
+        self.client.login(username='student', password='testpass123')
+        response = self.client.get(
+            reverse('onlinecourse:course_details', args=[self.course.id]),
+            secure=True
+        )
+        token = response.context['submission_token']
+        self.assertContains(response, f'name="submission_token" value="{token}"')
+
+
+class RateLimitTest(TestCase):
+    """Test cases for rate limiting and admission control"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+
+    def _login(self, password='wrongpassword'):
+        return self.client.post(reverse('onlinecourse:login'), {
+            'username': 'testuser',
+            'psw': password
+        }, secure=True)
+
+    def test_login_is_rate_limited(self):
+        """Test login returns 429 with Retry-After once the bucket is empty"""
+        from django.test import override_settings
+
+        with override_settings(RATELIMITS={'login': '2/m'}):
+            self.assertEqual(self._login().status_code, 200)
+            self.assertEqual(self._login().status_code, 200)
+            response = self._login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_clients_behind_proxy_have_separate_buckets(self):
+        """Test the client IP comes from the trusted X-Forwarded-For hop, not the proxy's address"""
+        from django.test import override_settings
+
+        def login_from(address):
+            return self.client.post(reverse('onlinecourse:login'), {'username': 'other', 'psw': 'wrong'},
+                                    secure=True, REMOTE_ADDR='10.0.0.1',
+                                    HTTP_X_FORWARDED_FOR='6.6.6.6, %s' % address)
+
+        with override_settings(RATELIMITS={'login': '1/m'}):
+            self.assertEqual(login_from('203.0.113.1').status_code, 200)
+            self.assertEqual(login_from('203.0.113.1').status_code, 429)
+            self.assertEqual(login_from('203.0.113.2').status_code, 200)
+
+    def test_failed_logins_from_elsewhere_dont_lock_out_user(self):
+        """Test the username bucket is scoped to the client IP"""
+        from django.test import override_settings
+
+        with override_settings(RATELIMITS={'login': '1/m'}):
+            self.client.post(reverse('onlinecourse:login'), {'username': 'testuser', 'psw': 'wrong'},
+                             secure=True, HTTP_X_FORWARDED_FOR='198.51.100.7')
+            response = self.client.post(reverse('onlinecourse:login'),
+                                        {'username': 'testuser', 'psw': 'testpass123'},
+                                        secure=True, HTTP_X_FORWARDED_FOR='203.0.113.1')
+        self.assertEqual(response.status_code, 302)
+
+    def test_login_page_get_is_not_limited(self):
+        """Test only POSTs draw tokens"""
+        from django.test import override_settings
+
+        with override_settings(RATELIMITS={'login': '1/m'}):
+            for _ in range(3):
+                response = self.client.get(reverse('onlinecourse:login'), secure=True)
+                self.assertEqual(response.status_code, 200)
+
+    def test_token_bucket_refills(self):
+        """Test tokens come back at the configured rate"""
+        from .ratelimit import take_token
+
+        self.assertEqual(take_token('bucket', 1, 1.0, now=100.0), 0)
+        self.assertAlmostEqual(take_token('bucket', 1, 1.0, now=100.5), 0.5)
+        self.assertEqual(take_token('bucket', 1, 1.0, now=102.0), 0)
+
+    def test_password_hashing_concurrency_cap(self):
+        """Test requests beyond the hashing concurrency cap are shed with 429"""
+        from .ratelimit import _get_slots
+
+        slots = _get_slots('password_hashing')
+        held = 0
+        while slots.acquire(blocking=False):
+            held += 1
+        try:
+            response = self._login(password='testpass123')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+        finally:
+            for _ in range(held):
+                slots.release()
+        self.assertEqual(self._login(password='testpass123').status_code, 302)
+
+
+class PasswordHashingTest(TestCase):
+    """Test cases for configurable password hashing"""
+
+    def test_login_rehashes_after_cost_change(self):
+        """Test a changed cost is applied transparently on the next login"""
+        from django.test import override_settings
+        from django.conf import settings
+
+        cost = dict(settings.PASSWORD_HASHING_COST, pbkdf2_iterations=1000)
+        with override_settings(PASSWORD_HASHING_COST=cost):
+            user = User.objects.create_user(username='student', password='testpass123')
+        self.assertIn('$1000$', user.password)
+
+        cost['pbkdf2_iterations'] = 2000
+        with override_settings(PASSWORD_HASHING_COST=cost):
+            response = self.client.post(reverse('onlinecourse:login'), {
+                'username': 'student',
+                'psw': 'testpass123'
+            }, secure=True)
+        self.assertEqual(response.status_code, 302)
+        user.refresh_from_db()
+        self.assertIn('$2000$', user.password)
+
+    def test_preferred_hasher_upgrades_on_login(self):
+        """Test switching PASSWORD_HASHER moves users to the new algorithm"""
+        from django.test import override_settings
+
+        user = User.objects.create_user(username='student', password='testpass123')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+        with override_settings(PASSWORD_HASHERS=[
+            'onlinecourse.hashers.ScryptPasswordHasher',
+            'onlinecourse.hashers.PBKDF2PasswordHasher',
+        ]):
+            self.client.post(reverse('onlinecourse:login'), {
+                'username': 'student',
+                'psw': 'testpass123'
+            }, secure=True)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+
+    def test_benchmark_hashers_command(self):
+        """Test the benchmark reports a rate for each hasher"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.test import override_settings
+        from django.conf import settings
+
+        cost = dict(settings.PASSWORD_HASHING_COST, pbkdf2_iterations=1000)
+        out = StringIO()
+        with override_settings(PASSWORD_HASHING_COST=cost):
+            call_command('benchmark_hashers', seconds=0.05, hashers=['pbkdf2_sha256'], stdout=out)
+        self.assertIn('pbkdf2_sha256', out.getvalue())
+        self.assertIn('iterations=1000', out.getvalue())
+
+
+class RegistrationFastPathTest(TestCase):
+    """Test cases for single-insert registration and username checks"""
+
+    def _register(self, username):
+        return self.client.post(reverse('onlinecourse:registration'), {
+            'username': username,
+            'psw': 'testpass123',
+            'firstname': 'New',
+            'lastname': 'User'
+        }, secure=True)
+
+    def test_registration_creates_learner_profile(self):
+        """Test a new user gets a Learner profile and is logged in"""
+        response = self._register('newuser')
+        self.assertEqual(response.status_code, 302)
+
+        user = User.objects.get(username='newuser')
+        self.assertTrue(Learner.objects.filter(user=user).exists())
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.id)
+
+    def test_duplicate_registration_writes_nothing(self):
+        """Test the unique constraint rejects an existing username"""
+        self._register('newuser')
+        self.client.logout()
+        response = self._register('newuser')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'User already exists.')
+        self.assertEqual(User.objects.filter(username='newuser').count(), 1)
+        self.assertEqual(Learner.objects.count(), 1)
+
+    def test_blank_username_is_rejected(self):
+        """Test an empty or whitespace-only username creates no account"""
+        for username in ('', '   '):
+            response = self._register(username)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Please choose a username.')
+        self.assertEqual(User.objects.count(), 0)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_username_is_stripped(self):
+        """Test registration stores the name check_username reported on"""
+        self._register('  bob ')
+        self.assertTrue(User.objects.filter(username='bob').exists())
+        response = self.client.get(reverse('onlinecourse:check_username'), {'username': '  bob'}, secure=True)
+        self.assertEqual(json.loads(response.content), {'username': 'bob', 'available': False})
+
+    def test_check_username(self):
+        """Test the availability endpoint"""
+        User.objects.create_user(username='taken', password='testpass123')
+        url = reverse('onlinecourse:check_username')
+
+        response = self.client.get(url, {'username': 'taken'}, secure=True)
+        self.assertEqual(json.loads(response.content), {'username': 'taken', 'available': False})
+
+        response = self.client.get(url, {'username': 'free'}, secure=True)
+        self.assertEqual(json.loads(response.content), {'username': 'free', 'available': True})
+
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 400)
+
+
+class ExamSnapshotTest(TestCase):
+    """Test cases for compiled exam snapshots"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+        self.question = Question.objects.create(
+            course=self.course,
+            content='What is 2+2?',
+            grade=10
+        )
+        self.choice = Choice.objects.create(
+            question=self.question,
+            content='4',
+            is_correct=True
+        )
+
+    def test_snapshot_contents(self):
+        """Test the snapshot holds ids, content and grades but not answers"""
+        from .snapshots import get_exam_snapshot
+
+        snapshot = get_exam_snapshot(self.course.id)
+        self.assertEqual(snapshot['questions'], [{
+            'id': self.question.id,
+            'pool': None,
+            'content': 'What is 2+2?',
+            'grade': 10,
+            'choices': [{'id': self.choice.id, 'content': '4'}],
+        }])
+        self.assertNotIn('is_correct', json.dumps(snapshot))
+
+    def test_snapshot_invalidated_on_change(self):
+        """Test editing a choice or question recompiles the snapshot"""
+        from .snapshots import get_exam_snapshot
+
+        first = get_exam_snapshot(self.course.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.content = 'four'
+            self.choice.save()
+        second = get_exam_snapshot(self.course.id)
+        self.assertNotEqual(first['version'], second['version'])
+        self.assertEqual(second['questions'][0]['choices'][0]['content'], 'four')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.delete()
+        self.assertEqual(get_exam_snapshot(self.course.id)['questions'], [])
+
+    def test_snapshot_invalidated_after_commit(self):
+        """Test the version is only bumped once the change has committed"""
+        from .snapshots import get_exam_snapshot
+
+        first = get_exam_snapshot(self.course.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.content = 'four'
+            self.choice.save()
+            # Not committed yet: readers keep the old version and the old rows
+            self.assertEqual(get_exam_snapshot(self.course.id)['version'], first['version'])
+        self.assertNotEqual(get_exam_snapshot(self.course.id)['version'], first['version'])
+
+    def test_course_detail_renders_exam_from_snapshot(self):
+        """Test a warm detail page doesn't query questions or choices"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.login(username='student', password='testpass123')
+        url = reverse('onlinecourse:course_details', args=[self.course.id])
+        self.client.get(url, secure=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, secure=True)
+
+        self.assertContains(response, 'What is 2+2?')
+        self.assertContains(response, f'name="choice_{self.choice.id}"')
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('onlinecourse_question', tables)
+        self.assertNotIn('onlinecourse_choice', tables)
+
+    def test_exam_snapshot_json(self):
+        """Test the JSON endpoint serves the snapshot to enrolled users"""
+        url = reverse('onlinecourse:exam_snapshot', args=[self.course.id])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 401)
+
+        self.client.login(username='student', password='testpass123')
+        self.assertEqual(self.client.get(url, secure=True).status_code, 403)
+        Enrollment.objects.create(user=self.user, course=self.course)
+        data = json.loads(self.client.get(url, secure=True).content)
+        self.assertEqual(data['questions'][0]['id'], self.question.id)
+
+        missing = reverse('onlinecourse:exam_snapshot', args=[self.course.id + 100])
+        self.assertEqual(self.client.get(missing, secure=True).status_code, 404)
+
+
+class QuestionPoolTest(TestCase):
+    """Test cases for per-learner sampling from question pools"""
+
+    def setUp(self):
+        from .models import QuestionPool
+
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+        self.enrollment = Enrollment.objects.create(
+            user=self.user,
+            course=self.course
+        )
+        self.pool = QuestionPool.objects.create(course=self.course, name='Bank', sample_size=2)
+        self.fixed = Question.objects.create(course=self.course, content='Always asked', grade=10)
+        self.pooled = [
+            Question.objects.create(course=self.course, pool=self.pool, content=f'Pooled {i}', grade=10)
+            for i in range(5)
+        ]
+
+    def _exam(self):
+        from .snapshots import exam_for_enrollment, get_exam_snapshot
+        return exam_for_enrollment(get_exam_snapshot(self.course.id), self.enrollment)
+
+    def test_sample_is_stored_and_stable(self):
+        """Test each learner gets unpooled questions plus sample_size from the pool"""
+        ids = [q['id'] for q in self._exam()['questions']]
+        self.assertEqual(len(ids), 3)
+        self.assertIn(self.fixed.id, ids)
+
+        self.enrollment.refresh_from_db()
+        self.assertEqual(self.enrollment.exam_question_ids, ids)
+        self.assertEqual([q['id'] for q in self._exam()['questions']], ids)
+
+    def test_not_enrolled_sees_only_unpooled_questions(self):
+        """Test visitors without an enrollment don't see the question bank"""
+        from .snapshots import exam_for_enrollment, get_exam_snapshot
+
+        exam = exam_for_enrollment(get_exam_snapshot(self.course.id), None)
+        self.assertEqual([q['id'] for q in exam['questions']], [self.fixed.id])
+
+    def test_pool_of_another_course(self):
+        """Test a question can't be put in another course's pool, and one already there is skipped"""
+        from django.core.exceptions import ValidationError
+        from .models import QuestionPool
+
+        other = Course.objects.create(name='Other', description='Other')
+        foreign_pool = QuestionPool.objects.create(course=other, name='Foreign', sample_size=1)
+        stray = Question(course=self.course, pool=foreign_pool, content='Stray', grade=10)
+        with self.assertRaises(ValidationError):
+            stray.full_clean()
+
+        stray.save()
+        ids = [q['id'] for q in self._exam()['questions']]
+        self.assertEqual(len(ids), 3)
+        self.assertNotIn(stray.id, ids)
+
+    def test_stored_sample_is_read_from_primary(self):
+        """Test a stale enrollment without a sample reuses the one stored on the primary"""
+        stored = [self.fixed.id, self.pooled[0].id]
+        Enrollment.objects.filter(pk=self.enrollment.pk).update(exam_question_ids=stored)
+        self.assertIsNone(self.enrollment.exam_question_ids)
+        self.assertEqual([q['id'] for q in self._exam()['questions']], stored)
+
+    def test_score_counts_only_sampled_questions(self):
+        """Test grading ignores questions the learner was not asked"""
+        ids = [q['id'] for q in self._exam()['questions']]
+        self.enrollment.refresh_from_db()
+        # No choices anywhere: every asked question is answered "correctly" by selecting nothing
+        submission = Submission.objects.create(enrollment=self.enrollment)
+        self.assertEqual(submission.compute_score(), 10 * len(ids))
+
+        response = self.client.get(
+            reverse('onlinecourse:exam_result', args=[self.course.id, submission.id]),
+            secure=True
+        )
+        self.assertEqual(sorted(q.id for q in response.context['questions']), sorted(ids))
+
+
+class ExamAttemptTest(TestCase):
+    """Test cases for timed exam attempts"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Timed Course',
+            description='Test Description',
+            exam_duration=30
+        )
+        self.enrollment = Enrollment.objects.create(
+            user=self.user,
+            course=self.course
+        )
+        self.question = Question.objects.create(course=self.course, content='Test question', grade=10)
+        self.choice = Choice.objects.create(question=self.question, content='Answer', is_correct=True)
+        self.client.login(username='student', password='testpass123')
+
+    def _start(self):
+        return self.client.post(reverse('onlinecourse:start_exam', args=[self.course.id]), secure=True)
+
+    def _submit(self, attempt_id):
+        return self.client.post(reverse('onlinecourse:submit', args=[self.course.id]), {
+            'choice_1': self.choice.id,
+            'attempt_id': attempt_id
+        }, secure=True)
+
+    def test_start_creates_attempt_and_shows_exam(self):
+        """Test starting an exam creates one active attempt with a deadline"""
+        from .models import ExamAttempt
+
+        self.assertEqual(self._start().status_code, 302)
+        self._start()
+        attempt = ExamAttempt.objects.get()
+        self.assertEqual(attempt.state, ExamAttempt.ACTIVE)
+        self.assertEqual(attempt.course, self.course)
+
+        response = self.client.get(reverse('onlinecourse:course_details', args=[self.course.id]), secure=True)
+        self.assertContains(response, f'name="attempt_id" value="{attempt.id}"')
+        self.assertContains(response, 'Test question')
+
+    def test_exam_snapshot_hidden_until_started(self):
+        """Test the JSON endpoint withholds a timed exam until an attempt is running"""
+        url = reverse('onlinecourse:exam_snapshot', args=[self.course.id])
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 409)
+        self.assertNotContains(response, 'Test question', status_code=409)
+
+        self._start()
+        self.assertContains(self.client.get(url, secure=True), 'Test question')
+
+    def test_exam_snapshot_requires_enrollment(self):
+        """Test a learner who isn't enrolled can't read a timed exam"""
+        User.objects.create_user(username='outsider', password='testpass123')
+        self.client.login(username='outsider', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:exam_snapshot', args=[self.course.id]), secure=True)
+        self.assertEqual(response.status_code, 403)
+        self.assertNotContains(response, 'Test question', status_code=403)
+
+    def test_exam_hidden_until_started(self):
+        """Test a timed exam's questions are not rendered before the attempt starts"""
+        response = self.client.get(reverse('onlinecourse:course_details', args=[self.course.id]), secure=True)
+        self.assertNotContains(response, 'Test question')
+        self.assertContains(response, 'Start Exam (30 minutes)')
+
+    def test_submit_before_deadline(self):
+        """Test submitting in time closes the attempt and links the submission"""
+        from .models import ExamAttempt
+
+        self._start()
+        attempt = ExamAttempt.objects.get()
+        self._submit(attempt.id)
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.state, ExamAttempt.SUBMITTED)
+        self.assertEqual(attempt.submission, Submission.objects.get())
+
+    def test_submit_after_deadline_grades_autosaved_answers(self):
+        """Test a late submit grades the drafts saved before the deadline, not the posted form"""
+        from datetime import timedelta
+        from django.contrib.messages import get_messages
+        from .models import DraftAnswer, ExamAttempt
+
+        self._start()
+        attempt = ExamAttempt.objects.get()
+        wrong = Choice.objects.create(question=self.question, content='Wrong', is_correct=False)
+        deadline = timezone.now() - timedelta(seconds=10)
+        ExamAttempt.objects.filter(id=attempt.id).update(deadline=deadline)
+        DraftAnswer.objects.create(enrollment=self.enrollment, choice=wrong)
+        DraftAnswer.objects.update(updated_at=deadline - timedelta(seconds=1))
+        # Saved after the deadline: not graded
+        DraftAnswer.objects.create(enrollment=self.enrollment, choice=self.choice)
+
+        response = self._submit(attempt.id)
+        submission = Submission.objects.get()
+        self.assertRedirects(response, reverse('onlinecourse:exam_result', args=[self.course.id, submission.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(list(submission.choices.all()), [wrong])
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.state, attempt.submission), (ExamAttempt.EXPIRED, submission))
+        self.assertIn('time limit', str(list(get_messages(response.wsgi_request))[0]))
+
+    def test_submit_without_open_attempt_is_rejected(self):
+        """Test a missing or already submitted attempt creates no submission and says why"""
+        response = self._submit('')
+        self.assertRedirects(response, reverse('onlinecourse:course_details', args=[self.course.id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(Submission.objects.count(), 0)
+        response = self.client.get(reverse('onlinecourse:course_details', args=[self.course.id]), secure=True)
+        self.assertContains(response, 'The time limit for this exam has passed')
+
+    def test_one_active_attempt_per_enrollment(self):
+        """Test the database rejects a second running attempt, and an overdue one doesn't block a restart"""
+        from datetime import timedelta
+        from django.db import IntegrityError, transaction
+        from .models import ExamAttempt
+
+        self._start()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExamAttempt.objects.create(enrollment=self.enrollment, course=self.course,
+                                       deadline=timezone.now() + timedelta(minutes=30))
+
+        ExamAttempt.objects.update(deadline=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._start().status_code, 302)
+        self.assertEqual(ExamAttempt.objects.filter(state=ExamAttempt.ACTIVE).count(), 1)
+        self.assertEqual(ExamAttempt.objects.filter(state=ExamAttempt.EXPIRED).count(), 1)
+
+    def test_active_attempt_cap(self):
+        """Test starts beyond max_active_attempts are shed with 503"""
+        self.course.max_active_attempts = 1
+        self.course.save()
+        other = User.objects.create_user(username='other', password='testpass123')
+        Enrollment.objects.create(user=other, course=self.course)
+        self._start()
+
+        self.client.login(username='other', password='testpass123')
+        response = self._start()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_sweep_attempts(self):
+        """Test the sweeper expires overdue attempts in batches"""
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ExamAttempt
+
+        past = timezone.now() - timedelta(minutes=1)
+        for number in range(3):
+            # One active attempt per enrollment
+            user = User.objects.create_user(username=f'overdue{number}', password='testpass123')
+            enrollment = Enrollment.objects.create(user=user, course=self.course)
+            ExamAttempt.objects.create(enrollment=enrollment, course=self.course, deadline=past)
+        current = ExamAttempt.objects.create(enrollment=self.enrollment, course=self.course,
+                                             deadline=timezone.now() + timedelta(minutes=10))
+
+        out = StringIO()
+        call_command('sweep_attempts', batch_size=2, stdout=out)
+        self.assertIn('Expired 3 attempt(s)', out.getvalue())
+        self.assertEqual(ExamAttempt.objects.filter(state=ExamAttempt.EXPIRED).count(), 3)
+        current.refresh_from_db()
+        self.assertEqual(current.state, ExamAttempt.ACTIVE)
+
+
+class AutosaveTest(TestCase):
+    """Test cases for autosaved draft answers"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='student',
+            password='testpass123'
+        )
+        self.course = Course.objects.create(
+            name='Test Course',
+            description='Test Description'
+        )
+        self.enrollment = Enrollment.objects.create(
+            user=self.user,
+            course=self.course
+        )
+        question = Question.objects.create(course=self.course, content='Test question', grade=10)
+        self.correct = Choice.objects.create(question=question, content='Right', is_correct=True)
+        self.wrong = Choice.objects.create(question=question, content='Wrong', is_correct=False)
+        self.client.login(username='student', password='testpass123')
+
+    def _autosave(self, selected=(), deselected=()):
+        return self.client.post(
+            reverse('onlinecourse:autosave', args=[self.course.id]),
+            json.dumps({'selected': list(selected), 'deselected': list(deselected)}),
+            content_type='application/json', secure=True
+        )
+
+    def _drafted(self):
+        from .models import DraftAnswer
+        return set(DraftAnswer.objects.filter(enrollment=self.enrollment, selected=True)
+                   .values_list('choice_id', flat=True))
+
+    def test_autosave_upserts_deltas(self):
+        """Test each autosave only changes the choices it names"""
+        self.assertEqual(self._autosave(selected=[self.correct.id, self.wrong.id]).json(), {'saved': 2})
+        self._autosave(deselected=[self.wrong.id])
+        self.assertEqual(self._drafted(), {self.correct.id})
+
+        from .models import DraftAnswer
+        self.assertEqual(DraftAnswer.objects.count(), 2)
+
+    def test_autosave_ignores_other_courses(self):
+        """Test choice ids from another course are not saved"""
+        other = Course.objects.create(name='Other', description='Other')
+        question = Question.objects.create(course=other, content='Other question')
+        foreign = Choice.objects.create(question=question, content='Foreign')
+
+        self.assertEqual(self._autosave(selected=[foreign.id]).json(), {'saved': 0})
+        self.assertEqual(self._autosave(selected=['x']).status_code, 400)
+
+    def test_autosave_requires_running_attempt(self):
+        """Test timed courses only autosave during an attempt"""
+        self.course.exam_duration = 30
+        self.course.save()
+        self.assertEqual(self._autosave(selected=[self.correct.id]).status_code, 409)
+
+    def test_course_detail_restores_drafts(self):
+        """Test the exam form is prefilled from saved drafts"""
+        self._autosave(selected=[self.correct.id])
+        response = self.client.get(reverse('onlinecourse:course_details', args=[self.course.id]), secure=True)
+        self.assertEqual(response.context['drafted'], {self.correct.id})
+        self.assertContains(response, f'value="{self.correct.id}" checked')
+
+    def test_autosave_pins_to_primary(self):
+        """Test an autosave keeps the learner's next page loads off the lagging replicas"""
+        from .routers import PIN_SESSION_KEY
+        self._autosave(selected=[self.correct.id])
+        self.assertIn(PIN_SESSION_KEY, self.client.session)
+
+    def test_submit_promotes_drafts(self):
+        """Test submitting with use_draft copies the draft into the submission and clears it"""
+        self._autosave(selected=[self.correct.id, self.wrong.id])
+        self._autosave(deselected=[self.wrong.id])
+
+        self.client.post(reverse('onlinecourse:submit', args=[self.course.id]),
+                         {'use_draft': '1'}, secure=True)
+        submission = Submission.objects.get()
+        self.assertEqual(list(submission.choices.values_list('id', flat=True)), [self.correct.id])
+        self.assertEqual(submission.compute_score(), 10)
+        self.assertEqual(self._drafted(), set())
+
+
+class CourseImportExportTest(TestCase):
+    """Test cases for the import_course and export_course commands"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='teacher', password='testpass123')
+        self.instructor = Instructor.objects.create(user=user, total_learners=0)
+        self.course = Course.objects.create(
+            name='Source Course',
+            description='Test Description',
+            exam_duration=45
+        )
+        self.course.instructors.add(self.instructor)
+        Lesson.objects.create(course=self.course, title='Intro', order=0, content='Hello')
+        from .models import QuestionPool
+        pool = QuestionPool.objects.create(course=self.course, name='Basics', sample_size=1)
+        for index in range(3):
+            question = Question.objects.create(course=self.course, content=f'Question {index}', grade=index,
+                                               pool=pool if index else None)
+            Choice.objects.create(question=question, content='Right', is_correct=True)
+            Choice.objects.create(question=question, content='Wrong', is_correct=False)
+
+    def _roundtrip(self, fmt):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+
+        path = os.path.join(tempfile.mkdtemp(), f'course.{fmt}')
+        call_command('export_course', self.course.id, output=path)
+        out = StringIO()
+        call_command('import_course', path, stdout=out)
+        self.assertIn('(3 questions)', out.getvalue())
+        return Course.objects.exclude(id=self.course.id).get()
+
+    def _assert_same(self, copy):
+        self.assertEqual(copy.name, 'Source Course')
+        self.assertEqual(copy.exam_duration, 45)
+        self.assertEqual(list(copy.instructors.all()), [self.instructor])
+        self.assertEqual(list(copy.lesson_set.values_list('title', 'content')), [('Intro', 'Hello')])
+        self.assertEqual(
+            list(copy.question_set.order_by('id').values_list('content', 'grade', 'pool__name')),
+            [('Question 0', 0, None), ('Question 1', 1, 'Basics'), ('Question 2', 2, 'Basics')]
+        )
+        self.assertEqual(Choice.objects.filter(question__course=copy, is_correct=True).count(), 3)
+        self.assertEqual(Choice.objects.filter(question__course=copy).count(), 6)
+
+    def test_json_roundtrip(self):
+        """Test a course exported as JSON imports as an identical copy"""
+        self._assert_same(self._roundtrip('json'))
+
+    def test_yaml_roundtrip(self):
+        """Test a course exported as YAML imports as an identical copy"""
+        self._assert_same(self._roundtrip('yaml'))
+
+    def test_import_query_count_is_constant(self):
+        """Test importing issues one insert per table, not one per row"""
+        from io import StringIO
+        from .course_io import export_course, import_course, load_course
+
+        stream = StringIO()
+        export_course(self.course, stream)
+        data = load_course(StringIO(stream.getvalue()))
+        data['questions'] *= 10
+        # instructors, savepoint, course, m2m set (2), lessons, pools, questions, choices, release
+        with self.assertNumQueries(10):
+            copy = import_course(data)
+        self.assertEqual(copy.question_set.count(), 30)
+
+    def test_import_rejects_unknown_instructor(self):
+        """Test an unknown instructor aborts the import without writing anything"""
+        from .course_io import CourseFormatError, import_course
+
+        with self.assertRaises(CourseFormatError):
+            import_course({'name': 'Bad', 'description': '', 'instructors': ['nobody']})
+        with self.assertRaises(CourseFormatError):
+            import_course({'name': 'Bad', 'description': '', 'questions': [{'content': 'Q', 'pool': 'missing'}]})
+        self.assertEqual(Course.objects.count(), 1)
+
+
+# The admin pages link static files, which aren't collected for tests
+ADMIN_TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=ADMIN_TEST_STORAGES)
+class AdminChangelistTest(TestCase):
+    """Test cases for the admin changelists of large tables"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.login(username='admin', password='testpass123')
+        self.course = Course.objects.create(name='Test Course', description='Test Description')
+        question = Question.objects.create(course=self.course, content='Test question')
+        Choice.objects.create(question=question, content='Answer')
+
+    def _add_submissions(self, count):
+        for index in range(count):
+            user = User.objects.create_user(username=f'learner{index}_{Submission.objects.count()}')
+            Learner.objects.create(user=user, social_link='https://example.com')
+            enrollment = Enrollment.objects.create(user=user, course=self.course)
+            Submission.objects.create(enrollment=enrollment)
+
+    def _changelist_queries(self, model_name):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:onlinecourse_{model_name}_changelist'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Test changelists follow foreign keys with joins instead of a query per row"""
+        self._add_submissions(1)
+        baseline = {name: self._changelist_queries(name) for name in ('submission', 'learner', 'choice')}
+        self._add_submissions(5)
+        for name, count in baseline.items():
+            self.assertEqual(self._changelist_queries(name), count, name)
+
+    def test_estimated_count_falls_back_to_exact_count(self):
+        """Test the paginator counts exactly where no estimate is available"""
+        from .paginators import EstimatedCountPaginator
+
+        self._add_submissions(3)
+        paginator = EstimatedCountPaginator(Submission.objects.order_by('id'), 2)
+        self.assertIsNone(paginator._estimated_count())
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+
+@override_settings(STORAGES=ADMIN_TEST_STORAGES)
+class BulkQuestionEditorTest(TestCase):
+    """Test cases for the admin bulk question editor"""
+
+    def setUp(self):
+        User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.login(username='admin', password='testpass123')
+        self.course = Course.objects.create(name='Test Course', description='Test Description')
+        self.url = reverse('admin:onlinecourse_course_questions', args=[self.course.id])
+        self._add_questions(2)
+
+    def _add_questions(self, count):
+        for index in range(count):
+            question = Question.objects.create(course=self.course, content=f'Question {index}', grade=10)
+            Choice.objects.create(question=question, content='Right', is_correct=True)
+            Choice.objects.create(question=question, content='Wrong', is_correct=False)
+
+    def _post_data(self, response):
+        """The editor's form as the browser would submit it unchanged."""
+        data = {}
+        for formset in (response.context['question_forms'], response.context['choice_forms']):
+            for name, field in formset.management_form.fields.items():
+                data[f'{formset.prefix}-{name}'] = formset.management_form.initial.get(name, field.initial)
+            for form in formset:
+                for name, value in form.initial.items():
+                    if name == 'is_correct':
+                        if value:
+                            data[form.add_prefix(name)] = 'on'
+                    elif name in form.fields:
+                        data[form.add_prefix(name)] = '' if value is None else value
+        return data
+
+    def test_editor_query_count_does_not_grow_with_questions(self):
+        """Test rendering a page issues the same queries for 2 or 20 questions"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(self.url, secure=True).status_code, 200)
+        self._add_questions(18)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url, secure=True)
+        self.assertContains(response, 'Question 17')
+        self.assertEqual(len(many), len(few))
+
+    def test_save_writes_changed_rows_once(self):
+        """Test saving updates only changed rows and invalidates the exam snapshot once"""
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        data = self._post_data(self.client.get(self.url, secure=True))
+        data['questions-1-content'] = 'Renamed'
+        data['choices-0-content'] = 'Still right'
+        with mock.patch('onlinecourse.admin.invalidate_exam_snapshot') as invalidate, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data, secure=True)
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        invalidate.assert_called_once_with(self.course.id)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "onlinecourse_')]
+        self.assertEqual(len(updates), 2)
+
+        self.assertEqual(list(Question.objects.order_by('id').values_list('content', flat=True)),
+                         ['Question 0', 'Renamed'])
+        self.assertEqual(Choice.objects.filter(content='Still right').count(), 1)
+
+    def test_stale_page_is_rejected(self):
+        """Test rows posted for a different page of questions are not saved"""
+        data = self._post_data(self.client.get(self.url, secure=True))
+        data['questions-0-id'] = Question.objects.order_by('id').last().id
+        data['questions-0-content'] = 'Overwritten'
+        response = self.client.post(self.url, data, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Question.objects.filter(content='Overwritten').exists())
+
+    def test_inline_save_invalidates_once(self):
+        """Test saving several choices in the admin invalidates the snapshot once"""
+        from unittest import mock
+        from .snapshots import deferred_invalidation
+
+        with mock.patch('onlinecourse.snapshots.invalidate') as invalidate, \
+                self.captureOnCommitCallbacks(execute=True):
+            with deferred_invalidation():
+                for choice in Choice.objects.all():
+                    choice.save()
+        invalidate.assert_called_once_with(f'exam:{self.course.id}')
+
+
+class CourseImageVariantsTest(TestCase):
+    """Test cases for resized course image variants"""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def _upload(self, name='cover.png', size=(800, 600)):
+        from io import BytesIO
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 255)).save(buffer, 'PNG')
+        return Course.objects.create(name='Pictured', description='Test Description',
+                                     image=SimpleUploadedFile(name, buffer.getvalue(), 'image/png'))
+
+    def test_upload_queues_variants(self):
+        """Test uploading an image queues one job that writes square, hashed variants"""
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from .jobs import run_pending
+        from .models import Job
+
+        course = self._upload()
+        self.assertEqual(Job.objects.filter(task='course_image_variants').count(), 1)
+        course.save()
+        self.assertEqual(Job.objects.filter(task='course_image_variants').count(), 1)
+        run_pending()
+
+        names = sorted(default_storage.listdir('course_images/variants')[1])
+        self.assertEqual(len(names), 4)
+        self.assertEqual({name.split('-')[1] for name in names}, {'240.jpg', '240.webp', '480.jpg', '480.webp'})
+        with default_storage.open('course_images/variants/' + names[0]) as variant:
+            self.assertEqual(Image.open(variant).size, (240, 240))
+
+    def test_identical_uploads_share_variants(self):
+        """Test variants are named by content, so re-uploads reuse them"""
+        from django.core.files.storage import default_storage
+        from .images import get_variants
+
+        first = get_variants(self._upload().image)
+        second = get_variants(self._upload().image)
+        self.assertEqual(first, second)
+        self.assertEqual(len(default_storage.listdir('course_images/variants')[1]), 4)
+
+    def test_course_list_renders_srcset(self):
+        """Test the catalog serves resized variants instead of the original"""
+        course = self._upload()
+        response = self.client.get(reverse('onlinecourse:index'), secure=True)
+        self.assertContains(response, '<source type="image/webp" srcset="/media/course_images/variants/')
+        self.assertContains(response, '480w')
+        self.assertNotContains(response, 'src="%s"' % course.image.url)
+        self.assertNotContains(response, '//course_images')
+
+    def test_unreadable_image_falls_back_to_original(self):
+        """Test an image Pillow can't read is linked as is"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        course = Course.objects.create(name='Broken', description='Test Description',
+                                       image=SimpleUploadedFile('broken.png', b'not an image'))
+        response = self.client.get(reverse('onlinecourse:index'), secure=True)
+        self.assertContains(response, 'src="%s"' % course.image.url)
+
+    def test_unreadable_image_failure_is_cached(self):
+        """Test an unreadable image is only opened once, not on every render"""
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from . import images
+
+        course = Course.objects.create(name='Broken', description='Test Description',
+                                       image=SimpleUploadedFile('broken.png', b'not an image'))
+        with mock.patch.object(images, 'generate_variants', wraps=images.generate_variants) as generate:
+            self.assertIsNone(images.get_variants(course.image))
+            self.assertIsNone(images.get_variants(course.image))
+        self.assertEqual(generate.call_count, 1)
+
+
+class MediaServingTest(TestCase):
+    """Test cases for serving uploaded media"""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def _write(self, name, content):
+        import os
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def _get(self, name, **headers):
+        response = self.client.get('/media/' + name, secure=True, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_storage_names_files_by_content(self):
+        """Test uploads get content-hashed names and identical uploads are stored once"""
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from .media import is_hashed
+
+        first = default_storage.save('course_images/logo.svg', ContentFile(b'<svg>' + b' ' * 500 + b'</svg>'))
+        second = default_storage.save('course_images/logo.svg', ContentFile(b'<svg>' + b' ' * 500 + b'</svg>'))
+        self.assertEqual(first, second)
+        self.assertTrue(is_hashed(first))
+        # Compressible types get a gzip sibling
+        self.assertTrue(default_storage.exists(first + '.gz'))
+
+    def test_cache_headers(self):
+        """Test hashed names are immutable and other names revalidate"""
+        self._write('course_images/cover.0123456789ab.png', b'hashed')
+        self._write('course_images/cover.png', b'plain')
+
+        response = self._get('course_images/cover.0123456789ab.png')
+        self.assertEqual(b''.join(response.streaming_content), b'hashed')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self._get('course_images/cover.png')['Cache-Control'], 'public, max-age=3600')
+
+        etag = response['ETag']
+        self.assertEqual(self._get('course_images/cover.0123456789ab.png', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_range_requests(self):
+        """Test single byte ranges are answered with 206 and bad ranges with 416"""
+        self._write('files/data.bin', bytes(range(100)))
+
+        response = self._get('files/data.bin', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self._get('files/data.bin', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(95, 100)))
+
+        response = self._get('files/data.bin', HTTP_RANGE='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        response = self._get('files/data.bin', HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_precompressed_variant(self):
+        """Test a .gz sibling is served to clients that accept gzip"""
+        import gzip
+        self._write('docs/notes.txt', b'plain text')
+        self._write('docs/notes.txt.gz', gzip.compress(b'plain text'))
+
+        response = self._get('docs/notes.txt', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'plain text')
+        self.assertNotIn('Content-Encoding', self._get('docs/notes.txt'))
+
+    def test_offload_to_web_server(self):
+        """Test x-accel-redirect mode hands the transfer to nginx"""
+        self._write('course_images/cover.png', b'image')
+        with override_settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            response = self._get('course_images/cover.png')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/course_images/cover.png')
+        self.assertEqual(response.content, b'')
+
+    def test_missing_and_traversal(self):
+        """Test unknown files and paths outside MEDIA_ROOT are 404s"""
+        self.assertEqual(self._get('nothing.png').status_code, 404)
+        self.assertEqual(self._get('../settings.py').status_code, 404)
+
+
+class ProfileStartupTest(TestCase):
+    """Test cases for the profile_startup command"""
+
+    def test_parse_importtime(self):
+        """Test -X importtime output is parsed into self and cumulative times"""
+        from .management.commands.profile_startup import parse_importtime
+
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |     _json',
+            'import time:      1500 |       1620 |   json',
+            'import time:        80 |       1700 | myproject',
+        ])
+        self.assertEqual(parse_importtime(output), [
+            ('_json', 120, 120, 2),
+            ('json', 1500, 1620, 1),
+            ('myproject', 80, 1700, 0),
+        ])
+
+
+class TemplateRenderingTest(TestCase):
+    """Test cases for the shared base template and template caching"""
+
+    def test_pages_share_navbar(self):
+        """Test the pages render the shared navbar with the login form"""
+        for url in [reverse('onlinecourse:index'), reverse('onlinecourse:login')]:
+            response = self.client.get(url, secure=True)
+            self.assertTemplateUsed(response, 'onlinecourse/base.html')
+            self.assertTemplateUsed(response, 'onlinecourse/partials/navbar.html')
+            self.assertContains(response, 'placeholder="Password" name="psw"')
+
+    def test_cached_loader_outside_debug(self):
+        """Test templates are loaded through the cached loader when DEBUG is off"""
+        from django.conf import settings
+        from django.template import engines
+
+        self.assertFalse(settings.DEBUG)
+        loaders = engines['django'].engine.template_loaders
+        self.assertEqual(len(loaders), 1)
+        self.assertEqual(type(loaders[0]).__module__, 'django.template.loaders.cached')
+
+    def test_warm_template_cache(self):
+        """Test warming compiles every page and shared template"""
+        from .rendering import PAGE_TEMPLATES, SHARED_TEMPLATES, warm_template_cache
+
+        self.assertEqual(warm_template_cache(), len(PAGE_TEMPLATES) + len(SHARED_TEMPLATES))
+
+    def test_benchmark_templates_command(self):
+        """Test the benchmark renders each template at each size"""
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('benchmark_templates', sizes='1,3', iterations=1, stdout=out)
+        output = out.getvalue()
+        for name in ['course_list', 'course_detail', 'exam_result']:
+            self.assertEqual(output.count('onlinecourse/%s_bootstrap.html' % name), 2)
+
+
+class RequestLoggingTest(TestCase):
+    """Test cases for structured request logging"""
+
+    def make_record(self, level=logging.INFO, **extra):
+        record = logging.LogRecord('onlinecourse.views', level, __file__, 1, 'Hello %s', ('world',), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        """Test records become one JSON object with extra fields at the top level"""
+        from .log import JsonFormatter
+
+        entry = json.loads(JsonFormatter().format(self.make_record(request_id='abc', user_id=7)))
+        self.assertEqual(entry['message'], 'Hello world')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['request_id'], 'abc')
+        self.assertEqual(entry['user_id'], 7)
+        self.assertNotIn('args', entry)
+
+    def test_request_id_and_access_log(self):
+        """Test each request gets an ID in the response and one timed access record"""
+        with self.assertLogs('onlinecourse.requests', level='INFO') as logs:
+            response = self.client.get(reverse('onlinecourse:index'), secure=True)
+        request_id = response['X-Request-ID']
+        self.assertRegex(request_id, r'^[0-9a-f]{32}$')
+        record = logs.records[0]
+        self.assertEqual(record.status, 200)
+        self.assertEqual(record.view, 'onlinecourse:index')
+        self.assertGreaterEqual(record.duration_ms, 0)
+
+        response = self.client.get(reverse('onlinecourse:index'), secure=True, HTTP_X_REQUEST_ID='proxy-id-1234')
+        self.assertEqual(response['X-Request-ID'], 'proxy-id-1234')
+        response = self.client.get(reverse('onlinecourse:index'), secure=True, HTTP_X_REQUEST_ID='bad id\n')
+        self.assertNotEqual(response['X-Request-ID'], 'bad id\n')
+
+    def test_debug_records_are_sampled(self):
+        """Test DEBUG records are kept only for sampled requests"""
+        from .log import RequestContextFilter, _request_context
+
+        log_filter = RequestContextFilter(sample_rate=0.0)
+        self.assertFalse(log_filter.filter(self.make_record(logging.DEBUG)))
+        self.assertTrue(log_filter.filter(self.make_record(logging.INFO)))
+        token = _request_context.set(('req-1', True))
+        try:
+            record = self.make_record(logging.DEBUG)
+            self.assertTrue(log_filter.filter(record))
+            self.assertEqual(record.request_id, 'req-1')
+        finally:
+            _request_context.reset(token)
+
+    def test_queue_handler_never_blocks(self):
+        """Test a full queue drops records instead of blocking the caller"""
+        from io import StringIO
+        from .log import QueueStreamHandler
+
+        stream = StringIO()
+        handler = QueueStreamHandler(stream=stream, queue_size=1)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler._ensure_listener()
+        handler._listener.stop()  # nothing drains the queue now
+        handler.handle(self.make_record())
+        handler.handle(self.make_record())
+        self.assertEqual(handler.dropped, 1)
+
+        handler._pid = None  # restart the writer
+        handler.handle(self.make_record())
+        handler.flush_and_stop()
+        self.assertEqual(stream.getvalue(), 'Hello world\n')
+        handler.close()
+
+
+class TracingTest(TestCase):
+    """Test cases for request tracing"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tracer', password='testpass123')
+        self.course = Course.objects.create(name='Traced', description='Traced course')
+        Enrollment.objects.create(user=self.user, course=self.course)
+        self.client.login(username='tracer', password='testpass123')
+
+    def traced_get(self, url, **extra):
+        """Request ``url`` with tracing on, exporting spans synchronously; return response and spans"""
+        import os
+        import tempfile
+        from unittest import mock
+        from django.conf import settings
+        from .tracing import ExportThread
+
+        path = tempfile.mkstemp(suffix='.jsonl')[1]
+        self.addCleanup(os.remove, path)
+        templates = [dict(settings.TEMPLATES[0], BACKEND='onlinecourse.tracing.DjangoTemplates')]
+        with override_settings(TRACING_ENABLED=True, TRACING_FILE=path, TRACING_SAMPLE_RATE=1.0,
+                               TEMPLATES=templates), \
+                mock.patch.object(ExportThread, 'submit', lambda thread, spans: thread.exporter.export(spans)):
+            response = self.client.get(url, secure=True, **extra)
+        with open(path) as f:
+            return response, [json.loads(line) for line in f]
+
+    def test_spans_for_view_queries_templates_and_cache(self):
+        """Test a traced request records view, SQL, template and cache spans in one trace"""
+        response, spans = self.traced_get(reverse('onlinecourse:course_details', args=(self.course.id,)))
+        self.assertEqual(response.status_code, 200)
+        names = [entry['name'] for entry in spans]
+        root = spans[-1]
+        self.assertEqual(root['name'], 'HTTP GET onlinecourse/<int:pk>/')
+        self.assertEqual(root['attributes']['http.status_code'], 200)
+        self.assertIn('view CourseDetailView', names)
+        self.assertIn('db.query', names)
+        self.assertIn('template.render', names)
+        self.assertIn('cache.get', names)
+        self.assertEqual({entry['traceId'] for entry in spans}, {root['traceId']})
+        span_ids = {entry['spanId'] for entry in spans}
+        for entry in spans[:-1]:
+            self.assertIn(entry['parentSpanId'], span_ids)
+        self.assertTrue(response['traceresponse'].startswith('00-%s-' % root['traceId']))
+
+    def test_continues_incoming_trace(self):
+        """Test a sampled traceparent header is continued and an unsampled one is not traced"""
+        trace_id, parent_id = 'a' * 32, 'b' * 16
+        response, spans = self.traced_get(reverse('onlinecourse:health_check'),
+                                          HTTP_TRACEPARENT='00-%s-%s-01' % (trace_id, parent_id))
+        self.assertEqual(spans[-1]['traceId'], trace_id)
+        self.assertEqual(spans[-1]['parentSpanId'], parent_id)
+
+        response, spans = self.traced_get(reverse('onlinecourse:health_check'),
+                                          HTTP_TRACEPARENT='00-%s-%s-00' % (trace_id, parent_id))
+        self.assertEqual(spans, [])
+        self.assertNotIn('traceresponse', response)
+
+    def test_disabled_tracing_is_a_noop(self):
+        """Test the middleware removes itself and spans are no-ops when tracing is off"""
+        from django.core.exceptions import MiddlewareNotUsed
+        from .tracing import NOOP_SPAN, TracingMiddleware, span
+
+        with self.assertRaises(MiddlewareNotUsed):
+            TracingMiddleware(lambda request: None)
+        self.assertIs(span('anything'), NOOP_SPAN)
+
+    def test_template_cache_warms_with_tracing_settings(self):
+        """Test the templates settings build with tracing on still warm the 'django' engine"""
+        import os
+        import runpy
+        from unittest import mock
+        from django.conf import settings
+        from .rendering import PAGE_TEMPLATES, SHARED_TEMPLATES, warm_template_cache
+
+        with mock.patch.dict(os.environ, {'TRACING_ENABLED': 'True'}):
+            traced_settings = runpy.run_path(os.path.join(settings.BASE_DIR, 'myproject', 'settings.py'))
+        templates = traced_settings['TEMPLATES']
+        self.assertEqual(templates[0]['BACKEND'], 'onlinecourse.tracing.DjangoTemplates')
+        with override_settings(TEMPLATES=templates):
+            self.assertEqual(warm_template_cache(), len(PAGE_TEMPLATES + SHARED_TEMPLATES))
+
+    def test_otlp_payload(self):
+        """Test spans are converted to OTLP/JSON with typed attributes"""
+        from .tracing import otlp_payload
+
+        payload = otlp_payload([{
+            'traceId': 'a' * 32, 'spanId': 'b' * 16, 'parentSpanId': '', 'name': 'db.query', 'kind': 3,
+            'startTimeUnixNano': 1, 'endTimeUnixNano': 2, 'status': {'code': 0},
+            'attributes': {'db.statement': 'SELECT 1', 'db.executemany': False, 'rows': 3},
+        }], 'onlinecourse')
+        resource_spans = payload['resourceSpans'][0]
+        self.assertEqual(resource_spans['resource']['attributes'][0]['value'], {'stringValue': 'onlinecourse'})
+        otlp_span = resource_spans['scopeSpans'][0]['spans'][0]
+        self.assertEqual(otlp_span['startTimeUnixNano'], '1')
+        self.assertEqual(otlp_span['attributes'], [
+            {'key': 'db.statement', 'value': {'stringValue': 'SELECT 1'}},
+            {'key': 'db.executemany', 'value': {'boolValue': False}},
+            {'key': 'rows', 'value': {'intValue': '3'}},
+        ])
+
+
+class RequestProfilingTest(TestCase):
+    """Test cases for on-demand request profiling"""
+
+    def setUp(self):
+        import tempfile
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(PROFILING_DIR=self.profile_dir, PROFILING_SAMPLE_INTERVAL=0.001)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.learner = User.objects.create_user(username='learner', password='testpass123')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_staff_query_parameter_records_cprofile(self):
+        """Test a staff ?_profile=cprofile request stores a loadable .prof file"""
+        import pstats
+        from .profiling import list_profiles, profile_path
+
+        self.client.login(username='staff', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:index') + '?_profile=cprofile', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/staff/profiles/', response['X-Profile'])
+        [(name, size, modified)] = list_profiles()
+        self.assertIn('-onlinecourse_index-', name)
+        self.assertTrue(name.endswith('.prof'))
+        pstats.Stats(profile_path(name))
+
+        download = self.client.get(response['X-Profile'].split(';')[0], secure=True)
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('attachment', download['Content-Disposition'])
+
+    def test_query_parameter_ignored_for_learners(self):
+        """Test non-staff users cannot trigger profiling or download profiles"""
+        from .profiling import list_profiles
+
+        self.client.login(username='learner', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:index') + '?_profile=cprofile', secure=True)
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(list_profiles(), [])
+        response = self.client.get(reverse('onlinecourse:profile_list'), secure=True)
+        self.assertEqual(response.status_code, 302)
+
+    def test_signed_header_records_collapsed_stacks(self):
+        """Test a signed header profiles with the sampler and a forged one is ignored"""
+        from .profiling import list_profiles, make_token, profile_path
+
+        response = self.client.get(reverse('onlinecourse:index'), secure=True, HTTP_X_PROFILE='sample:forged:sig')
+        self.assertNotIn('X-Profile', response)
+
+        response = self.client.get(reverse('onlinecourse:index'), secure=True, HTTP_X_PROFILE=make_token('sample'))
+        self.assertIn('X-Profile', response)
+        [(name, size, modified)] = list_profiles()
+        self.assertTrue(name.endswith('.collapsed'))
+        with open(profile_path(name)) as f:
+            for line in f:
+                self.assertRegex(line, r'^\S.*;.* \d+$')
+
+    def test_retention_limit(self):
+        """Test only the newest PROFILING_MAX_FILES profiles are kept"""
+        from .profiling import list_profiles, make_token
+
+        with override_settings(PROFILING_MAX_FILES=2):
+            for _ in range(3):
+                self.client.get(reverse('onlinecourse:health_check'), secure=True,
+                                HTTP_X_PROFILE=make_token('cprofile'))
+        self.assertEqual(len(list_profiles()), 2)
+
+    def test_download_rejects_other_paths(self):
+        """Test the download view only serves names of stored profiles"""
+        self.client.login(username='staff', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:download_profile', args=('..%2Fsettings.py',)), secure=True)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('onlinecourse:profile_list'), secure=True)
+        self.assertContains(response, 'No profiles have been recorded.')
+
+
+class SlowQueryLogTest(TestCase):
+    """Test cases for the slow query log"""
+
+    def setUp(self):
+        self.course = Course.objects.create(name='Indexed', description='Course')
+        self.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+
+    def test_normalize_and_fingerprint(self):
+        """Test statements differing only in values share a fingerprint"""
+        from .slowqueries import fingerprint, normalize
+
+        first = normalize('SELECT "t1"."id" FROM "t1" WHERE "t1"."name" = \'a\' AND "t1"."id" IN (%s, %s, %s) LIMIT 21')
+        second = normalize('SELECT "t1"."id" FROM "t1"  WHERE "t1"."name" = \'b\'\'c\' AND "t1"."id" IN (%s) LIMIT 5')
+        self.assertEqual(first, 'SELECT "t1"."id" FROM "t1" WHERE "t1"."name" = ? AND "t1"."id" IN (...) LIMIT ?')
+        self.assertEqual(fingerprint(first), fingerprint(second))
+        self.assertEqual(normalize('INSERT INTO "t" VALUES (%s, %s), (%s, %s)'), 'INSERT INTO "t" VALUES (...)')
+
+    def test_params_shape(self):
+        """Test only parameter types are described, never values"""
+        from .slowqueries import params_shape
+
+        self.assertEqual(params_shape((1, 'secret', [1, 2, 3], None)), 'int, str, list[3], NoneType')
+        self.assertEqual(params_shape([(1, 'a'), (2, 'b')], many=True), '2 x (int, str)')
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_queries_are_aggregated_with_plan(self):
+        """Test slow queries of a request are recorded per fingerprint with a plan and caller"""
+        from .models import SlowQuery
+
+        url = reverse('onlinecourse:course_details', args=(self.course.id,))
+        self.client.get(url, secure=True)
+        query = SlowQuery.objects.get(statement__contains='FROM "onlinecourse_course" WHERE')
+        self.assertEqual(query.calls, 1)
+        self.assertEqual(query.view, 'onlinecourse:course_details')
+        self.assertEqual(query.params_shape, 'int')
+        self.assertIn('onlinecourse_course', query.plan)
+        self.assertNotIn(str(self.course.id), query.statement)
+
+        self.client.get(url, secure=True)
+        query.refresh_from_db()
+        self.assertEqual(query.calls, 2)
+        self.assertGreaterEqual(query.total_ms, query.max_ms)
+        self.assertFalse(SlowQuery.objects.filter(statement__contains='onlinecourse_slowquery').exists())
+
+    def test_fast_queries_are_not_recorded(self):
+        """Test queries under the threshold leave no trace"""
+        from .models import SlowQuery
+
+        self.client.get(reverse('onlinecourse:course_details', args=(self.course.id,)), secure=True)
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_caller_location(self):
+        """Test the recorded location is the innermost frame in the app"""
+        from .slowqueries import _caller
+
+        def query_from_app():
+            return _caller()
+        # _caller skips its own frame and its caller's (the query wrapper)
+        self.assertRegex((lambda: query_from_app())(), r'^onlinecourse/tests\.py:\d+ in ')
+
+    def test_staff_page(self):
+        """Test the slow query page is staff only and lists recorded queries"""
+        from .models import SlowQuery
+
+        SlowQuery.objects.create(fingerprint='0' * 16, statement='SELECT ? FROM "x"', example='SELECT 1 FROM "x"',
+                                 database='default', view='onlinecourse:index', plan='SCAN x',
+                                 calls=4, total_ms=900, max_ms=400)
+        response = self.client.get(reverse('onlinecourse:slow_query_list'), secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username='staff', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:slow_query_list') + '?order=max', secure=True)
+        self.assertContains(response, 'SELECT ? FROM &quot;x&quot;')
+        self.assertContains(response, 'SCAN x')
+
+
+class LeaderboardTest(TestCase):
+    """Test cases for course leaderboards"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.course = Course.objects.create(name='Ranked', description='Course')
+        self.users = [User.objects.create_user(username='learner%d' % number, password='testpass123')
+                      for number in range(4)]
+
+    def record(self, user, score, minutes=0):
+        from datetime import timedelta
+        from .leaderboard import record_score
+        record_score(self.course.id, user.id, score, timezone.now() + timedelta(minutes=minutes))
+
+    def test_upsert_keeps_best_score(self):
+        """Test a learner's entry only ever moves up"""
+        from .models import LeaderboardEntry
+
+        self.record(self.users[0], 60)
+        self.record(self.users[0], 40)
+        self.assertEqual(LeaderboardEntry.objects.get().best_score, 60)
+        self.record(self.users[0], 90)
+        self.assertEqual(LeaderboardEntry.objects.get().best_score, 90)
+        self.assertEqual(LeaderboardEntry.objects.count(), 1)
+
+    def test_rank_is_an_indexed_count(self):
+        """Test ranks use competition ranking with one count query"""
+        from .leaderboard import get_rank
+
+        for user, score in zip(self.users, [80, 95, 80, 50]):
+            self.record(user, score)
+        with self.assertNumQueries(2):
+            self.assertEqual(get_rank(self.course.id, self.users[0].id), (2, 80))
+        self.assertEqual(get_rank(self.course.id, self.users[2].id), (2, 80))
+        self.assertEqual(get_rank(self.course.id, self.users[3].id), (4, 50))
+        self.assertIsNone(get_rank(self.course.id, User.objects.create_user(username='new').id))
+
+    def test_top_entries_are_cached(self):
+        """Test the top of the board shares ranks on ties and is served from the cache"""
+        from .leaderboard import top_entries
+
+        for index, (user, score) in enumerate(zip(self.users, [80, 95, 80, 50])):
+            self.record(user, score, minutes=index)
+        self.assertEqual(top_entries(self.course.id), [
+            {'rank': 1, 'username': 'learner1', 'score': 95},
+            {'rank': 2, 'username': 'learner0', 'score': 80},
+            {'rank': 2, 'username': 'learner2', 'score': 80},
+            {'rank': 4, 'username': 'learner3', 'score': 50},
+        ])
+        with self.assertNumQueries(0):
+            top_entries(self.course.id)
+
+    def test_grading_updates_leaderboard(self):
+        """Test the grading job records the learner's score"""
+        from .jobs import run_pending
+        from .leaderboard import get_rank
+
+        question = Question.objects.create(course=self.course, content='Q', grade=10)
+        choice = Choice.objects.create(question=question, content='A', is_correct=True)
+        enrollment = Enrollment.objects.create(user=self.users[0], course=self.course)
+        self.client.login(username='learner0', password='testpass123')
+        self.client.post(reverse('onlinecourse:submit', args=(self.course.id,)),
+                         {'choice_%d' % choice.id: choice.id}, secure=True)
+        self.assertIsNone(get_rank(self.course.id, enrollment.user_id))
+        run_pending()
+        self.assertEqual(get_rank(self.course.id, enrollment.user_id), (1, 10))
+
+    def test_leaderboard_page(self):
+        """Test the leaderboard page lists entries and the learner's own rank"""
+        self.record(self.users[1], 95)
+        self.record(self.users[0], 70)
+        self.client.login(username='learner0', password='testpass123')
+        response = self.client.get(reverse('onlinecourse:leaderboard', args=(self.course.id,)), secure=True)
+        self.assertContains(response, 'learner1')
+        self.assertContains(response, 'Your best score is 70, rank 2.')
+
+    def test_rebuild_leaderboard_command(self):
+        """Test the rebuild command fills the board from graded submissions"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import LeaderboardEntry
+
+        enrollment = Enrollment.objects.create(user=self.users[0], course=self.course)
+        for score in [30, 70, 50]:
+            Submission.objects.create(enrollment=enrollment, score=score, graded_at=timezone.now())
+        Submission.objects.create(enrollment=enrollment)
+        out = StringIO()
+        call_command('rebuild_leaderboard', stdout=out)
+        self.assertIn('Recorded 3 graded submissions', out.getvalue())
+        self.assertEqual(LeaderboardEntry.objects.get().best_score, 70)
@@ -0,0 +1,339 @@
+"""
+Request tracing with OpenTelemetry-compatible spans.
+
+With ``TRACING_ENABLED`` on, :class:`TracingMiddleware` starts a trace for
+a ``TRACING_SAMPLE_RATE`` fraction of requests (or continues the one in an
+incoming W3C ``traceparent`` header) and records spans for:
+
+* the request, and each view in ``views.py`` (:func:`traced_view`);
+* every SQL query, through ``connection.execute_wrapper()``;
+* template rendering, through :class:`DjangoTemplates` (the template
+  backend settings switch to when tracing is enabled);
+* cache calls on the tiered default cache.
+
+Finished traces are handed to a background thread and exported either as
+JSON lines to ``TRACING_FILE`` or as OTLP/JSON to a collector at
+``TRACING_OTLP_ENDPOINT``.
+
+Disabled, the middleware removes itself when the server starts, and
+:func:`span` only looks up a context variable and returns a shared no-op.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from django.utils.decorators import method_decorator
+
+logger = logging.getLogger(__name__)
+
+# The innermost open span of the trace being recorded, if any
+_current_span = ContextVar('tracing_current_span', default=None)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+MAX_STATEMENT_LENGTH = 2000
+EXPORT_QUEUE_SIZE = 1000
+# OTLP span kinds
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+
+def _new_id(bits):
+    return '%0*x' % (bits // 4, random.getrandbits(bits))
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'error', '_token')
+
+    def __init__(self, trace, parent_id, name, kind, attributes):
+        self.trace = trace
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = self.end_ns = 0
+        self.error = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc_value is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.trace.spans.append(self)
+        return False
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': self.attributes,
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 0},
+        }
+
+
+class Trace:
+    """The spans recorded for one request."""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or _new_id(128)
+        self.spans = []
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """
+    Return a context manager recording a child of the current span, or a
+    no-op outside a traced request.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, parent.span_id, name, kind, attributes)
+
+
+def _span_decorator(name, function_name):
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if _current_span.get() is None:
+                return view_func(request, *args, **kwargs)
+            with span(name, **{'code.function': function_name}):
+                return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def traced_view(view):
+    """Record a span around a view function, or a class-based view's ``dispatch()``."""
+    name = 'view %s' % view.__qualname__
+    decorator = _span_decorator(name, '%s.%s' % (view.__module__, view.__qualname__))
+    if isinstance(view, type):
+        view.dispatch = method_decorator(decorator)(view.dispatch)
+        return view
+    return decorator(view)
+
+
+def _sql_wrapper(alias, vendor):
+    def wrapper(execute, sql, params, many, context):
+        if _current_span.get() is None:
+            return execute(sql, params, many, context)
+        with span('db.query', KIND_CLIENT, **{
+            'db.system': vendor,
+            'db.name': alias,
+            'db.statement': sql[:MAX_STATEMENT_LENGTH],
+            'db.executemany': many,
+        }):
+            return execute(sql, params, many, context)
+    return wrapper
+
+
+class _TracedTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        with span('template.render', **{'template.name': self.origin.template_name}):
+            return self.template.render(context, request)
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """The Django template backend, with a span around each render."""
+
+    def from_string(self, template_code):
+        return _TracedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TracedTemplate(super().get_template(template_name))
+
+
+# Exporters, run in the export thread
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(spans, service_name):
+    """Build an OTLP/JSON ``ExportTraceServiceRequest`` body."""
+    otlp_spans = []
+    for entry in spans:
+        entry = dict(entry, startTimeUnixNano=str(entry['startTimeUnixNano']),
+                     endTimeUnixNano=str(entry['endTimeUnixNano']))
+        entry['attributes'] = [{'key': key, 'value': _otlp_value(value)}
+                               for key, value in entry['attributes'].items()]
+        otlp_spans.append(entry)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+        'scopeSpans': [{'scope': {'name': 'onlinecourse'}, 'spans': otlp_spans}],
+    }]}
+
+
+class FileExporter:
+    """Append spans to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, 'a') as f:
+            for entry in spans:
+                f.write(json.dumps(entry, default=str) + '\n')
+
+
+class OTLPExporter:
+    """POST spans as OTLP/JSON to a collector's ``/v1/traces`` endpoint."""
+
+    def __init__(self, endpoint, service_name, timeout=5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans):
+        body = json.dumps(otlp_payload(spans, self.service_name), default=str).encode()
+        request = urllib.request.Request(self.endpoint, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def get_exporter():
+    if settings.TRACING_EXPORTER == 'otlp':
+        return OTLPExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME)
+    return FileExporter(settings.TRACING_FILE)
+
+
+class ExportThread:
+    """
+    Export finished traces from a bounded queue in a background thread, so
+    a slow collector never holds up a response.  Traces that don't fit in
+    the queue are dropped.
+    """
+
+    def __init__(self, exporter, queue_size=EXPORT_QUEUE_SIZE):
+        self.exporter = exporter
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Started per process: a thread started before a fork doesn't run in the child
+                self.queue = queue.Queue(maxsize=self.queue_size)
+                threading.Thread(target=self._run, name='trace-export', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, spans):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            spans = self.queue.get()
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.warning('Exporting %d spans failed', len(spans), exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until everything submitted so far is exported."""
+        if self._pid == os.getpid():
+            self.queue.join()
+
+
+class TracingMiddleware:
+    """Record a trace for sampled requests."""
+
+    def __init__(self, get_response):
+        if not settings.TRACING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.exporter = ExportThread(get_exporter())
+
+    def __call__(self, request):
+        match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+        if match:
+            # Continue the caller's trace and follow its sampling decision
+            trace_id, parent_id, flags = match.groups()
+            sampled = int(flags, 16) & 1
+        else:
+            trace_id = parent_id = None
+            sampled = random.random() < settings.TRACING_SAMPLE_RATE
+        if not sampled:
+            return self.get_response(request)
+
+        trace = Trace(trace_id)
+        request.trace_id = trace.trace_id
+        root = Span(trace, parent_id, 'HTTP %s' % request.method, KIND_SERVER, {
+            'http.method': request.method,
+            'http.target': request.path,
+        })
+        with root, ExitStack() as stack:
+            for alias in settings.DATABASES:
+                connection = connections[alias]
+                stack.enter_context(connection.execute_wrapper(_sql_wrapper(alias, connection.vendor)))
+            response = self.get_response(request)
+            root.set_attribute('http.status_code', response.status_code)
+            if request.resolver_match:
+                root.name = 'HTTP %s %s' % (request.method, request.resolver_match.route)
+                root.set_attribute('http.route', request.resolver_match.route)
+        response['traceresponse'] = '00-%s-%s-01' % (trace.trace_id, root.span_id)
+        self.exporter.submit([recorded.to_dict() for recorded in trace.spans])
+        return response
@@ -1,7 +1,5 @@
 from django.urls import path
-from django.conf import settings
-from django.conf.urls.static import static
-from . import views
+from . import profiling, slowqueries, views
 
 app_name = 'onlinecourse'
 urlpatterns = [
@@ -13,17 +11,30 @@ urlpatterns = [
     # name the URL
     path(route='', view=views.CourseListView.as_view(), name='index'),
     path('registration/', views.registration_request, name='registration'),
+    path('registration/check-username/', views.check_username, name='check_username'),
     path('login/', views.login_request, name='login'),
     path('logout/', views.logout_request, name='logout'),
     # ex: /onlinecourse/5/
     path('<int:pk>/', views.CourseDetailView.as_view(), name='course_details'),
     # ex: /enroll/5/
     path('<int:course_id>/enroll/', views.enroll, name='enroll'),
+    # ex: /onlinecourse/5/exam/ (questions and choices as JSON, without answers)
+    path('<int:course_id>/exam/', views.exam_snapshot, name='exam_snapshot'),
+    path('<int:course_id>/exam/start/', views.start_exam, name='start_exam'),
+    path('<int:course_id>/exam/autosave/', views.autosave, name='autosave'),
 
     # <HINT> Create a route for submit view
     path('<int:course_id>/submit/', views.submit, name="submit"),
 
     # <HINT> Create a route for show_exam_result view
-    path('course/<int:course_id>/submission/<int:submission_id>/result', views.show_exam_result, name="exam_result")
+    path('course/<int:course_id>/submission/<int:submission_id>/result', views.show_exam_result, name="exam_result"),
+    # ex: /onlinecourse/5/leaderboard/
+    path('<int:course_id>/leaderboard/', views.leaderboard, name='leaderboard'),
 
- ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Staff only: request profiles recorded by ProfilingMiddleware
+    path('staff/profiles/', profiling.profile_list, name='profile_list'),
+    path('staff/profiles/<str:name>', profiling.download_profile, name='download_profile'),
+    # Staff only: queries recorded by SlowQueryMiddleware
+    path('staff/slow-queries/', slowqueries.slow_query_list, name='slow_query_list'),
+
+ ]
@@ -1,19 +1,34 @@
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, JsonResponse
-from django.db import connection
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+from django.db import IntegrityError, connection, transaction
+from django.db.models.functions import Now
 # <HINT> Import any new Models here
-from .models import Course, Enrollment, Question, Choice, Submission
+from .models import Course, DraftAnswer, Enrollment, ExamAttempt, Learner, Question, Choice, Submission
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
+from .jobs import enqueue
+from .leaderboard import get_rank, top_entries
+from .ratelimit import admission_control, ratelimit
+from .routers import pin_to_primary, read_from_replica
+from .snapshots import exam_for_enrollment, get_exam_snapshot
+from .tracing import traced_view
+import json
 import logging
+import uuid
+from datetime import timedelta
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 # Create your views here.
 
 
+@traced_view
 def health_check(request):
     """
     Health check endpoint for monitoring application status.
@@ -35,32 +50,58 @@ def health_check(request):
         return JsonResponse(health_status, status=503)
 
 
+@traced_view
+@ratelimit('ip')
+@admission_control('password_hashing')
 def registration_request(request):
     context = {}
     if request.method == 'GET':
         return render(request, 'onlinecourse/user_registration_bootstrap.html', context)
     elif request.method == 'POST':
-        # Check if user exists
-        username = request.POST['username']
+        # Stripped like check_username; create_user's checks are skipped below, so validate here
+        username = User.normalize_username(request.POST['username'].strip())
+        try:
+            if not username:
+                raise ValidationError('Please choose a username.')
+            User.username_validator(username)
+        except ValidationError as e:
+            context['message'] = ' '.join(e.messages)
+            return render(request, 'onlinecourse/user_registration_bootstrap.html', context)
         password = request.POST['psw']
         first_name = request.POST['firstname']
         last_name = request.POST['lastname']
-        user_exist = False
+        user = User(username=username, first_name=first_name, last_name=last_name)
+        # Hash before opening the transaction; it is by far the slowest step
+        user.set_password(password)
         try:
-            User.objects.get(username=username)
-            user_exist = True
-        except:
-            logger.error("New user")
-        if not user_exist:
-            user = User.objects.create_user(username=username, first_name=first_name, last_name=last_name,
-                                            password=password)
-            login(request, user)
-            return redirect("onlinecourse:index")
-        else:
+            with transaction.atomic():
+                user.save()
+                Learner.objects.create(user=user)
+        except IntegrityError:
+            # The unique index on username rejected an existing (or concurrently created) user
             context['message'] = "User already exists."
             return render(request, 'onlinecourse/user_registration_bootstrap.html', context)
+        logger.info('User registered', extra={'user_id': user.pk})
+        login(request, user)
+        pin_to_primary(request)
+        return redirect("onlinecourse:index")
+
 
+@traced_view
+@ratelimit('ip', methods=('GET',))
+def check_username(request):
+    username = request.GET.get('username', '').strip()
+    if not username:
+        return JsonResponse({'error': 'username is required'}, status=400)
+    username = User.normalize_username(username)
+    # Served by the unique index on auth_user.username
+    available = not User.objects.filter(username=username).exists()
+    return JsonResponse({'username': username, 'available': available})
 
+
+@traced_view
+@ratelimit('ip', 'username')
+@admission_control('password_hashing')
 def login_request(request):
     context = {}
     if request.method == "POST":
@@ -77,6 +118,7 @@ def login_request(request):
         return render(request, 'onlinecourse/user_login_bootstrap.html', context)
 
 
+@traced_view
 def logout_request(request):
     logout(request)
     return redirect('onlinecourse:index')
@@ -92,7 +134,18 @@ def check_if_enrolled(user, course):
     return is_enrolled
 
 
+def get_enrollment(user, course_id):
+    return Enrollment.objects.filter(user=user, course_id=course_id).first()
+
+
+def get_active_attempt(enrollment):
+    return ExamAttempt.objects.filter(
+        enrollment=enrollment, state=ExamAttempt.ACTIVE, deadline__gt=Now()).first()
+
+
 # CourseListView
+@traced_view
+@method_decorator(read_from_replica, name='dispatch')
 class CourseListView(generic.ListView):
     template_name = 'onlinecourse/course_list_bootstrap.html'
     context_object_name = 'course_list'
@@ -106,11 +159,143 @@ class CourseListView(generic.ListView):
         return courses
 
 
+@traced_view
+@method_decorator(read_from_replica, name='dispatch')
 class CourseDetailView(generic.DetailView):
     model = Course
     template_name = 'onlinecourse/course_detail_bootstrap.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # One token per rendered exam form; replayed POSTs of the same form
+        # resolve to the submission it already created.
+        context['submission_token'] = uuid.uuid4().hex
+        if self.request.user.is_authenticated:
+            enrollment = get_enrollment(self.request.user, self.object.id)
+            if self.object.exam_duration is not None:
+                # A timed exam is only shown once an attempt has been started
+                context['attempt'] = enrollment and get_active_attempt(enrollment)
+                if not context['attempt']:
+                    return context
+            context['exam'] = exam_for_enrollment(get_exam_snapshot(self.object.id), enrollment)
+            # Answers autosaved before a reload are ticked again.  Read from the
+            # primary: a use_draft submit promotes the primary's drafts, so the
+            # form must show exactly those.
+            context['drafted'] = set(DraftAnswer.objects.using('default').filter(
+                enrollment=enrollment, selected=True).values_list('choice_id', flat=True)) if enrollment else set()
+        return context
+
+
+@traced_view
+@read_from_replica
+def exam_snapshot(request, course_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+    course = Course.objects.filter(pk=course_id).only('exam_duration').first()
+    if course is None:
+        return JsonResponse({'error': 'course not found'}, status=404)
+    enrollment = get_enrollment(request.user, course_id)
+    if enrollment is None:
+        return JsonResponse({'error': 'not enrolled'}, status=403)
+    # Same gate as the course page: a timed exam is only shown during an attempt
+    if course.exam_duration is not None and get_active_attempt(enrollment) is None:
+        return JsonResponse({'error': 'no running exam attempt'}, status=409)
+    return JsonResponse(exam_for_enrollment(get_exam_snapshot(course_id), enrollment))
+
+
+@traced_view
+def start_exam(request, course_id):
+    if not request.user.is_authenticated:
+        return redirect('onlinecourse:login')
+    details = HttpResponseRedirect(reverse(viewname='onlinecourse:course_details', args=(course_id,)))
+    if request.method != 'POST':
+        return details
+    course = get_object_or_404(Course, pk=course_id)
+    enrollment = get_enrollment(request.user, course_id)
+    if enrollment is None or course.exam_duration is None:
+        return details
+
+    try:
+        with transaction.atomic():
+            # Serialise starts of this course's exam, so concurrent starts can't overrun the cap
+            Course.objects.select_for_update().filter(pk=course.pk).exists()
+            active = ExamAttempt.objects.filter(course=course, state=ExamAttempt.ACTIVE, deadline__gt=Now())
+            if active.filter(enrollment=enrollment).exists():
+                # Already running; carry on with it
+                return details
+            if course.max_active_attempts is not None and active.count() >= course.max_active_attempts:
+                response = HttpResponse('Too many learners are taking this exam right now, please try again '
+                                        'shortly.', status=503, content_type='text/plain')
+                response['Retry-After'] = str(EXAM_FULL_RETRY_AFTER)
+                return response
+            # Only one attempt per enrollment may be active; close an overdue one the sweeper hasn't yet
+            ExamAttempt.objects.filter(enrollment=enrollment, state=ExamAttempt.ACTIVE,
+                                       deadline__lte=Now()).update(state=ExamAttempt.EXPIRED)
+            ExamAttempt.objects.create(enrollment=enrollment, course=course,
+                                       deadline=timezone.now() + timedelta(minutes=course.exam_duration))
+    except IntegrityError:
+        # A concurrent start for this learner won; carry on with its attempt
+        pass
+    pin_to_primary(request)
+    return details
+
 
+@traced_view
+@ratelimit('user')
+def autosave(request, course_id):
+    """
+    Save the choices ticked or unticked since the last autosave.
+
+    Expects a JSON body ``{"selected": [choice ids], "deselected": [choice ids]}``
+    and upserts one draft row per changed choice.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'authentication required'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    enrollment = get_enrollment(request.user, course_id)
+    if enrollment is None:
+        return JsonResponse({'error': 'not enrolled'}, status=403)
+    if enrollment.course.exam_duration is not None and get_active_attempt(enrollment) is None:
+        return JsonResponse({'error': 'no running exam attempt'}, status=409)
+    try:
+        delta = json.loads(request.body)
+        changes = {int(choice_id): True for choice_id in delta.get('selected', [])}
+        changes.update({int(choice_id): False for choice_id in delta.get('deselected', [])})
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'invalid autosave payload'}, status=400)
+
+    # Ignore ids that aren't choices of this course
+    valid = Choice.objects.filter(id__in=changes, question__course_id=course_id).values_list('id', flat=True)
+    drafts = [DraftAnswer(enrollment=enrollment, choice_id=choice_id, selected=changes[choice_id])
+              for choice_id in valid]
+    DraftAnswer.objects.bulk_create(drafts, update_conflicts=True, unique_fields=['enrollment', 'choice'],
+                                    update_fields=['selected', 'updated_at'])
+    pin_to_primary(request)
+    return JsonResponse({'saved': len(drafts)})
+
+
+def promote_drafts(submission, saved_by=None):
+    """
+    Copy the selected draft answers into the submission's choices with one
+    INSERT ... SELECT; with ``saved_by``, only drafts saved by that time.
+    """
+    field = Submission.choices.field
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO {through} ({submission_column}, {choice_column}) ' \
+          'SELECT %s, choice_id FROM {drafts} WHERE enrollment_id = %s AND selected = %s'
+    params = [submission.id, submission.enrollment_id, True]
+    if saved_by is not None:
+        sql += ' AND updated_at <= %s'
+        params.append(connection.ops.adapt_datetimefield_value(saved_by))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql.format(through=qn(field.m2m_db_table()), submission_column=qn(field.m2m_column_name()),
+                       choice_column=qn(field.m2m_reverse_name()), drafts=qn(DraftAnswer._meta.db_table)),
+            params)
+
+
+@traced_view
 def enroll(request, course_id):
     course = get_object_or_404(Course, pk=course_id)
     user = request.user
@@ -121,10 +306,19 @@ def enroll(request, course_id):
         Enrollment.objects.create(user=user, course=course, mode='honor')
         course.total_enrollment += 1
         course.save()
+        pin_to_primary(request)
 
     return HttpResponseRedirect(reverse(viewname='onlinecourse:course_details', args=(course.id,)))
 
 
+SUBMISSION_TOKEN_LENGTH = 64
+EXAM_FULL_RETRY_AFTER = 60
+
+
+class AttemptClosed(Exception):
+    pass
+
+
 # <HINT> Create a submit view to create an exam submission record for a course enrollment,
 # you may implement it based on following logic:
          # Get user and course object, then get the associated enrollment object created when the user enrolled the course
@@ -132,6 +326,8 @@ def enroll(request, course_id):
          # Collect the selected choices from exam form
          # Add each selected choice object to the submission object
          # Redirect to show_exam_result with the submission id
+@traced_view
+@ratelimit('user')
 def submit(request, course_id):
     if not request.user.is_authenticated:
         return redirect('onlinecourse:login')
@@ -146,11 +342,64 @@ def submit(request, course_id):
         # Redirect to course detail if not enrolled
         return HttpResponseRedirect(reverse(viewname='onlinecourse:course_details', args=(course.id,)))
     
-    submission = Submission.objects.create(enrollment=enrollment)
-    choice_ids = extract_answers(request)
-    if choice_ids:
-        choices = Choice.objects.filter(id__in=choice_ids)
-        submission.choices.set(choices)
+    token = request.POST.get('submission_token') or None
+    if token is not None and len(token) > SUBMISSION_TOKEN_LENGTH:
+        return HttpResponseBadRequest('Invalid submission token.', content_type='text/plain')
+    if token is not None:
+        # A double-clicked or replayed form: send the user to the result it already produced
+        submission_id = Submission.objects.filter(
+            enrollment=enrollment, idempotency_key=token).values_list('id', flat=True).first()
+        if submission_id is not None:
+            return HttpResponseRedirect(reverse(viewname='onlinecourse:exam_result', args=(course_id, submission_id)))
+
+    late_deadline = None
+    try:
+        with transaction.atomic():
+            submission = Submission.objects.create(enrollment=enrollment, idempotency_key=token)
+            if course.exam_duration is not None:
+                attempt_id = request.POST.get('attempt_id', '')
+                attempts = ExamAttempt.objects.filter(
+                    pk=int(attempt_id) if attempt_id.isdigit() else None, enrollment=enrollment)
+                # The deadline is checked by the database, in the same statement that closes the attempt
+                closed = attempts.filter(state=ExamAttempt.ACTIVE, deadline__gte=Now()).update(
+                    state=ExamAttempt.SUBMITTED, submission=submission)
+                if not closed:
+                    # Too late for the posted form; grade what was autosaved before the deadline
+                    late = attempts.filter(state__in=[ExamAttempt.ACTIVE, ExamAttempt.EXPIRED],
+                                           submission__isnull=True, deadline__lt=Now())
+                    late_deadline = late.values_list('deadline', flat=True).first()
+                    if late_deadline is None or not late.update(state=ExamAttempt.EXPIRED, submission=submission):
+                        raise AttemptClosed()
+            if late_deadline is not None:
+                promote_drafts(submission, saved_by=late_deadline)
+            elif request.POST.get('use_draft'):
+                # The page autosaved every answer; only the token was posted
+                promote_drafts(submission)
+            else:
+                choice_ids = extract_answers(request)
+                if choice_ids:
+                    choices = Choice.objects.filter(id__in=choice_ids)
+                    submission.choices.set(choices)
+            DraftAnswer.objects.filter(enrollment=enrollment).delete()
+            # Grading happens in the background worker
+            enqueue('grade_submission', {'submission_id': submission.id},
+                    idempotency_key='grade_submission:%d' % submission.id)
+    except IntegrityError:
+        # A concurrent duplicate of this POST committed first, unless the
+        # error came from another constraint: then there is nothing to find
+        submission = token and Submission.objects.filter(enrollment=enrollment, idempotency_key=token).first()
+        if submission is None:
+            raise
+    except AttemptClosed:
+        # No running attempt, or one that was already submitted
+        messages.error(request, 'The time limit for this exam has passed, so your answers could not be submitted.')
+        return HttpResponseRedirect(reverse(viewname='onlinecourse:course_details', args=(course.id,)))
+    if late_deadline is not None:
+        messages.warning(request, 'The time limit for this exam passed before you submitted. '
+                                  'The answers saved before the deadline were graded.')
+    logger.debug('Exam submitted', extra={'submission_id': submission.id, 'course_id': course.id,
+                                          'from_draft': bool(request.POST.get('use_draft'))})
+    pin_to_primary(request)
     submission_id = submission.id
     return HttpResponseRedirect(reverse(viewname='onlinecourse:exam_result', args=(course_id, submission_id)))
 
@@ -172,20 +421,33 @@ def extract_answers(request):
         # Get the selected choice ids from the submission record
         # For each selected choice, check if it is a correct answer or not
         # Calculate the total score
+@traced_view
+@read_from_replica
 def show_exam_result(request, course_id, submission_id):
     context = {}
     course = get_object_or_404(Course, pk=course_id)
-    submission = Submission.objects.get(id=submission_id)
+    submission = Submission.objects.select_related('enrollment').get(id=submission_id)
     choices = submission.choices.all()
-    total_score = 0
-    questions = course.question_set.all()  # Assuming course has related questions
-    for question in questions:
-        correct_choices = question.choice_set.filter(is_correct=True)  # Get all correct choices for the question
-        selected_choices = choices.filter(question=question)  # Get the user's selected choices for the question
-        # Check if the selected choices are the same as the correct choices
-        if set(correct_choices) == set(selected_choices):
-            total_score += question.grade  # Add the question's grade only if all correct answers are selected
+    # Use the grade from the background job, or grade now if it hasn't run yet
+    total_score = submission.score
+    if total_score is None:
+        total_score = submission.compute_score()
+    # Only the questions this learner was asked, with their choices in one extra query
+    questions = course.question_set.order_by('id').prefetch_related('choice_set')
+    if submission.enrollment.exam_question_ids is not None:
+        questions = questions.filter(id__in=submission.enrollment.exam_question_ids)
     context['course'] = course
+    context['questions'] = questions
     context['grade'] = total_score
     context['choices'] = choices
-    return render(request, 'onlinecourse/exam_result_bootstrap.html', context)
\ No newline at end of file
+    return render(request, 'onlinecourse/exam_result_bootstrap.html', context)
+
+
+@traced_view
+@read_from_replica
+def leaderboard(request, course_id):
+    course = get_object_or_404(Course, pk=course_id)
+    context = {'course': course, 'entries': top_entries(course.id)}
+    if request.user.is_authenticated:
+        context['own_rank'] = get_rank(course.id, request.user.id)
+    return render(request, 'onlinecourse/leaderboard_bootstrap.html', context)
@@ -10,7 +10,6 @@ echo "========================================"
 
 # Create necessary directories
 echo "Creating required directories..."
-mkdir -p logs
 mkdir -p staticfiles
 mkdir -p media
 
@@ -76,25 +75,20 @@ echo "========================================"
 echo "Starting Gunicorn server..."
 echo "========================================"
 
-# Use PORT environment variable if available (Azure, Heroku set this)
-PORT=${PORT:-8000}
-WORKERS=${WORKERS:-2}
-TIMEOUT=${TIMEOUT:-120}
+# Workers, threads and timeouts come from gunicorn.conf.py, which reads
+# PORT, WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_TIMEOUT, ...
+export PORT=${PORT:-8000}
+if [ ! -z "$WORKERS" ]; then
+    export WEB_CONCURRENCY=$WORKERS
+fi
+if [ ! -z "$TIMEOUT" ]; then
+    export GUNICORN_TIMEOUT=$TIMEOUT
+fi
 
 echo "Configuration:"
 echo "  Port: $PORT"
-echo "  Workers: $WORKERS"
-echo "  Timeout: $TIMEOUT seconds"
-echo "  Worker Class: gevent"
+echo "  Workers: ${WEB_CONCURRENCY:-auto}"
+echo "  Worker Class: ${GUNICORN_WORKER_CLASS:-gthread}"
 echo ""
 
-exec gunicorn myproject.wsgi:application \
-    --bind=0.0.0.0:$PORT \
-    --workers=$WORKERS \
-    --worker-class=gthread \
-    --threads=2 \
-    --timeout=$TIMEOUT \
-    --access-logfile=- \
-    --error-logfile=- \
-    --log-level=info \
-    --capture-output
+exec gunicorn --config gunicorn.conf.py